@@ -0,0 +1,367 @@
+# e2e_bench.py
+"""
+Benchmark end-to-end: src.main:app (uvicorn, osobny proces) + lokalny broker MQTT (mqtt_broker.py)
++ lokalny serwer SMTP (smtp_sink.py). Wszystko na localhost, bez zewnętrznych usług.
+
+Uruchomienie (z katalogu backend):
+    python bench/e2e_bench.py --out results/base.json
+    python bench/e2e_bench.py --out results/new.json --baseline results/base.json
+
+Mierzy:
+- REST: przepustowość i p50/p99 dla POST /auth/login, GET /devices, GET/POST /devices/{hw_uid}/state
+- komendy MQTT: ile komend/s dociera do brokera (POST /devices/batch/state, potokowo)
+- alarm -> mail: od publikacji doorlock/<hw_uid>/alarm/state "1" do odbioru maila przez SMTP
+
+Aplikacja dostaje MQTT_TLS=0 i SMTP_STARTTLS=0 (lokalne usługi bez TLS), świeżą bazę SQLite
+i log w katalogu roboczym. Wynik: JSON na stdout (i do --out); z --baseline także różnice.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from login_bench import _percentiles
+from mqtt_broker import LocalBroker
+from smtp_sink import SmtpSink, free_port
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "bench-password"
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end backend benchmark")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500, help="żądań na każdą trasę REST")
+    parser.add_argument("--logins", type=int, default=100, help="żądań POST /auth/login")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=10, help="BCRYPT_ROUNDS")
+    parser.add_argument("--batch-rounds", type=int, default=5, help="ile razy każdy user wysyła batch komend")
+    parser.add_argument("--alarms", type=int, default=200)
+    parser.add_argument("--alarm-rate", type=float, default=50.0, help="alarmów na sekundę")
+    parser.add_argument("--timeout", type=float, default=60.0, help="limit czekania na komendy/maile (s)")
+    parser.add_argument("--out", default=None, help="plik na wynik JSON")
+    parser.add_argument("--baseline", default=None, help="wcześniejszy wynik JSON do porównania")
+    return parser.parse_args()
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _seed(args: argparse.Namespace) -> list[tuple[str, int]]:
+    """Użytkownicy bench<i> i urządzenia bench-<n> (urządzenie n -> user n % users). Zwraca (hw_uid, user)."""
+    from passlib.hash import bcrypt
+    from sqlalchemy import insert, select
+
+    from src.db import engine, init_db
+    from src.models import Device, User
+
+    init_db()
+    password_hash = bcrypt.using(rounds=args.rounds).hash(PASSWORD)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"username": f"bench{i}", "email": f"bench{i}@example.com", "password_hash": password_hash}
+            for i in range(args.users)
+        ])
+        ids = dict(conn.execute(select(User.username, User.id_user)).all())
+        devices = [(f"bench-{n:05d}", n % args.users) for n in range(args.devices)]
+        conn.execute(insert(Device), [
+            {"name": hw_uid, "hw_uid": hw_uid, "id_user": ids[f"bench{user}"]} for hw_uid, user in devices
+        ])
+    engine.dispose()
+    return devices
+
+
+async def _load(client, total: int, concurrency: int, make_request) -> dict:
+    """total żądań z `concurrency` równoległymi klientami; make_request(i) -> (metoda, url, kwargs)."""
+    latency: list[float] = []
+    statuses: dict[int, int] = {}
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for i in counter:
+            method, url, kwargs = make_request(i)
+            t0 = time.monotonic()
+            r = await client.request(method, url, **kwargs)
+            latency.append(time.monotonic() - t0)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    return {
+        "requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(total / elapsed, 2) if elapsed else None,
+        "status_codes": statuses,
+        "latency": _percentiles(latency),
+    }
+
+
+async def _wait_for(predicate, timeout: float, what: str) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"timeout: {what}")
+        await asyncio.sleep(0.05)
+
+
+class _CommandCounter:
+    """Subskrybent doorlock/+/cmd - liczy komendy, które faktycznie dotarły do brokera."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.last_at = 0.0
+
+    async def run(self, client) -> None:
+        await client.subscribe("doorlock/+/cmd", qos=0)
+        async for _ in client.messages:
+            self.count += 1
+            self.last_at = time.monotonic()
+
+
+async def _run(args: argparse.Namespace, app_url: str, broker: LocalBroker, sink: SmtpSink,
+               devices: list[tuple[str, int]], app: subprocess.Popen) -> dict:
+    import aiomqtt
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=app_url, timeout=30, limits=limits) as client:
+
+        async def app_ready() -> bool:
+            try:
+                return (await client.get("/openapi.json")).status_code == 200
+            except httpx.TransportError:
+                return False
+
+        deadline = time.monotonic() + args.timeout
+        while not await app_ready():
+            if app.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("aplikacja nie wystartowała - patrz app.log")
+            await asyncio.sleep(0.2)
+        # listener połączony = subskrypcja alarmów widoczna w brokerze
+        await _wait_for(lambda: "doorlock/+/alarm/state" in broker.subscriptions(), args.timeout, "listener")
+
+        tokens = []
+        for i in range(args.users):
+            r = await client.post("/auth/login", json={"login": f"bench{i}", "password": PASSWORD})
+            r.raise_for_status()
+            tokens.append({"Authorization": f"Bearer {r.json()['access_token']}"})
+
+        def owner(n: int) -> tuple[str, dict]:
+            hw_uid, user = devices[n % len(devices)]
+            return hw_uid, tokens[user]
+
+        rest = {
+            "login": await _load(client, args.logins, args.concurrency, lambda i: (
+                "POST", "/auth/login", {"json": {"login": f"bench{i % args.users}", "password": PASSWORD}}
+            )),
+            "devices_list": await _load(client, args.requests, args.concurrency, lambda i: (
+                "GET", "/devices", {"headers": tokens[i % args.users]}
+            )),
+        }
+
+        def state_get(i: int):
+            hw_uid, headers = owner(i)
+            return "GET", f"/devices/{hw_uid}/state", {"headers": headers}
+
+        def state_post(i: int):
+            hw_uid, headers = owner(i)
+            return "POST", f"/devices/{hw_uid}/state", {
+                "headers": headers, "json": {"state": "open" if i % 2 else "closed"},
+            }
+
+        rest["state_get"] = await _load(client, args.requests, args.concurrency, state_get)
+
+        async with aiomqtt.Client("127.0.0.1", broker.port) as observer:
+            counter = _CommandCounter()
+            counter_task = asyncio.create_task(counter.run(observer))
+            await _wait_for(lambda: "doorlock/+/cmd" in broker.subscriptions(), 10, "cmd observer")
+
+            rest["state_post"] = await _load(client, args.requests, args.concurrency, state_post)
+
+            # --- przepustowość komend: batch na wszystkie urządzenia usera, kilka rund ---
+            by_user: dict[int, list[str]] = {}
+            for hw_uid, user in devices:
+                by_user.setdefault(user, []).append(hw_uid)
+            # komendy z fazy state_post jeszcze mogą dochodzić - nie liczymy ich do batchy
+            ok_posts = rest["state_post"]["status_codes"].get(200, 0)
+            try:
+                await _wait_for(lambda: counter.count >= ok_posts, 10, "state_post commands")
+            except RuntimeError:
+                pass
+            counter.count = 0
+            expected = len(devices) * args.batch_rounds
+
+            async def send_batches(user: int, hw_uids: list[str]) -> None:
+                for r in range(args.batch_rounds):
+                    items = [{"hw_uid": h, "state": "open" if r % 2 else "closed"} for h in hw_uids]
+                    await client.post("/devices/batch/state", headers=tokens[user], json={"items": items})
+
+            started = time.monotonic()
+            await asyncio.gather(*(send_batches(u, h) for u, h in by_user.items()))
+            try:
+                await _wait_for(lambda: counter.count >= expected, args.timeout, "batch commands")
+            except RuntimeError:
+                pass
+            elapsed = (counter.last_at or time.monotonic()) - started
+            commands = {
+                "expected": expected,
+                "received": counter.count,
+                "elapsed_s": round(elapsed, 3),
+                "per_s": round(counter.count / elapsed, 2) if elapsed > 0 else None,
+            }
+            counter_task.cancel()
+
+        # --- alarm -> mail ---
+        sent: deque[tuple[str, float]] = deque()
+        async with aiomqtt.Client("127.0.0.1", broker.port) as device:
+            started = time.monotonic()
+            for i, (hw_uid, _) in zip(range(args.alarms), itertools.cycle(devices)):
+                # równe tempo: i-ty alarm nie wcześniej niż i / rate od startu
+                delay = started + i / args.alarm_rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sent.append((hw_uid, time.monotonic()))
+                await device.publish(f"doorlock/{hw_uid}/alarm/state", "1", qos=1)
+        try:
+            await _wait_for(lambda: sink.stats()["received"] >= args.alarms, args.timeout, "alarm emails")
+        except RuntimeError:
+            pass
+
+        latency, missing = [], 0
+        for hw_uid, sent_at in sent:
+            arrived = sink.pop_arrival(hw_uid)
+            if arrived is None:
+                missing += 1
+            else:
+                latency.append(arrived - sent_at)
+        alarms = {
+            "sent": len(sent),
+            "emails": sink.stats(),
+            "missing": missing,
+            "latency": _percentiles(latency),
+        }
+
+        metrics_text = (await client.get("/metrics")).text
+
+    return {"rest": rest, "commands": commands, "alarm_to_email": alarms, "metrics_text": metrics_text}
+
+
+def _compare(result: dict, baseline: dict) -> dict:
+    """Względna zmiana (nowy / stary - 1) kluczowych liczb; dla opóźnień ujemna = lepiej."""
+
+    def rel(new, old):
+        return round(new / old - 1, 4) if new is not None and old else None
+
+    out = {}
+    for name, cur in result["rest"].items():
+        old = baseline.get("rest", {}).get(name)
+        if old:
+            out[f"rest.{name}.rps"] = rel(cur["rps"], old["rps"])
+            for key in ("p50_ms", "p99_ms"):
+                out[f"rest.{name}.{key}"] = rel(cur["latency"].get(key), old["latency"].get(key))
+    out["commands.per_s"] = rel(result["commands"]["per_s"], baseline.get("commands", {}).get("per_s"))
+    old_alarm = baseline.get("alarm_to_email", {}).get("latency", {})
+    for key in ("p50_ms", "p99_ms"):
+        out[f"alarm_to_email.{key}"] = rel(result["alarm_to_email"]["latency"].get(key), old_alarm.get(key))
+    return out
+
+
+def main() -> None:
+    args = _parse_args()
+    workdir = tempfile.mkdtemp(prefix="e2e-bench-")
+
+    broker = LocalBroker()
+    broker.start()
+    sink = SmtpSink()
+    sink.start()
+    app_port = free_port()
+
+    # konfiguracja przed importem src (moduły czytają env przy imporcie) - ta sama dla procesu aplikacji
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "MQTT_HOST": "127.0.0.1",
+        "MQTT_PORT": str(broker.port),
+        "MQTT_TLS": "0",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(sink.port),
+        "SMTP_USER": "bench@example.com",
+        "SMTP_PASS": "bench",
+        "SMTP_STARTTLS": "0",
+        "BCRYPT_ROUNDS": str(args.rounds),
+        # każdy alarm ma dać mail, bez składania w digest
+        "ALARM_DEBOUNCE_SECONDS": "0",
+        # obciążenie idzie z jednego IP / na tych samych userów
+        "LOGIN_RATE_LIMIT": "0",
+        "REFRESH_MAX_SESSIONS": "0",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    devices = _seed(args)
+
+    log_path = os.path.join(workdir, "app.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1",
+             "--port", str(app_port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=os.environ.copy(), stdout=log, stderr=subprocess.STDOUT,
+        )
+        try:
+            measured = asyncio.run(_run(args, f"http://127.0.0.1:{app_port}", broker, sink, devices, app))
+        finally:
+            app.terminate()
+            try:
+                app.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                app.kill()
+            broker.stop()
+            sink.stop()
+
+    with open(os.path.join(workdir, "metrics.txt"), "w", encoding="utf-8") as f:
+        f.write(measured.pop("metrics_text"))
+
+    result = {
+        "benchmark": "e2e",
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workdir": workdir,
+        },
+        "params": {
+            k: getattr(args, k)
+            for k in ("users", "devices", "requests", "logins", "concurrency", "rounds",
+                      "batch_rounds", "alarms", "alarm_rate")
+        },
+        **measured,
+        "broker": broker.stats(),
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            result["vs_baseline"] = _compare(result, json.load(f))
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+# fleet_sim.py
+"""
+Symulator floty zamków do testów skali (10k+ urządzeń).
+
+- zakłada N wirtualnych urządzeń w bazie (paczkami, istniejące hw_uid pomija) i przypisuje je do
+  --users użytkowników sim<i>@example.com
+- łączy urządzenia z brokerem przez kilka połączeń MQTT (--connections), każde obsługuje swoją
+  część floty: subskrybuje doorlock/<hw_uid>/cmd i /alarm, odpowiada ackiem i nowym stanem
+- generuje ruch alarm/state wg profilu:
+    steady    stałe tempo --rate wiadomości/s na całą flotę
+    burst     tło --rate + co --burst-every s paczka --burst-size alarmów naraz
+    flapping  tło --rate + --flap-devices urządzeń przełącza stan/alarm --flap-hz razy na sekundę
+- co --report-s wypisuje, jak backend nadąża: wysłane vs odebrane przez listener (/metrics),
+  kolejka alarmów, maile, opóźnienie alarm -> mail; na końcu JSON (--out)
+
+Lokalnie, bez zewnętrznych usług (broker i SMTP w tym procesie):
+    python bench/fleet_sim.py --local --devices 10000 --profile burst --duration 120
+    # w drugim terminalu backend z wypisanymi przez symulator zmiennymi (MQTT_TLS=0, SMTP_STARTTLS=0 ...)
+
+Maile (opóźnienie, zgubione, duplikaty) są liczone tylko z --local (serwer SMTP symulatora).
+Przy ALARM_DEBOUNCE_SECONDS > 0 powtórzenia w oknie idą jednym digestem - "missing" to wtedy
+alarmy złożone do digestu, a nie zgubione.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from collections import Counter, deque
+from typing import Optional
+
+from login_bench import _percentiles
+from mqtt_broker import LocalBroker
+from smtp_sink import SmtpSink
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_METRIC_LINE = re.compile(r'^(\w+)(?:\{([^}]*)\})? ([0-9.eE+-]+|NaN|\+Inf)$')
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Virtual doorlock fleet simulator")
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--prefix", default="sim-", help="prefiks hw_uid wirtualnych urządzeń")
+    parser.add_argument("--no-provision", action="store_true", help="urządzenia już są w bazie")
+    parser.add_argument("--connections", type=int, default=4, help="połączenia MQTT na całą flotę")
+    parser.add_argument("--host", default=os.getenv("MQTT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    parser.add_argument("--local", action="store_true", help="broker i serwer SMTP w tym procesie")
+    parser.add_argument("--smtp-port", type=int, default=2525, help="port serwera SMTP przy --local")
+    parser.add_argument("--profile", choices=["steady", "burst", "flapping"], default="steady")
+    parser.add_argument("--rate", type=float, default=200.0, help="wiadomości/s (tło) na całą flotę")
+    parser.add_argument("--alarm-ratio", type=float, default=0.1, help="jaka część ruchu tła to alarmy")
+    parser.add_argument("--burst-every", type=float, default=10.0)
+    parser.add_argument("--burst-size", type=int, default=1000)
+    parser.add_argument("--flap-devices", type=int, default=50)
+    parser.add_argument("--flap-hz", type=float, default=5.0)
+    parser.add_argument("--ack-delay-ms", type=float, default=20.0)
+    parser.add_argument("--ack-loss", type=float, default=0.0, help="jaka część komend zostaje bez acka")
+    parser.add_argument("--duration", type=float, default=60.0, help="czas generowania ruchu (s)")
+    parser.add_argument("--drain", type=float, default=30.0, help="ile czekać po ruchu na maile/listener (s)")
+    parser.add_argument("--report-s", type=float, default=5.0)
+    parser.add_argument("--api-url", default=None, help="np. http://127.0.0.1:8011 - odczyt /metrics")
+    parser.add_argument("--metrics-token", default=os.getenv("METRICS_TOKEN"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="plik na wynik JSON")
+    return parser.parse_args()
+
+
+def provision(devices: list[str], users: int, chunk: int = 1000) -> int:
+    """Zakłada brakujące urządzenia i userów symulatora. Zwraca liczbę nowych urządzeń."""
+    from passlib.hash import bcrypt
+    from sqlalchemy import insert, select
+
+    from src.db import engine, init_db
+    from src.models import Device, User
+
+    init_db()
+    with engine.begin() as conn:
+        names = [f"sim{i}" for i in range(users)]
+        have = set(conn.execute(select(User.username).where(User.username.in_(names))).scalars())
+        missing = [n for n in names if n not in have]
+        if missing:
+            password_hash = bcrypt.hash("sim-password")
+            conn.execute(insert(User), [
+                {"username": n, "email": f"{n}@example.com", "password_hash": password_hash} for n in missing
+            ])
+        ids = dict(conn.execute(select(User.username, User.id_user).where(User.username.in_(names))).all())
+
+    created = 0
+    for start in range(0, len(devices), chunk):
+        part = devices[start:start + chunk]
+        with engine.begin() as conn:
+            have = set(conn.execute(select(Device.hw_uid).where(Device.hw_uid.in_(part))).scalars())
+            rows = [
+                {"name": hw_uid, "hw_uid": hw_uid, "id_user": ids[f"sim{(start + i) % users}"]}
+                for i, hw_uid in enumerate(part)
+                if hw_uid not in have
+            ]
+            if rows:
+                conn.execute(insert(Device), rows)
+                created += len(rows)
+    engine.dispose()
+    return created
+
+
+class FleetStats:
+    def __init__(self) -> None:
+        self.sent = Counter()  # alarm / state / ack
+        self.commands = 0
+        self.acks_dropped = 0
+        # alarmy czekające na mail: hw_uid -> czasy wysłania
+        self.alarms_pending: dict[str, deque[float]] = {}
+        self.alarm_latency: list[float] = []
+        self.duplicate_emails = 0
+
+    def alarm_sent(self, hw_uid: str) -> None:
+        self.sent["alarm"] += 1
+        self.alarms_pending.setdefault(hw_uid, deque()).append(time.monotonic())
+
+    def match_emails(self, sink: SmtpSink) -> None:
+        """Dopasowuje maile z serwera SMTP do wysłanych alarmów (FIFO per urządzenie)."""
+        for hw_uid, pending in self.alarms_pending.items():
+            while True:
+                arrived = sink.pop_arrival(hw_uid)
+                if arrived is None:
+                    break
+                if pending:
+                    self.alarm_latency.append(arrived - pending.popleft())
+                else:
+                    # więcej maili niż alarmów dla urządzenia
+                    self.duplicate_emails += 1
+
+    def missing_emails(self) -> int:
+        return sum(len(p) for p in self.alarms_pending.values())
+
+
+class VirtualConnection:
+    """Jedno połączenie MQTT obsługujące część floty."""
+
+    def __init__(self, index: int, devices: list[str], args: argparse.Namespace, stats: FleetStats) -> None:
+        self.index = index
+        self.devices = devices
+        self.args = args
+        self.stats = stats
+        self.is_open = {hw_uid: False for hw_uid in devices}
+        self.client = None
+
+    async def run(self, stop: asyncio.Event) -> None:
+        import aiomqtt
+
+        async with aiomqtt.Client(
+            self.args.host, self.args.port, identifier=f"fleet-sim-{self.index}", max_queued_outgoing_messages=100_000
+        ) as client:
+            for start in range(0, len(self.devices), 200):
+                topics = []
+                for hw_uid in self.devices[start:start + 200]:
+                    topics += [(f"doorlock/{hw_uid}/cmd", 1), (f"doorlock/{hw_uid}/alarm", 1)]
+                await client.subscribe(topics)
+            self.client = client
+            receiver = asyncio.create_task(self._receive(client))
+            await stop.wait()
+            receiver.cancel()
+
+    async def _receive(self, client) -> None:
+        async for msg in client.messages:
+            parts = msg.topic.value.split("/")
+            if parts[-1] != "cmd":
+                continue  # /alarm - komenda alarmu, zamek tylko ją przyjmuje
+            self.stats.commands += 1
+            asyncio.create_task(self._ack(parts[1], msg.payload.decode("utf-8", errors="ignore")))
+
+    async def _ack(self, hw_uid: str, payload: str) -> None:
+        await asyncio.sleep(self.args.ack_delay_ms / 1000)
+        if random.random() < self.args.ack_loss:
+            self.stats.acks_dropped += 1
+            return
+        cid = None
+        if payload.startswith("{"):
+            try:
+                data = json.loads(payload)
+                cid, payload = data.get("cid"), str(data.get("cmd", ""))
+            except ValueError:
+                pass
+        self.is_open[hw_uid] = payload == "1"
+        ack = json.dumps({"cid": cid, "status": "ok"}) if cid else "1"
+        await self.publish(f"doorlock/{hw_uid}/ack", ack, "ack")
+        await self.publish(f"doorlock/{hw_uid}/state", "open" if self.is_open[hw_uid] else "closed", "state")
+
+    async def publish(self, topic: str, payload: str, kind: str) -> None:
+        await self.client.publish(topic, payload, qos=1)
+        if kind != "alarm":
+            self.stats.sent[kind] += 1
+
+    async def alarm(self, hw_uid: str) -> None:
+        self.stats.alarm_sent(hw_uid)
+        await self.publish(f"doorlock/{hw_uid}/alarm/state", "1", "alarm")
+
+    async def toggle_state(self, hw_uid: str) -> None:
+        self.is_open[hw_uid] = not self.is_open[hw_uid]
+        await self.publish(f"doorlock/{hw_uid}/state", "open" if self.is_open[hw_uid] else "closed", "state")
+
+
+class TrafficGenerator:
+    def __init__(self, connections: list[VirtualConnection], args: argparse.Namespace) -> None:
+        self.connections = connections
+        self.args = args
+        # urządzenie -> jego połączenie
+        self.owner = {hw_uid: conn for conn in connections for hw_uid in conn.devices}
+        self.devices = list(self.owner)
+
+    async def _emit(self, hw_uid: str, alarm: bool) -> None:
+        conn = self.owner[hw_uid]
+        await (conn.alarm(hw_uid) if alarm else conn.toggle_state(hw_uid))
+
+    async def run(self, duration: float) -> None:
+        tasks = [self._background(duration)]
+        if self.args.profile == "burst":
+            tasks.append(self._bursts(duration))
+        elif self.args.profile == "flapping":
+            tasks.append(self._flapping(duration))
+        await asyncio.gather(*tasks)
+
+    async def _background(self, duration: float) -> None:
+        # tempo trzymane względem startu - spóźnione wiadomości są doganiane, nie gubione
+        started = time.monotonic()
+        emitted = 0
+        while (now := time.monotonic()) - started < duration:
+            due = int((now - started) * self.args.rate) - emitted
+            if due > 0:
+                await asyncio.gather(*(
+                    self._emit(random.choice(self.devices), random.random() < self.args.alarm_ratio)
+                    for _ in range(due)
+                ))
+                emitted += due
+            await asyncio.sleep(0.01)
+
+    async def _bursts(self, duration: float) -> None:
+        started = time.monotonic()
+        while time.monotonic() - started + self.args.burst_every < duration:
+            await asyncio.sleep(self.args.burst_every)
+            burst = random.sample(self.devices, min(self.args.burst_size, len(self.devices)))
+            await asyncio.gather(*(self._emit(hw_uid, True) for hw_uid in burst))
+
+    async def _flapping(self, duration: float) -> None:
+        flappers = self.devices[: self.args.flap_devices]
+        started = time.monotonic()
+        tick = 0
+        while time.monotonic() - started < duration:
+            # na przemian: zmiana stanu i alarm - typowy "drgający" czujnik
+            alarm = tick % 2 == 1
+            await asyncio.gather(*(self._emit(hw_uid, alarm) for hw_uid in flappers))
+            tick += 1
+            await asyncio.sleep(1 / self.args.flap_hz)
+
+
+async def _scrape_metrics(args: argparse.Namespace) -> dict:
+    """Wybrane liczniki z /metrics backendu: {nazwa: suma po etykietach} + wiadomości listenera per kind."""
+    if not args.api_url:
+        return {}
+    import httpx
+
+    headers = {"Authorization": f"Bearer {args.metrics_token}"} if args.metrics_token else {}
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            text = (await client.get(f"{args.api_url.rstrip('/')}/metrics", headers=headers)).text
+    except httpx.HTTPError:
+        return {}
+
+    out: dict = {"listener": {}}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        if name == "mqtt_listener_messages_total":
+            kind = re.search(r'kind="([^"]*)"', labels or "").group(1)
+            out["listener"][kind] = float(value)
+        elif name in ("alarm_queue_depth", "mqtt_listener_reconnects_total", "device_event_log_dropped_total",
+                      "device_event_log_buffered", "command_ack_pending"):
+            out[name] = out.get(name, 0) + float(value)
+    return out
+
+
+def _report(stats: FleetStats, metrics: dict, sink: Optional[SmtpSink], elapsed: float) -> dict:
+    sent_total = sum(stats.sent.values())
+    report = {
+        "elapsed_s": round(elapsed, 1),
+        "sent": dict(stats.sent),
+        "commands_received": stats.commands,
+        "acks_dropped": stats.acks_dropped,
+    }
+    if metrics:
+        received = sum(metrics["listener"].values())
+        report["listener_received"] = metrics["listener"]
+        # lag listenera: wysłane przez flotę, a jeszcze nie przeczytane przez backend
+        report["listener_backlog"] = int(sent_total - received)
+        report.update({k: v for k, v in metrics.items() if k != "listener"})
+    if sink is not None:
+        stats.match_emails(sink)
+        report["emails"] = sink.stats()
+        report["emails_missing"] = stats.missing_emails()
+        report["emails_duplicate"] = stats.duplicate_emails
+        report["alarm_to_email"] = _percentiles(stats.alarm_latency)
+    return report
+
+
+async def _run(args: argparse.Namespace, devices: list[str], broker: Optional[LocalBroker],
+               sink: Optional[SmtpSink]) -> dict:
+    stats = FleetStats()
+    # podział floty jak w backendzie (crc32) - stabilny między uruchomieniami
+    shards: list[list[str]] = [[] for _ in range(args.connections)]
+    for hw_uid in devices:
+        shards[zlib.crc32(hw_uid.encode()) % args.connections].append(hw_uid)
+    connections = [VirtualConnection(i, shard, args, stats) for i, shard in enumerate(shards) if shard]
+
+    stop = asyncio.Event()
+    conn_tasks = [asyncio.create_task(c.run(stop)) for c in connections]
+    await asyncio.sleep(0)
+    started = time.monotonic()
+    while any(c.client is None for c in connections):
+        if any(t.done() for t in conn_tasks):
+            await asyncio.gather(*conn_tasks)  # błąd połączenia -> wyjątek tutaj
+        await asyncio.sleep(0.1)
+    print(f"[SIM] {len(devices)} devices on {len(connections)} connections ready "
+          f"({time.monotonic() - started:.1f}s)", flush=True)
+
+    if broker is not None:
+        print("[SIM] waiting for the backend listener (doorlock/+/alarm/state)...", flush=True)
+        while not any(f.endswith("/alarm/state") for f in broker.subscriptions()):
+            await asyncio.sleep(0.5)
+
+    base_metrics = await _scrape_metrics(args)
+    generator = TrafficGenerator(connections, args)
+    started = time.monotonic()
+
+    async def reporter() -> None:
+        while True:
+            await asyncio.sleep(args.report_s)
+            metrics = _diff_metrics(await _scrape_metrics(args), base_metrics)
+            report = _report(stats, metrics, sink, time.monotonic() - started)
+            print(f"[SIM] {json.dumps(report)}", flush=True)
+
+    report_task = asyncio.create_task(reporter())
+    await generator.run(args.duration)
+    print(f"[SIM] traffic done, draining up to {args.drain}s...", flush=True)
+
+    deadline = time.monotonic() + args.drain
+    while time.monotonic() < deadline:
+        if sink is not None:
+            stats.match_emails(sink)
+            if not stats.missing_emails():
+                break
+        await asyncio.sleep(0.5)
+
+    report_task.cancel()
+    final = _report(stats, _diff_metrics(await _scrape_metrics(args), base_metrics), sink, time.monotonic() - started)
+    stop.set()
+    await asyncio.gather(*conn_tasks, return_exceptions=True)
+    if broker is not None:
+        final["broker"] = broker.stats()
+    return final
+
+
+def _diff_metrics(current: dict, base: dict) -> dict:
+    """Liczniki listenera od startu symulacji (backend mógł już coś przetworzyć wcześniej)."""
+    if not current:
+        return current
+    out = dict(current)
+    out["listener"] = {k: v - base.get("listener", {}).get(k, 0) for k, v in current["listener"].items()}
+    return out
+
+
+def main() -> None:
+    args = _parse_args()
+    random.seed(args.seed)
+    devices = [f"{args.prefix}{n:06d}" for n in range(args.devices)]
+    sys.path.insert(0, BACKEND_DIR)
+
+    if not args.no_provision:
+        started = time.monotonic()
+        created = provision(devices, args.users)
+        print(f"[SIM] provisioned {created} new devices ({time.monotonic() - started:.1f}s)", flush=True)
+
+    broker = sink = None
+    if args.local:
+        broker = LocalBroker(port=args.port)
+        broker.start()
+        sink = SmtpSink(port=args.smtp_port)
+        sink.start()
+        print("[SIM] local services up - start the backend with:", flush=True)
+        print(f"    MQTT_HOST=127.0.0.1 MQTT_PORT={broker.port} MQTT_TLS=0 "
+              f"SMTP_HOST=127.0.0.1 SMTP_PORT={sink.port} SMTP_STARTTLS=0 SMTP_USER=sim SMTP_PASS=sim", flush=True)
+
+    try:
+        result = asyncio.run(_run(args, devices, broker, sink))
+    finally:
+        if broker is not None:
+            broker.stop()
+        if sink is not None:
+            sink.stop()
+
+    result["params"] = {k: v for k, v in vars(args).items() if k not in ("metrics_token", "out")}
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# login_bench.py
+"""
+Benchmark przepustowości /auth/login (bcrypt we własnej puli).
+
+Uruchomienie (z katalogu backend):
+    python bench/login_bench.py --logins 200 --concurrency 32 --executor process
+    python bench/login_bench.py --executor thread --rounds 10 --seed-rounds 12   # + przeliczanie hashy
+
+Aplikacja działa w procesie (httpx ASGITransport) na tymczasowej bazie SQLite.
+Równolegle do logowań co --probe-ms idzie GET /auth/me - jego opóźnienie pokazuje,
+czy burza logowań blokuje resztę API. Wynik: JSON na stdout (i do --out).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+
+    def pick(q: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 2)
+
+    return {
+        "count": len(values),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Login throughput benchmark")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=200, help="łączna liczba logowań")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument("--workers", type=int, default=None, help="HASH_WORKERS (domyślnie jak w aplikacji)")
+    parser.add_argument("--rounds", type=int, default=10, help="BCRYPT_ROUNDS - docelowy koszt")
+    parser.add_argument("--seed-rounds", type=int, default=None, help="koszt hashy startowych (inny = rehash przy logowaniu)")
+    parser.add_argument("--probe-ms", type=float, default=20.0, help="co ile ms GET /auth/me (0 = bez)")
+    parser.add_argument("--out", default=None, help="plik na wynik JSON")
+    return parser.parse_args()
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    import httpx
+    from fastapi import FastAPI
+    from passlib.hash import bcrypt
+
+    from src.auth.password_hasher import password_hasher
+    from src.auth.security import create_access_token
+    from src.db import SessionLocal, async_engine, init_db
+    from src.models import User
+    from src.routers.router import router as auth_router
+
+    init_db()
+    password = "bench-password"
+    seed_hash = bcrypt.using(rounds=args.seed_rounds or args.rounds).hash(password)
+    with SessionLocal() as db:
+        users = [
+            User(username=f"bench{i}", email=f"bench{i}@example.com", password_hash=seed_hash)
+            for i in range(args.users)
+        ]
+        db.add_all(users)
+        db.commit()
+        probe_token = create_access_token(users[0].id_user)
+
+    app = FastAPI()
+    app.include_router(auth_router)
+
+    started = time.monotonic()
+    await asyncio.to_thread(password_hasher.start)
+    startup_s = time.monotonic() - started
+
+    login_latency: list[float] = []
+    probe_latency: list[float] = []
+    statuses: dict[int, int] = {}
+    counter = iter(range(args.logins))
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+
+        async def login_worker() -> None:
+            for i in counter:
+                t0 = time.monotonic()
+                r = await client.post("/auth/login", json={"login": f"bench{i % args.users}", "password": password})
+                login_latency.append(time.monotonic() - t0)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        async def probe() -> None:
+            headers = {"Authorization": f"Bearer {probe_token}"}
+            while not done.is_set():
+                t0 = time.monotonic()
+                await client.get("/auth/me", headers=headers)
+                probe_latency.append(time.monotonic() - t0)
+                await asyncio.sleep(args.probe_ms / 1000)
+
+        probe_task = asyncio.create_task(probe()) if args.probe_ms > 0 else None
+        t_start = time.monotonic()
+        await asyncio.gather(*(login_worker() for _ in range(args.concurrency)))
+        elapsed = time.monotonic() - t_start
+        done.set()
+        if probe_task is not None:
+            await probe_task
+
+    hasher_stats = password_hasher.stats()
+    await asyncio.to_thread(password_hasher.shutdown)
+    await async_engine.dispose()
+
+    return {
+        "benchmark": "login",
+        "params": {
+            "users": args.users,
+            "logins": args.logins,
+            "concurrency": args.concurrency,
+            "executor": args.executor,
+            "workers": hasher_stats["workers"],
+            "bcrypt_rounds": args.rounds,
+            "seed_rounds": args.seed_rounds or args.rounds,
+        },
+        "pool_startup_s": round(startup_s, 3),
+        "elapsed_s": round(elapsed, 3),
+        "logins_per_s": round(args.logins / elapsed, 2) if elapsed else None,
+        "status_codes": statuses,
+        "login_latency": _percentiles(login_latency),
+        "me_latency_under_load": _percentiles(probe_latency),
+        "hasher": hasher_stats,
+    }
+
+
+def main() -> None:
+    args = _parse_args()
+
+    # konfiguracja przed importem src (moduły czytają env przy imporcie)
+    workdir = tempfile.mkdtemp(prefix="login-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["HASH_EXECUTOR"] = args.executor
+    if args.workers:
+        os.environ["HASH_WORKERS"] = str(args.workers)
+    # ten benchmark mierzy logowania, nie limit sesji
+    os.environ.setdefault("REFRESH_MAX_SESSIONS", "0")
+    # wszystkie logowania idą z jednego "klienta" - limit prób by je uciął
+    os.environ.setdefault("LOGIN_RATE_LIMIT", "0")
+    sys.path.insert(0, BACKEND_DIR)
+
+    result = asyncio.run(_run(args))
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    # spawn (pula procesów bcrypt) importuje ten plik ponownie - bez strażnika odpaliłby benchmark
+    main()
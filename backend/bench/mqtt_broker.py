@@ -0,0 +1,243 @@
+# mqtt_broker.py
+"""
+Minimalny broker MQTT 3.1.1 do benchmarków i symulatora floty - tylko localhost, bez TLS i auth.
+
+Obsługuje: CONNECT, SUBSCRIBE/UNSUBSCRIBE (+ i #, $share/<grupa>/<filtr> round-robin),
+PUBLISH QoS0/QoS1 (PUBACK do nadawcy), PINGREQ, DISCONNECT.
+Do subskrybentów wiadomości idą zawsze z QoS0 - broker nic nie kolejkuje ani nie ponawia,
+więc zgubienie wiadomości przez backend widać w wynikach, a nie ukrywa go broker.
+
+Samodzielnie:
+    python bench/mqtt_broker.py --port 1883
+"""
+import argparse
+import asyncio
+import itertools
+import struct
+import threading
+from typing import Optional
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    p_parts = pattern.split("/")
+    t_parts = topic.split("/")
+    for i, part in enumerate(p_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts) or (part != "+" and part != t_parts[i]):
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+def _encode_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def _packet(ptype: int, flags: int, body: bytes) -> bytes:
+    return bytes([(ptype << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _utf8(data: bytes, pos: int) -> tuple[str, int]:
+    (length,) = struct.unpack_from("!H", data, pos)
+    pos += 2
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+class _Session:
+    __slots__ = ("writer", "client_id", "filters")
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.client_id = ""
+        self.filters: dict[str, Optional[str]] = {}  # filtr -> grupa $share (albo None)
+
+    def send(self, data: bytes) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class LocalBroker:
+    """Broker w wątku z własną pętlą: start() -> port, stop(). Liczniki w stats()."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self._sessions: set[_Session] = set()
+        self._groups: dict[tuple[str, str], itertools.count] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+        self.connections = 0
+        self.received = 0
+        self.delivered = 0
+        self.unrouted = 0
+
+    # --- cykl życia ---
+
+    def start(self) -> int:
+        self._thread = threading.Thread(target=self._run, name="bench-mqtt-broker", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.port
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for session in list(self._sessions):
+                session.writer.close()
+            self._loop.close()
+
+    def subscriptions(self) -> list[str]:
+        return [f for s in list(self._sessions) for f in s.filters]
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "sessions": len(self._sessions),
+            "received": self.received,
+            "delivered": self.delivered,
+            "unrouted": self.unrouted,
+        }
+
+    # --- protokół ---
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = _Session(writer)
+        self._sessions.add(session)
+        self.connections += 1
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b""
+                if not self._dispatch(session, header[0] >> 4, header[0] & 0x0F, body):
+                    break
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._sessions.discard(session)
+            writer.close()
+
+    def _dispatch(self, session: _Session, ptype: int, flags: int, body: bytes) -> bool:
+        if ptype == PUBLISH:
+            self._on_publish(session, flags, body)
+        elif ptype == CONNECT:
+            # identyfikator klienta: po nagłówku protokołu (nazwa, wersja, flagi, keepalive)
+            _, pos = _utf8(body, 0)
+            session.client_id, _ = _utf8(body, pos + 4)
+            session.send(_packet(CONNACK, 0, b"\x00\x00"))
+        elif ptype == SUBSCRIBE:
+            (packet_id,) = struct.unpack_from("!H", body, 0)
+            pos, granted = 2, bytearray()
+            while pos < len(body):
+                topic, pos = _utf8(body, pos)
+                qos = body[pos]
+                pos += 1
+                group = None
+                if topic.startswith("$share/"):
+                    _, group, topic = topic.split("/", 2)
+                session.filters[topic] = group
+                granted.append(min(qos, 1))
+            session.send(_packet(SUBACK, 0, struct.pack("!H", packet_id) + bytes(granted)))
+        elif ptype == UNSUBSCRIBE:
+            (packet_id,) = struct.unpack_from("!H", body, 0)
+            pos = 2
+            while pos < len(body):
+                topic, pos = _utf8(body, pos)
+                if topic.startswith("$share/"):
+                    topic = topic.split("/", 2)[2]
+                session.filters.pop(topic, None)
+            session.send(_packet(UNSUBACK, 0, struct.pack("!H", packet_id)))
+        elif ptype == PINGREQ:
+            session.send(_packet(PINGRESP, 0, b""))
+        elif ptype == DISCONNECT:
+            return False
+        # PUBACK od subskrybentów i reszta - ignorowane
+        return True
+
+    def _on_publish(self, sender: _Session, flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        topic, pos = _utf8(body, 0)
+        if qos:
+            packet_id = body[pos:pos + 2]
+            pos += 2
+            sender.send(_packet(PUBACK, 0, packet_id))
+        self.received += 1
+
+        out = _packet(PUBLISH, 0, struct.pack("!H", len(topic.encode())) + topic.encode() + body[pos:])
+        shared: dict[tuple[str, str], list[_Session]] = {}
+        routed = False
+        for session in list(self._sessions):
+            for pattern, group in session.filters.items():
+                if not topic_matches(pattern, topic):
+                    continue
+                if group is None:
+                    session.send(out)
+                    self.delivered += 1
+                    routed = True
+                else:
+                    shared.setdefault((group, pattern), []).append(session)
+                break
+        # $share: jedna kopia na grupę, kolejno do członków
+        for key, members in shared.items():
+            turn = next(self._groups.setdefault(key, itertools.count()))
+            members[turn % len(members)].send(out)
+            self.delivered += 1
+            routed = True
+        if not routed:
+            self.unrouted += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local MQTT broker stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    broker = LocalBroker(args.host, args.port)
+    broker.start()
+    print(f"[BROKER] listening on {args.host}:{broker.port} (Ctrl+C = stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[BROKER] stats: {broker.stats()}")
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# smtp_sink.py
+"""
+Lokalny serwer SMTP (aiosmtpd) dla benchmarków: przyjmuje każdy login, nic nie wysyła dalej,
+zapamiętuje czas odbioru każdego maila alarmowego per hw_uid.
+Aplikacja łączy się z nim przy SMTP_STARTTLS=0.
+"""
+import re
+import socket
+import threading
+import logging
+import time
+from collections import defaultdict, deque
+from email import message_from_bytes
+from typing import Optional
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+# aiosmtpd sam ustawia przestarzałe pole przy każdym AUTH i loguje ostrzeżenie - szum na stderr
+logging.getLogger("mail.log").setLevel(logging.ERROR)
+
+_HW_UID = re.compile(r"hw_uid: (\S+)")
+
+
+class _Handler:
+    def __init__(self, sink: "SmtpSink") -> None:
+        self._sink = sink
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        received_at = time.monotonic()
+        msg = message_from_bytes(envelope.original_content or envelope.content)
+        body = msg.get_payload(decode=True) or b""
+        match = _HW_UID.search(body.decode("utf-8", errors="ignore"))
+        self._sink.record(match.group(1) if match else None, msg.get("Subject", ""), received_at)
+        return "250 OK"
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _accept_any(server, session, envelope, mechanism, auth_data) -> AuthResult:
+    return AuthResult(success=True)
+
+
+class SmtpSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        # Controller sprawdza gotowość łącząc się na podany port - 0 nie zadziała
+        self.port = port or free_port(host)
+        self._controller = Controller(
+            _Handler(self),
+            hostname=host,
+            port=self.port,
+            authenticator=_accept_any,
+            auth_require_tls=False,
+        )
+        self._lock = threading.Lock()
+        self._arrivals: dict[Optional[str], deque[float]] = defaultdict(deque)
+        self.received = 0
+        self.digests = 0
+
+    def start(self) -> int:
+        self._controller.start()
+        return self.port
+
+    def stop(self) -> None:
+        self._controller.stop()
+
+    def record(self, hw_uid: Optional[str], subject: str, received_at: float) -> None:
+        with self._lock:
+            self.received += 1
+            if "kolejnych" in subject:
+                self.digests += 1
+            self._arrivals[hw_uid].append(received_at)
+
+    def pop_arrival(self, hw_uid: str) -> Optional[float]:
+        """Czas odbioru najstarszego jeszcze nieodebranego maila dla urządzenia."""
+        with self._lock:
+            queue = self._arrivals.get(hw_uid)
+            return queue.popleft() if queue else None
+
+    def count(self, hw_uid: str) -> int:
+        with self._lock:
+            return len(self._arrivals.get(hw_uid, ()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"received": self.received, "digests": self.digests}
@@ -0,0 +1,104 @@
+# alarm_debounce.py
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+# (hw_uid, liczba złożonych alarmów, pierwszy, ostatni)
+DigestFn = Callable[[str, int, datetime, datetime], Awaitable[None]]
+
+
+@dataclass
+class _Window:
+    count: int = 0
+    first: Optional[datetime] = None
+    last: Optional[datetime] = None
+    handle: Optional[asyncio.TimerHandle] = None
+
+
+class AlarmDebouncer:
+    """
+    Okno debounce per hw_uid.
+
+    - pierwszy alarm urządzenia przechodzi od razu (offer() -> True) i otwiera okno
+    - kolejne alarmy w oknie są tylko liczone (offer() -> False) - bez DB i bez maila
+    - na końcu okna, jeśli coś złożono, idzie jeden digest ("N alarmów między T1 a T2")
+      i okno otwiera się od nowa; okno bez powtórzeń po prostu znika
+    window <= 0 wyłącza debounce (każdy alarm przechodzi).
+    """
+
+    def __init__(self, window: float, on_digest: DigestFn) -> None:
+        self._window = window
+        self._on_digest = on_digest
+        self._windows: dict[str, _Window] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+        self.received = 0
+        self.passed = 0
+        self.suppressed = 0
+        self.digests = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._window > 0
+
+    def offer(self, hw_uid: str, at: Optional[datetime] = None) -> bool:
+        """True = wyślij normalny alarm teraz; False = alarm złożony do digestu."""
+        self.received += 1
+        if not self.enabled:
+            self.passed += 1
+            return True
+
+        at = at or datetime.now()
+        win = self._windows.get(hw_uid)
+        if win is None:
+            self._open(hw_uid)
+            self.passed += 1
+            return True
+
+        win.count += 1
+        win.first = win.first or at
+        win.last = at
+        self.suppressed += 1
+        return False
+
+    def _open(self, hw_uid: str) -> None:
+        loop = asyncio.get_running_loop()
+        win = _Window()
+        win.handle = loop.call_later(self._window, self._close, hw_uid)
+        self._windows[hw_uid] = win
+
+    def _close(self, hw_uid: str) -> None:
+        win = self._windows.pop(hw_uid, None)
+        if win is None or win.count == 0:
+            return
+        # burza trwa - digest za to okno i od razu nowe okno
+        self._open(hw_uid)
+        self._emit(hw_uid, win)
+
+    def _emit(self, hw_uid: str, win: _Window) -> None:
+        self.digests += 1
+        task = asyncio.create_task(self._on_digest(hw_uid, win.count, win.first, win.last))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        """Przy zatrzymaniu: wysyła zaległe digesty i czeka na nie."""
+        windows, self._windows = self._windows, {}
+        for hw_uid, win in windows.items():
+            if win.handle is not None:
+                win.handle.cancel()
+            if win.count:
+                self._emit(hw_uid, win)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "window_s": self._window,
+            "open_windows": len(self._windows),
+            "received": self.received,
+            "passed": self.passed,
+            "suppressed": self.suppressed,
+            "digests": self.digests,
+        }
@@ -0,0 +1,241 @@
+# alarm_pipeline.py
+import asyncio
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from src.app_log import get_logger
+from src.metrics import ALARM_END_TO_END_SECONDS, ALARM_STAGE_SECONDS
+from src.timing import StageTimer
+
+log = get_logger("alarm")
+
+
+@dataclass
+class AlarmEvent:
+    hw_uid: str
+    received_at: float  # time.monotonic() w chwili odebrania z MQTT
+    # digest z debounce: ile alarmów złożono i z jakiego przedziału czasu
+    count: int = 1
+    first: Optional[datetime] = None
+    last: Optional[datetime] = None
+
+    @property
+    def is_digest(self) -> bool:
+        return self.first is not None
+
+
+Recipient = tuple[str, Optional[str]]
+ResolveFn = Callable[[str], Awaitable[Optional[Recipient]]]
+# (email, zdarzenie, nazwa urządzenia)
+NotifyFn = Callable[[str, AlarmEvent, Optional[str]], Awaitable[None]]
+# kilka powiadomień naraz (jedna sesja SMTP); zwraca błędy w tej samej kolejności (None = wysłane)
+NotifyManyFn = Callable[[list[tuple[str, AlarmEvent, Optional[str]]]], Awaitable[list[Optional[Exception]]]]
+
+
+def shard_for(hw_uid: str, shards: int) -> int:
+    """Stabilny (między procesami) numer sharda dla hw_uid."""
+    return zlib.crc32(hw_uid.encode("utf-8")) % shards
+
+
+class AlarmPipeline:
+    """
+    Przetwarzanie alarmów etapami: odbiór -> ustalenie odbiorcy -> powiadomienie.
+
+    - N workerów; hw_uid jest zawsze kierowany do tego samego workera (crc32 % N), więc
+      alarmy jednego urządzenia są obsługiwane po kolei, a różne urządzenia równolegle
+    - każdy worker ma ograniczoną kolejkę; submit() czeka, gdy jest pełna, co
+      spowalnia czytanie z MQTT zamiast rosnąć w pamięci (backpressure)
+    - z notify_many worker bierze naraz to, co już czeka w jego kolejce (do batch_size),
+      i wysyła paczkę jednym wywołaniem (jedna sesja SMTP) - kolejność w shardzie bez zmian
+    - stats(): głębokość kolejek i czasy etapów (czekanie w kolejce, resolve, notify)
+    """
+
+    def __init__(
+        self,
+        resolve: ResolveFn,
+        notify: NotifyFn,
+        *,
+        workers: int = 8,
+        queue_size: int = 1000,
+        notify_many: Optional[NotifyManyFn] = None,
+        batch_size: int = 1,
+    ) -> None:
+        self._resolve = resolve
+        self._notify = notify
+        self._notify_many = notify_many
+        self._batch_size = max(1, batch_size) if notify_many is not None else 1
+        self._workers = max(1, workers)
+        per_worker = max(1, queue_size // self._workers)
+        self._queues: list[asyncio.Queue[Optional[AlarmEvent]]] = [
+            asyncio.Queue(maxsize=per_worker) for _ in range(self._workers)
+        ]
+        self._tasks: list[asyncio.Task] = []
+
+        # te same pomiary do stats() i do /metrics
+        self._wait = StageTimer(observe=ALARM_STAGE_SECONDS.labels("queue_wait").observe)
+        self._resolve_t = StageTimer(observe=ALARM_STAGE_SECONDS.labels("resolve").observe)
+        self._notify_t = StageTimer(observe=ALARM_STAGE_SECONDS.labels("notify").observe)
+        self._total_t = StageTimer(observe=ALARM_END_TO_END_SECONDS.observe)
+        self.received = 0
+        self.no_recipient = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(q), name=f"alarm-worker-{i}")
+            for i, q in enumerate(self._queues)
+        ]
+
+    async def submit(self, hw_uid: str, received_at: Optional[float] = None) -> None:
+        """Etap "odbiór": wrzuca alarm do kolejki workera danego urządzenia (czeka, gdy pełna)."""
+        self.received += 1
+        event = AlarmEvent(hw_uid=hw_uid, received_at=received_at or time.monotonic())
+        await self._queues[shard_for(hw_uid, self._workers)].put(event)
+
+    async def submit_digest(self, hw_uid: str, count: int, first: datetime, last: datetime) -> None:
+        """Digest z debounce idzie tą samą kolejką co alarmy urządzenia (zachowana kolejność)."""
+        event = AlarmEvent(hw_uid=hw_uid, received_at=time.monotonic(), count=count, first=first, last=last)
+        await self._queues[shard_for(hw_uid, self._workers)].put(event)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Kończy po przetworzeniu tego, co już jest w kolejkach (maksymalnie `timeout` sekund)."""
+        if not self._tasks:
+            return
+        # pełna kolejka (worker utknął np. na wolnym SMTP) - czekanie na miejsce na sentinel
+        # też liczy się do limitu, inaczej stop() wisiałby bez końca
+        full = []
+        for q in self._queues:
+            try:
+                q.put_nowait(None)
+            except asyncio.QueueFull:
+                full.append(q)
+
+        async def _drain() -> None:
+            for q in full:
+                await q.put(None)
+            await asyncio.wait(self._tasks)
+
+        try:
+            await asyncio.wait_for(_drain(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        pending = [task for task in self._tasks if not task.done()]
+        if pending:
+            log.warning("drain timeout, dropping queued alarms", extra={
+                "workers": len(pending),
+                "queued": self.queue_depth(),
+                "timeout_s": timeout,
+            })
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self._workers,
+            "queue_depth": self.queue_depth(),
+            "queue_depth_max_shard": max(q.qsize() for q in self._queues),
+            "received": self.received,
+            "no_recipient": self.no_recipient,
+            "failed": self.failed,
+            "batches": self.batches,
+            "stages": {
+                "queue_wait": self._wait.summary(),
+                "resolve": self._resolve_t.summary(),
+                "notify": self._notify_t.summary(),
+                "end_to_end": self._total_t.summary(),
+            },
+        }
+
+    async def _worker(self, queue: "asyncio.Queue[Optional[AlarmEvent]]") -> None:
+        while True:
+            event = await queue.get()
+            if event is None:
+                return
+            batch = [event]
+            stopping = False
+            # bez czekania: tylko to, co już leży w kolejce
+            while len(batch) < self._batch_size:
+                try:
+                    queued = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if queued is None:
+                    stopping = True
+                    break
+                batch.append(queued)
+            try:
+                if len(batch) == 1:
+                    await self._handle(event)
+                else:
+                    await self._handle_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += len(batch)
+                log.error("alarm handling failed", extra={"hw_uid": event.hw_uid, "error": str(e)})
+            if stopping:
+                return
+
+    async def _handle(self, event: AlarmEvent) -> None:
+        started = time.monotonic()
+        self._wait.add(started - event.received_at)
+
+        recipient = await self._resolve(event.hw_uid)
+        resolved = time.monotonic()
+        self._resolve_t.add(resolved - started)
+
+        if not recipient:
+            self.no_recipient += 1
+            log.warning("no assigned user/email, not sending", extra={"hw_uid": event.hw_uid})
+            return
+
+        email, device_name = recipient
+        await self._notify(email, event, device_name)
+        finished = time.monotonic()
+        self._notify_t.add(finished - resolved)
+        self._total_t.add(finished - event.received_at)
+
+    async def _handle_batch(self, batch: list[AlarmEvent]) -> None:
+        started = time.monotonic()
+        to_send: list[tuple[str, AlarmEvent, Optional[str]]] = []
+        for event in batch:
+            self._wait.add(started - event.received_at)
+            resolve_started = time.monotonic()
+            try:
+                recipient = await self._resolve(event.hw_uid)
+            except Exception as e:
+                self.failed += 1
+                log.error("alarm handling failed", extra={"hw_uid": event.hw_uid, "error": str(e)})
+                continue
+            self._resolve_t.add(time.monotonic() - resolve_started)
+            if not recipient:
+                self.no_recipient += 1
+                log.warning("no assigned user/email, not sending", extra={"hw_uid": event.hw_uid})
+                continue
+            email, device_name = recipient
+            to_send.append((email, event, device_name))
+
+        if not to_send:
+            return
+        self.batches += 1
+        resolved = time.monotonic()
+        errors = await self._notify_many(to_send)
+        finished = time.monotonic()
+        self._notify_t.add(finished - resolved)
+        for (_, event, _), error in zip(to_send, errors):
+            if error is not None:
+                self.failed += 1
+                log.error("alarm handling failed", extra={"hw_uid": event.hw_uid, "error": str(error)})
+                continue
+            self._total_t.add(finished - event.received_at)
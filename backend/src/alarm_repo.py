@@ -1,8 +1,25 @@
  #alarm_repo.py
-from sqlalchemy.orm import Session
-from src.models import Device  # albo z Twojej ścieżki importów
+import os
+import threading
+import time
+from typing import Callable, Optional
 
-def get_alarm_recipient_by_hw_uid(db: Session, hw_uid: str) -> tuple[str, str | None] | None:
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models import Device, User  # albo z Twojej ścieżki importów
+
+Recipient = tuple[str, str | None]
+
+
+def _recipient_query():
+    # jedno zapytanie z JOIN, tylko potrzebne kolumny (bez ładowania obiektów ORM)
+    return select(Device.hw_uid, User.email, Device.name, Device.id_user).join(
+        User, Device.id_user == User.id_user
+    )
+
+
+async def get_alarm_recipient_by_hw_uid(db: AsyncSession, hw_uid: str) -> Recipient | None:
     """
     Zwraca (email, device_name) dla urządzenia o hw_uid.
     None jeśli:
@@ -10,9 +27,146 @@ def get_alarm_recipient_by_hw_uid(db: Session, hw_uid: str) -> tuple[str, str |
     - device nie ma przypisanego usera
     - user nie ma email (u Ciebie email jest NOT NULL więc odpada)
     """
-    device = db.query(Device).filter(Device.hw_uid == hw_uid).first()
-    if not device:
+    row = (await db.execute(_recipient_query().where(Device.hw_uid == hw_uid))).first()
+    if not row:
         return None
-    if not device.user:
+    return row.email, row.name
+
+
+class RecipientCache:
+    """
+    hw_uid -> (email, device_name) albo None (brak urządzenia/właściciela - też cache'owane).
+    Wpis pamięta id_user, żeby zmiana emaila usera unieważniała jego urządzenia.
+    Blokada, bo unieważnienia przychodzą z wątku API, a odczyty z listenera.
+    """
+
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 60.0, max_size: int = 100_000) -> None:
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_size = max_size
+        # hw_uid -> (expires_at, recipient | None, id_user | None)
+        self._data: dict[str, tuple[float, Optional[Recipient], Optional[int]]] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    _MISS = object()
+
+    def get(self, hw_uid: str):
+        """Zwraca Recipient, None (wynik negatywny) albo RecipientCache._MISS."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(hw_uid)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return self._MISS
+            self.hits += 1
+            if entry[1] is None:
+                self.negative_hits += 1
+            return entry[1]
+
+    def put(self, hw_uid: str, recipient: Optional[Recipient], id_user: Optional[int] = None) -> None:
+        ttl = self._ttl if recipient is not None else self._negative_ttl
+        with self._lock:
+            self._data.pop(hw_uid, None)
+            self._data[hw_uid] = (time.monotonic() + ttl, recipient, id_user)
+            while len(self._data) > self._max_size:
+                # dict zachowuje kolejność wstawiania - wylatuje najstarszy wpis
+                self._data.pop(next(iter(self._data)))
+
+    def invalidate(self, hw_uid: str) -> None:
+        with self._lock:
+            self._data.pop(hw_uid, None)
+
+    def invalidate_user(self, id_user: int) -> None:
+        with self._lock:
+            for key in [k for k, v in self._data.items() if v[2] == id_user]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+        }
+
+
+recipient_cache = RecipientCache(
+    ttl=float(os.getenv("ALARM_RECIPIENT_TTL", "300")),
+    negative_ttl=float(os.getenv("ALARM_RECIPIENT_NEGATIVE_TTL", "60")),
+    max_size=int(os.getenv("ALARM_RECIPIENT_CACHE_SIZE", "100000")),
+)
+
+
+async def get_alarm_recipient_cached(
+    session_factory: Callable[[], AsyncSession],
+    hw_uid: str,
+) -> Recipient | None:
+    """Jak get_alarm_recipient_by_hw_uid, ale sesję DB otwiera tylko przy braku wpisu w cache."""
+    cached = recipient_cache.get(hw_uid)
+    if cached is not RecipientCache._MISS:
+        return cached
+
+    async with session_factory() as db:
+        row = (await db.execute(_recipient_query().where(Device.hw_uid == hw_uid))).first()
+
+    if not row:
+        recipient_cache.put(hw_uid, None)
         return None
-    return device.user.email, device.name
\ No newline at end of file
+    recipient = (row.email, row.name)
+    recipient_cache.put(hw_uid, recipient, row.id_user)
+    return recipient
+
+
+async def warm_recipient_cache(db: AsyncSession) -> int:
+    """Ładuje do cache odbiorców wszystkich urządzeń z właścicielem (start listenera). Zwraca liczbę wpisów."""
+    count = 0
+    result = await db.stream(_recipient_query().where(Device.hw_uid.is_not(None)))
+    async for row in result:
+        recipient_cache.put(row.hw_uid, (row.email, row.name), row.id_user)
+        count += 1
+    return count
+
+
+# --- unieważnianie przy zmianach przez ORM ---
+# Zapisy przez core (update()/insert() bez ORM) muszą same zawołać recipient_cache.invalidate().
+def _changed(target, *attrs: str) -> bool:
+    state = inspect(target)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+@event.listens_for(Device, "after_insert")
+@event.listens_for(Device, "after_delete")
+def _invalidate_device(mapper, connection, target: Device) -> None:
+    if target.hw_uid:
+        recipient_cache.invalidate(target.hw_uid)
+
+
+@event.listens_for(Device, "after_update")
+def _invalidate_device_on_update(mapper, connection, target: Device) -> None:
+    # zmiana stanu (is_open/alarm_active) nie dotyczy odbiorcy alarmu
+    if not _changed(target, "id_user", "name", "hw_uid"):
+        return
+    if target.hw_uid:
+        recipient_cache.invalidate(target.hw_uid)
+    for old_uid in inspect(target).attrs.hw_uid.history.deleted or ():
+        if old_uid:
+            recipient_cache.invalidate(old_uid)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, target: User) -> None:
+    recipient_cache.invalidate_user(target.id_user)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_user_on_update(mapper, connection, target: User) -> None:
+    if _changed(target, "email"):
+        recipient_cache.invalidate_user(target.id_user)
@@ -0,0 +1,209 @@
+# app_log.py
+"""
+Logi strukturalne (JSON, jedna linia na wpis) z nieblokującym zapisem.
+
+- logger.info("...", extra={"hw_uid": ..., "topic": ...}) - pola z extra lądują w JSON-ie
+- emit tylko wkłada rekord do ograniczonej kolejki; stdout pisze osobny wątek (QueueListener).
+  Pełna kolejka = rekord odrzucony i policzony (dropped), nigdy czekanie w pętli zdarzeń
+- rekordy z polem "topic" przechodzą przez próbkowanie i limit na klasę tematu
+  (doorlock/<hw_uid>/state -> doorlock/+/state), żeby zalew wiadomości nie zalał logów;
+  WARNING i wyżej zawsze przechodzą
+
+Konfiguracja:
+- LOG_LEVEL          (domyślnie INFO)
+- LOG_FORMAT         json | text (domyślnie json)
+- LOG_QUEUE_SIZE     limit kolejki rekordów (domyślnie 10000)
+- LOG_TOPIC_RATE     wpisów/s na klasę tematu (domyślnie 20, 0 = bez limitu); LOG_TOPIC_BURST (domyślnie 100)
+- LOG_TOPIC_SAMPLE   próbkowanie per klasa, np. "doorlock/+/state=0.01,doorlock/+/ack=0.1"
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+ROOT_LOGGER = "doorlock"
+
+# atrybuty, które ma każdy LogRecord - reszta to pola z extra
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def topic_class(topic: str) -> str:
+    """doorlock/<hw_uid>/alarm/state -> doorlock/+/alarm/state (stała liczba kluczy przy 10k urządzeń)."""
+    parts = topic.split("/")
+    if len(parts) >= 2 and parts[0] == "doorlock":
+        parts[1] = "+"
+    return "/".join(parts)
+
+
+def _parse_sampling(spec: str) -> dict[str, float]:
+    out = {}
+    for item in spec.split(","):
+        if "=" in item:
+            pattern, ratio = item.split("=", 1)
+            out[pattern.strip()] = float(ratio)
+    return out
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Czytelny dla człowieka (lokalnie): czas poziom logger wiadomość k=v ..."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in vars(record).items() if k not in _RESERVED)
+        ts = datetime.fromtimestamp(record.created).strftime("%H:%M:%S.%f")[:-3]
+        line = f"{ts} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if fields:
+            line = f"{line} {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class TopicSampler(logging.Filter):
+    """Próbkowanie i token bucket per klasa tematu dla rekordów z polem "topic" poniżej WARNING."""
+
+    def __init__(self, rate: float, burst: int, sampling: dict[str, float]) -> None:
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._sampling = sampling
+        self._buckets: dict[str, list[float]] = {}  # klasa -> [tokeny, ostatnie uzupełnienie]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        topic = getattr(record, "topic", None)
+        if topic is None or record.levelno >= logging.WARNING:
+            return True
+        key = topic_class(topic)
+
+        ratio = self._sampling.get(key)
+        if ratio is not None and random.random() >= ratio:
+            self.suppressed += 1
+            return False
+        if self._rate <= 0:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self._burst), now]
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, który przy pełnej kolejce odrzuca rekord zamiast czekać."""
+
+    def __init__(self, q: queue.Queue) -> None:
+        super().__init__(q)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatowanie (getMessage, JSON) robi wątek zapisu, nie wywołujący
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # przy pełnej kolejce put_nowait rzuciłby Full - przy zamykaniu można poczekać na wątek zapisu
+        self.queue.put(self._sentinel, timeout=5)
+
+
+_setup_lock = threading.Lock()
+_handler: Optional[BoundedQueueHandler] = None
+_sampler: Optional[TopicSampler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _setup() -> None:
+    global _handler, _sampler, _listener
+
+    with _setup_lock:
+        if _handler is not None:
+            return
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(TextFormatter() if os.getenv("LOG_FORMAT", "json") == "text" else JsonFormatter())
+
+        records: queue.Queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        handler = BoundedQueueHandler(records)
+        sampler = TopicSampler(
+            rate=float(os.getenv("LOG_TOPIC_RATE", "20")),
+            burst=int(os.getenv("LOG_TOPIC_BURST", "100")),
+            sampling=_parse_sampling(os.getenv("LOG_TOPIC_SAMPLE", "")),
+        )
+        handler.addFilter(sampler)
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.addHandler(handler)
+        # nie dublujemy wpisów w handlerach uvicorna / root loggera
+        root.propagate = False
+
+        _listener = _Listener(records, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        _handler, _sampler = handler, sampler
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger "doorlock.<name>" podpięty pod nieblokujący zapis JSON."""
+    _setup()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def shutdown_logging() -> None:
+    """Dopisuje zaległe rekordy (wołane przy wyjściu procesu)."""
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def log_stats() -> dict:
+    return {
+        "enqueued": _handler.enqueued if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+        "suppressed": _sampler.suppressed if _sampler is not None else 0,
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+    }
@@ -0,0 +1,134 @@
+# password_hasher.py
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from src.auth.security import BCRYPT_ROUNDS, hash_password, verify_and_update_password
+from src.metrics import PASSWORD_HASH_SECONDS
+from src.timing import StageTimer
+
+
+class HashingBusy(RuntimeError):
+    """Kolejka do haszowania pełna - trasa odpowiada 503 zamiast czekać w nieskończoność."""
+
+
+# funkcje dla procesów roboczych (muszą być na poziomie modułu, żeby dało się je zpicklować)
+def _warmup() -> int:
+    return os.getpid()
+
+
+class PasswordHasher:
+    """
+    bcrypt poza pętlą zdarzeń i poza wspólnym threadpoolem FastAPI.
+
+    - własna pula: procesy (domyślnie - bcrypt nie blokuje GIL-a procesu API) albo wątki
+    - najwyżej `max_workers` zadań naraz, najwyżej `max_queue` czekających; kolejne -> HashingBusy
+    - stats(): czas czekania na wolnego workera, czas samego haszowania, odrzucone, przeliczone hashe
+    """
+
+    def __init__(self, *, kind: str = "process", max_workers: int = 2, max_queue: int = 100) -> None:
+        if kind not in ("process", "thread"):
+            raise RuntimeError("HASH_EXECUTOR musi być 'process' albo 'thread'")
+        self.kind = kind
+        self._max_workers = max(1, max_workers)
+        self._max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._start_lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+
+        self._queue_t = StageTimer(observe=PASSWORD_HASH_SECONDS.labels("queue_wait").observe)
+        self._run_t = StageTimer(observe=PASSWORD_HASH_SECONDS.labels("hash").observe)
+        self.rejected = 0
+        self.rehashed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """Tworzy pulę i od razu odpala procesy (pierwsze logowanie nie czeka na spawn)."""
+        with self._start_lock:
+            if self._executor is None:
+                self._executor = self._create()
+
+    def _create(self) -> Executor:
+        if self.kind == "process":
+            # spawn: proces API ma wątki (listener MQTT, publisher) - fork z nimi nie jest bezpieczny
+            executor = ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            for f in [executor.submit(_warmup) for _ in range(self._max_workers)]:
+                f.result()
+            return executor
+        return ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="hash")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_workers)
+        if self._executor is None:
+            await asyncio.to_thread(self.start)
+
+        if self._waiting >= self._max_queue and self._slots.locked():
+            self.rejected += 1
+            raise HashingBusy("Password hashing queue full")
+
+        queued = time.monotonic()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        try:
+            started = time.monotonic()
+            self._queue_t.add(started - queued)
+            try:
+                result = await asyncio.wrap_future(self._executor.submit(fn, *args))
+            except BrokenProcessPool:
+                # padnięty proces roboczy - nowa pula przy następnym wywołaniu
+                self.failed += 1
+                self._executor = None
+                raise
+            self._run_t.add(time.monotonic() - started)
+            return result
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple[bool, Optional[str]]:
+        """(hasło poprawne?, nowy hash z kosztem BCRYPT_ROUNDS albo None, gdy obecny jest aktualny)"""
+        ok, new_hash = await self._run(verify_and_update_password, password, hashed)
+        if new_hash is not None:
+            self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.kind,
+            "workers": self._max_workers,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "waiting": self._waiting,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "failed": self.failed,
+            "queue_wait": self._queue_t.summary(),
+            "hash_time": self._run_t.summary(),
+        }
+
+
+password_hasher = PasswordHasher(
+    kind=os.getenv("HASH_EXECUTOR", "process").strip().lower(),
+    max_workers=int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_queue=int(os.getenv("HASH_MAX_QUEUE", "100")),
+)
@@ -0,0 +1,107 @@
+# app/auth/principal_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import event
+
+from src.models import User
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Odchudzona kopia zalogowanego usera (to, co zwraca get_current_user)."""
+    id_user: int
+    username: str
+    email: str
+    nr_telefonu: Optional[str]
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id_user=user.id_user,
+            username=user.username,
+            email=user.email,
+            nr_telefonu=user.nr_telefonu,
+            created_at=user.created_at,
+        )
+
+
+class PrincipalCache:
+    """
+    Cache zweryfikowanych access tokenów: token -> (claims, Principal).
+    - wpis żyje maksymalnie do `exp` tokena
+    - każdy user ma "epokę" unieważnień; logout_all i zmiany usera ją podbijają,
+      więc wszystkie wpisy tego usera przestają być ważne bez przeszukiwania cache
+    - LRU z limitem rozmiaru
+    """
+
+    def __init__(self, max_size: int = 50_000) -> None:
+        self._max_size = max_size
+        self._data: "OrderedDict[str, tuple[float, int, dict, Principal]]" = OrderedDict()
+        self._epochs: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[tuple[dict, Principal]]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            exp, epoch, claims, principal = entry
+            if exp <= now or epoch != self._epochs.get(principal.id_user, 0):
+                del self._data[token]
+                self.misses += 1
+                return None
+            self._data.move_to_end(token)
+            self.hits += 1
+            return claims, principal
+
+    def epoch(self, id_user: int) -> int:
+        with self._lock:
+            return self._epochs.get(id_user, 0)
+
+    def put(self, token: str, claims: dict, principal: Principal, epoch: int) -> None:
+        """`epoch` trzeba pobrać PRZED odczytem usera z bazy, żeby nie zapamiętać starego snapshotu."""
+        exp = claims.get("exp")
+        if exp is None or self._max_size <= 0:
+            return
+        with self._lock:
+            if epoch != self._epochs.get(principal.id_user, 0):
+                return
+            self._data[token] = (float(exp), epoch, claims, principal)
+            self._data.move_to_end(token)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def revoke_user(self, id_user: int) -> None:
+        with self._lock:
+            self._epochs[id_user] = self._epochs.get(id_user, 0) + 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+principal_cache = PrincipalCache(max_size=int(os.getenv("PRINCIPAL_CACHE_SIZE", "50000")))
+
+
+# zmiana/usunięcie usera przez ORM -> snapshoty w cache są nieaktualne
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _revoke_on_change(mapper, connection, target: User) -> None:
+    principal_cache.revoke_user(target.id_user)
@@ -0,0 +1,185 @@
+# rate_limit.py
+import abc
+import importlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class RateLimitStore(abc.ABC):
+    """
+    Miejsce trzymania stanu kubełków (token bucket). Domyślnie pamięć procesu (MemoryBucketStore);
+    przy kilku procesach API wspólny stan daje własna implementacja (np. Redis),
+    wskazana przez LOGIN_RATE_STORE=pakiet.modul:Klasa.
+    """
+
+    @abc.abstractmethod
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """
+        Zabiera jeden token z kubełka `key` (uzupełnianego `rate` tokenów/s, pojemność `burst`).
+        Zwraca 0, gdy się udało, inaczej liczbę sekund do następnego tokenu.
+        """
+
+    def size(self) -> int:
+        return 0
+
+
+class MemoryBucketStore(RateLimitStore):
+    """
+    key -> (tokeny, czas ostatniego użycia) w OrderedDict w kolejności użycia.
+    Kubełek, który zdążył się w pełni uzupełnić, niczego nie pamięta - jest usuwany
+    (od najdawniej używanych, przy okazji take()). Twardy limit max_keys na wypadek
+    zalewu unikalnymi kluczami.
+    """
+
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self._max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        refill_s = burst / rate
+        with self._lock:
+            entry = self._buckets.pop(key, None)
+            if entry is None:
+                tokens = burst
+            else:
+                tokens = min(burst, entry[0] + (now - entry[1]) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+
+            # najdawniej używane na początku - czyścimy, dopóki są już pełne
+            while self._buckets:
+                oldest_key, (_, last) = next(iter(self._buckets.items()))
+                if now - last < refill_s and len(self._buckets) <= self._max_keys:
+                    break
+                del self._buckets[oldest_key]
+                self.evicted += 1
+        return wait
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+def _load_store_factory(spec: str) -> Callable[[], RateLimitStore]:
+    if spec == "memory":
+        return lambda: MemoryBucketStore(int(os.getenv("LOGIN_RATE_MAX_KEYS", "100000")))
+    module_name, _, class_name = spec.partition(":")
+    if not class_name:
+        raise RuntimeError("LOGIN_RATE_STORE musi być 'memory' albo 'pakiet.modul:Klasa'")
+    store_class = getattr(importlib.import_module(module_name), class_name)
+    if not (isinstance(store_class, type) and issubclass(store_class, RateLimitStore)):
+        raise RuntimeError(f"LOGIN_RATE_STORE: {spec} nie jest klasą RateLimitStore")
+    return store_class
+
+
+def _bucket(name: str, per_min: float, burst: float) -> Optional[tuple[float, float]]:
+    """(tokeny/s, pojemność) albo None, gdy kubełek jest wyłączony (0)."""
+    if per_min < 0 or burst < 0:
+        raise RuntimeError(f"Limit logowania ({name}): stawka i burst muszą być >= 0 (0 = bez limitu)")
+    if per_min == 0 or burst == 0:
+        return None
+    return per_min / 60.0, burst
+
+
+class LoginRateLimiter:
+    """
+    Ograniczenie prób /auth/login przed jakąkolwiek pracą (zapytanie o usera, bcrypt).
+
+    Dwa token buckety: po adresie klienta i po identyfikatorze logowania (username/email,
+    bez rozróżniania wielkości liter). Najpierw IP - odrzucony adres nie zużywa limitu loginu.
+    Stawki w próbach na minutę, pojemność (burst) w próbach. Stawka albo burst 0 wyłącza
+    dany kubełek; wartości ujemne to błąd konfiguracji (RuntimeError przy tworzeniu).
+    """
+
+    def __init__(
+        self,
+        store_factory: Callable[[], RateLimitStore],
+        *,
+        ip_per_min: float = 60.0,
+        ip_burst: float = 20.0,
+        login_per_min: float = 10.0,
+        login_burst: float = 5.0,
+    ) -> None:
+        self._ip_store = store_factory()
+        self._login_store = store_factory()
+        self._ip = _bucket("ip", ip_per_min, ip_burst)
+        self._login = _bucket("login", login_per_min, login_burst)
+
+        self.allowed = 0
+        self.rejected_ip = 0
+        self.rejected_login = 0
+
+    async def check(self, login: str, client_ip: Optional[str]) -> float:
+        """0 = wpuść; >0 = odrzuć, wartość do Retry-After (sekundy)."""
+        if client_ip and self._ip is not None:
+            wait = await self._ip_store.take(f"ip:{client_ip}", *self._ip)
+            if wait:
+                self.rejected_ip += 1
+                return wait
+
+        if self._login is not None:
+            wait = await self._login_store.take(f"login:{login.strip().lower()}", *self._login)
+            if wait:
+                self.rejected_login += 1
+                return wait
+
+        self.allowed += 1
+        return 0.0
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected_ip": self.rejected_ip,
+            "rejected_login": self.rejected_login,
+            "ip_keys": self._ip_store.size(),
+            "login_keys": self._login_store.size(),
+        }
+
+
+# TRUST_PROXY=1: adres klienta z X-Forwarded-For (API za reverse proxy)
+TRUST_PROXY = os.getenv("TRUST_PROXY", "0") == "1"
+
+
+def client_ip(request) -> Optional[str]:
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+def retry_after_header(wait: float) -> str:
+    return str(max(1, math.ceil(wait)))
+
+
+def _build_login_limiter() -> Optional[LoginRateLimiter]:
+    """
+    - LOGIN_RATE_LIMIT=0          wyłącza limit
+    - LOGIN_RATE_IP_PER_MIN / LOGIN_RATE_IP_BURST        (domyślnie 60 / 20)
+    - LOGIN_RATE_LOGIN_PER_MIN / LOGIN_RATE_LOGIN_BURST  (domyślnie 10 / 5)
+      0 w stawce albo burst wyłącza dany kubełek
+    - LOGIN_RATE_STORE=memory | pakiet.modul:Klasa (RateLimitStore)
+    """
+    if os.getenv("LOGIN_RATE_LIMIT", "1") == "0":
+        return None
+    return LoginRateLimiter(
+        _load_store_factory(os.getenv("LOGIN_RATE_STORE", "memory")),
+        ip_per_min=float(os.getenv("LOGIN_RATE_IP_PER_MIN", "60")),
+        ip_burst=float(os.getenv("LOGIN_RATE_IP_BURST", "20")),
+        login_per_min=float(os.getenv("LOGIN_RATE_LOGIN_PER_MIN", "10")),
+        login_burst=float(os.getenv("LOGIN_RATE_LOGIN_BURST", "5")),
+    )
+
+
+login_limiter = _build_login_limiter()
@@ -0,0 +1,182 @@
+# refresh_sessions.py
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app_log import get_logger
+from src.models import RefreshSession
+
+log = get_logger("auth.sessions")
+
+# ile aktywnych refresh sesji może mieć jeden user (0 = bez limitu)
+MAX_SESSIONS_PER_USER = int(os.getenv("REFRESH_MAX_SESSIONS", "10"))
+
+
+async def add_refresh_session(
+    db: AsyncSession,
+    id_user: int,
+    token_hash: str,
+    expires_at: datetime,
+) -> None:
+    """
+    Dodaje sesję i pilnuje limitu MAX_SESSIONS_PER_USER: nadmiarowe aktywne sesje usera
+    (najstarsze pierwsze) są unieważniane w tej samej transakcji. Commit robi wołający.
+    """
+    db.add(RefreshSession(id_user=id_user, token_hash=token_hash, expires_at=expires_at))
+    if MAX_SESSIONS_PER_USER <= 0:
+        return
+
+    # sesja działa z autoflush=False - nowa sesja musi być widoczna dla zapytania
+    await db.flush()
+
+    now = datetime.now(timezone.utc)
+    # aktywne sesje usera od najnowszej; wszystko za pierwszymi N wylatuje
+    overflow = (
+        select(RefreshSession.id_session)
+        .where(
+            RefreshSession.id_user == id_user,
+            RefreshSession.revoked_at.is_(None),
+            RefreshSession.expires_at > now,
+        )
+        .order_by(RefreshSession.id_session.desc())
+        .offset(MAX_SESSIONS_PER_USER)
+    )
+    await db.execute(
+        update(RefreshSession)
+        .where(RefreshSession.id_session.in_(overflow.scalar_subquery()))
+        .values(revoked_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class RefreshSessionCompactor:
+    """
+    Okresowe czyszczenie refresh_sessions: usuwa sesje wygasłe oraz unieważnione
+    dawniej niż `revoked_retention` sekund.
+
+    Usuwa porcjami po `chunk` wierszy, każda porcja w osobnej, krótkiej transakcji -
+    duże czyszczenie nie blokuje tabeli (ani pliku SQLite) na długo.
+    """
+
+    def __init__(
+        self,
+        *,
+        interval: float = 3600.0,
+        chunk: int = 1000,
+        revoked_retention: float = 0.0,
+    ) -> None:
+        self._interval = interval
+        self._chunk = max(1, chunk)
+        self._revoked_retention = revoked_retention
+        self._session_factory: Optional[Callable[[], AsyncSession]] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.purged = 0
+        self.failed_runs = 0
+        self.last_run_ms = 0.0
+        self.last_purged = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._interval > 0
+
+    def start(self, session_factory: Callable[[], AsyncSession]) -> None:
+        if self._task is None and self.enabled:
+            self._session_factory = session_factory
+            self._task = asyncio.create_task(self._run(), name="refresh-session-compactor")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                purged = await self.compact(self._session_factory)
+                if purged:
+                    log.info("refresh sessions purged", extra={"purged": purged, "ms": self.last_run_ms})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed_runs += 1
+                log.error("refresh session compaction failed", extra={"error": str(e)})
+            await asyncio.sleep(self._interval)
+
+    async def compact(self, session_factory: Callable[[], AsyncSession]) -> int:
+        """Jedno pełne przejście. Zwraca liczbę usuniętych wierszy."""
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        revoked_before = now - timedelta(seconds=self._revoked_retention)
+        stale = or_(
+            RefreshSession.expires_at <= now,
+            RefreshSession.revoked_at <= revoked_before,
+        )
+
+        total = 0
+        while True:
+            async with session_factory() as db:
+                ids = (await db.execute(
+                    select(RefreshSession.id_session).where(stale).limit(self._chunk)
+                )).scalars().all()
+                if not ids:
+                    break
+                await db.execute(
+                    delete(RefreshSession)
+                    .where(RefreshSession.id_session.in_(ids))
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            total += len(ids)
+            if len(ids) < self._chunk:
+                break
+            # oddaj pętlę innym zadaniom między porcjami
+            await asyncio.sleep(0)
+
+        self.runs += 1
+        self.purged += total
+        self.last_purged = total
+        self.last_run_ms = round((time.monotonic() - started) * 1000, 2)
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "interval_s": self._interval,
+            "runs": self.runs,
+            "purged": self.purged,
+            "last_purged": self.last_purged,
+            "failed_runs": self.failed_runs,
+            "last_run_ms": self.last_run_ms,
+        }
+
+
+# REFRESH_COMPACT_INTERVAL=0 wyłącza czyszczenie w tle
+session_compactor = RefreshSessionCompactor(
+    interval=float(os.getenv("REFRESH_COMPACT_INTERVAL", "3600")),
+    chunk=int(os.getenv("REFRESH_COMPACT_CHUNK", "1000")),
+    revoked_retention=float(os.getenv("REFRESH_REVOKED_RETENTION", "0")),
+)
+
+
+if __name__ == "__main__":
+    # jednorazowe czyszczenie (np. z crona): python -m src.auth.refresh_sessions
+    from src.db import AsyncSessionLocal, async_engine
+
+    async def _main() -> None:
+        purged = await session_compactor.compact(AsyncSessionLocal)
+        log.info("refresh sessions purged", extra={"purged": purged, "ms": session_compactor.last_run_ms})
+        await async_engine.dispose()
+
+    asyncio.run(_main())
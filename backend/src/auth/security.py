@@ -1,9 +1,19 @@
-import hashlib, secrets
+import hashlib, os, secrets
 from datetime import datetime, timedelta, timezone
 from jose import jwt
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# docelowy koszt bcrypt; hashe z innym kosztem są przeliczane przy udanym logowaniu
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    # min = max = cel: needs_update() zgłasza zarówno słabsze, jak i droższe hashe
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 JWT_SECRET = "to_nie_ja_to_chat"         # najlepiej z env
 JWT_ALG = "HS256"
@@ -17,6 +27,10 @@ def hash_password(p: str) -> str:
 def verify_password(p: str, hashed: str) -> bool:
     return pwd_context.verify(p, hashed)
 
+def verify_and_update_password(p: str, hashed: str) -> tuple[bool, str | None]:
+    """(poprawne hasło?, nowy hash gdy stary ma inny koszt niż BCRYPT_ROUNDS, inaczej None)"""
+    return pwd_context.verify_and_update(p, hashed)
+
 def create_access_token(user_id: int) -> str:
     now = datetime.now(timezone.utc)
     payload = {
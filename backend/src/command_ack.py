@@ -0,0 +1,242 @@
+# command_ack.py
+import asyncio
+import bisect
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+# CMD_CORRELATION=1: komenda idzie jako {"cmd": "1", "cid": "<id>"} zamiast gołego "1".
+# Domyślnie wyłączone - zamki ze starym firmware porównują payload dosłownie.
+# Ack bez cid (stary firmware) potwierdza najstarszą oczekującą komendę urządzenia.
+CMD_CORRELATION = os.getenv("CMD_CORRELATION", "0") == "1"
+
+# granice kubełków histogramu opóźnień (ms); ostatni kubełek to +Inf
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def new_correlation_id() -> str:
+    return secrets.token_hex(8)
+
+
+def format_command(payload: str, cid: Optional[str]) -> str:
+    if cid is None or not CMD_CORRELATION:
+        return payload
+    return json.dumps({"cmd": payload, "cid": cid}, separators=(",", ":"))
+
+
+def parse_ack(payload: str) -> tuple[Optional[str], str]:
+    """
+    Payload z doorlock/<hw_uid>/ack -> (cid | None, status).
+    Akceptuje {"cid": "...", "status": "ok"|"error"}, sam cid, "1"/"ok" albo "0" (ack bez cid).
+    """
+    text = payload.strip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None, "ok"
+        cid = data.get("cid")
+        status = str(data.get("status", "ok")).lower()
+        return (str(cid) if cid else None), ("ok" if status in ("ok", "1", "true") else "error")
+    if text == "0":
+        return None, "error"
+    if text and text not in ("1", "ok"):
+        return text, "ok"
+    return None, "ok"
+
+
+class LatencyHistogram:
+    """Stałe kubełki (LATENCY_BUCKETS_MS) + suma i licznik - tanie w utrzymaniu dla wielu urządzeń."""
+
+    __slots__ = ("counts", "total", "sum_ms", "max_ms")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{b}": c for b, c in zip(LATENCY_BUCKETS_MS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.total,
+            "avg_ms": round(self.sum_ms / self.total, 2) if self.total else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "buckets": buckets,
+        }
+
+
+@dataclass
+class PendingCommand:
+    cid: str
+    hw_uid: str
+    channel: str
+    payload: str
+    sent_at: float = field(default_factory=time.monotonic)
+    # ustawiane tylko, gdy ktoś czeka na ack (?wait_ack=true)
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    future: Optional[asyncio.Future] = None
+
+
+@dataclass(frozen=True)
+class AckResult:
+    cid: str
+    status: str  # "ok" | "error"
+    latency_ms: float
+
+
+class AckTracker:
+    """
+    Komendy czekające na potwierdzenie z doorlock/<hw_uid>/ack.
+
+    - register() przed publikacją; ack z listenera (jedna subskrypcja doorlock/+/ack, inny wątek)
+      trafia do resolve(), które dopasowuje po cid albo - bez cid - do najstarszej komendy urządzenia
+    - wait() czeka na ack z timeoutem (wątek API), wynik wraca przez call_soon_threadsafe
+    - komendy bez potwierdzenia wygasają po `timeout`; opóźnienia ack trafiają do histogramów
+      (łącznie i per urządzenie, najwyżej `max_devices` urządzeń)
+    """
+
+    def __init__(self, timeout: float = 10.0, max_pending: int = 10_000, max_devices: int = 10_000) -> None:
+        self.timeout = timeout
+        self._max_pending = max_pending
+        self._max_devices = max_devices
+        self._pending: "OrderedDict[str, PendingCommand]" = OrderedDict()
+        self._by_device: dict[str, deque[str]] = {}
+        self._lock = threading.Lock()
+
+        self._latency = LatencyHistogram()
+        self._device_latency: "OrderedDict[str, LatencyHistogram]" = OrderedDict()
+        self.registered = 0
+        self.acked = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.unmatched = 0
+        # True, gdy listener w tym procesie subskrybuje doorlock/+/ack - inaczej ack nigdy nie przyjdzie
+        self.receiving = False
+
+    def register(self, hw_uid: str, channel: str, payload: str, *, wait: bool = False) -> PendingCommand:
+        cmd = PendingCommand(cid=new_correlation_id(), hw_uid=hw_uid, channel=channel, payload=payload)
+        if wait:
+            cmd.loop = asyncio.get_running_loop()
+            cmd.future = cmd.loop.create_future()
+        with self._lock:
+            self._expire(time.monotonic())
+            while len(self._pending) >= self._max_pending:
+                self._drop(next(iter(self._pending)))
+                self.timeouts += 1
+            self._pending[cmd.cid] = cmd
+            self._by_device.setdefault(hw_uid, deque()).append(cmd.cid)
+            self.registered += 1
+        return cmd
+
+    def resolve(self, hw_uid: str, cid: Optional[str], status: str = "ok") -> Optional[AckResult]:
+        """Wołane z listenera. None, gdy ack nie pasuje do żadnej oczekującej komendy."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if cid is None:
+                queue = self._by_device.get(hw_uid)
+                cid = queue[0] if queue else None
+            cmd = self._pending.get(cid) if cid else None
+            if cmd is None or cmd.hw_uid != hw_uid:
+                self.unmatched += 1
+                return None
+            self._drop(cid)
+
+            latency_ms = (now - cmd.sent_at) * 1000
+            self._latency.add(latency_ms)
+            hist = self._device_latency.pop(hw_uid, None) or LatencyHistogram()
+            hist.add(latency_ms)
+            self._device_latency[hw_uid] = hist
+            while len(self._device_latency) > self._max_devices:
+                self._device_latency.popitem(last=False)
+            if status == "ok":
+                self.acked += 1
+            else:
+                self.errors += 1
+
+        result = AckResult(cid=cmd.cid, status=status, latency_ms=round(latency_ms, 2))
+        if cmd.future is not None:
+            try:
+                cmd.loop.call_soon_threadsafe(_set_result, cmd.future, result)
+            except RuntimeError:
+                pass  # pętla czekającego już zamknięta
+        return result
+
+    async def wait(self, cmd: PendingCommand, timeout: Optional[float] = None) -> Optional[AckResult]:
+        """AckResult albo None po timeoucie (komenda jest wtedy zapominana)."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(cmd.future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if cmd.cid in self._pending:
+                    self._drop(cmd.cid)
+                    self.timeouts += 1
+            return None
+
+    def forget(self, cmd: PendingCommand) -> None:
+        """Komenda nie wyszła (błąd publikacji) - nie czekamy na jej ack."""
+        with self._lock:
+            if cmd.cid in self._pending:
+                self._drop(cmd.cid)
+
+    def _drop(self, cid: str) -> None:
+        cmd = self._pending.pop(cid)
+        queue = self._by_device.get(cmd.hw_uid)
+        if queue is not None:
+            try:
+                queue.remove(cid)
+            except ValueError:
+                pass
+            if not queue:
+                del self._by_device[cmd.hw_uid]
+
+    def _expire(self, now: float) -> None:
+        # _pending w kolejności rejestracji - najstarsze na początku
+        while self._pending:
+            cid, cmd = next(iter(self._pending.items()))
+            if now - cmd.sent_at < self.timeout:
+                return
+            self._drop(cid)
+            self.timeouts += 1
+
+    def device_latency(self, hw_uid: str) -> dict:
+        with self._lock:
+            hist = self._device_latency.get(hw_uid)
+            return hist.snapshot() if hist is not None else LatencyHistogram().snapshot()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "receiving": self.receiving,
+                "pending": len(self._pending),
+                "registered": self.registered,
+                "acked": self.acked,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "unmatched": self.unmatched,
+                "latency": self._latency.snapshot(),
+            }
+
+
+def _set_result(future: asyncio.Future, result: AckResult) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+ack_tracker = AckTracker(
+    timeout=float(os.getenv("CMD_ACK_TIMEOUT", "10")),
+    max_pending=int(os.getenv("CMD_ACK_MAX_PENDING", "10000")),
+)
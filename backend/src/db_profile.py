@@ -0,0 +1,151 @@
+# db_profile.py
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """
+    Ustawienia bazy wybierane konfiguracją (DB_PROFILE + pojedyncze nadpisania z env).
+    Pragmy dotyczą tylko SQLite, ustawienia puli - każdej bazy.
+    """
+    name: str
+    # SQLite PRAGMA (None = zostaw domyślne SQLite)
+    journal_mode: Optional[str] = None
+    synchronous: Optional[str] = None
+    mmap_size: Optional[int] = None
+    cache_size: Optional[int] = None       # ujemne = KiB, dodatnie = strony
+    busy_timeout: Optional[int] = None     # ms
+    temp_store: Optional[str] = None
+    # pula połączeń (None = domyślne SQLAlchemy)
+    pool_size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    pool_timeout: Optional[float] = None
+    pool_recycle: Optional[int] = None
+    pool_pre_ping: bool = False
+
+    def sqlite_pragmas(self) -> dict[str, object]:
+        pragmas = {
+            "journal_mode": self.journal_mode,
+            "synchronous": self.synchronous,
+            "mmap_size": self.mmap_size,
+            "cache_size": self.cache_size,
+            "busy_timeout": self.busy_timeout,
+            "temp_store": self.temp_store,
+        }
+        return {k: v for k, v in pragmas.items() if v is not None}
+
+    def pool_kwargs(self) -> dict[str, object]:
+        kwargs = {
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+        }
+        kwargs = {k: v for k, v in kwargs.items() if v is not None}
+        if self.pool_pre_ping:
+            kwargs["pool_pre_ping"] = True
+        return kwargs
+
+
+PROFILES: dict[str, StorageProfile] = {
+    # dotychczasowe zachowanie: domyślne pragmy SQLite i domyślna pula
+    "default": StorageProfile(name="default"),
+    # SQLite pod realnym ruchem: WAL (czytelnicy nie czekają na pisarza), busy_timeout
+    # zamiast natychmiastowego "database is locked", większy cache i mmap
+    "production": StorageProfile(
+        name="production",
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        mmap_size=256 * 1024 * 1024,
+        cache_size=-64 * 1024,
+        busy_timeout=5000,
+        temp_store="MEMORY",
+        pool_size=10,
+        max_overflow=20,
+        pool_timeout=30,
+        pool_recycle=1800,
+        pool_pre_ping=True,
+    ),
+}
+
+# nadpisania pojedynczych ustawień: zmienna env -> (pole profilu, typ)
+_ENV_OVERRIDES = {
+    "DB_SQLITE_JOURNAL_MODE": ("journal_mode", str),
+    "DB_SQLITE_SYNCHRONOUS": ("synchronous", str),
+    "DB_SQLITE_MMAP_SIZE": ("mmap_size", int),
+    "DB_SQLITE_CACHE_SIZE": ("cache_size", int),
+    "DB_SQLITE_BUSY_TIMEOUT": ("busy_timeout", int),
+    "DB_SQLITE_TEMP_STORE": ("temp_store", str),
+    "DB_POOL_SIZE": ("pool_size", int),
+    "DB_MAX_OVERFLOW": ("max_overflow", int),
+    "DB_POOL_TIMEOUT": ("pool_timeout", float),
+    "DB_POOL_RECYCLE": ("pool_recycle", int),
+}
+
+
+def load_storage_profile() -> StorageProfile:
+    name = os.getenv("DB_PROFILE", "default").strip().lower()
+    if name not in PROFILES:
+        raise RuntimeError(f"Nieznany DB_PROFILE: {name} (dostępne: {', '.join(PROFILES)})")
+
+    profile = PROFILES[name]
+    overrides: dict[str, object] = {}
+    for env_name, (attr, cast) in _ENV_OVERRIDES.items():
+        val = os.getenv(env_name)
+        if val:
+            overrides[attr] = cast(val)
+    if os.getenv("DB_POOL_PRE_PING"):
+        overrides["pool_pre_ping"] = os.getenv("DB_POOL_PRE_PING", "").lower() in ("1", "true", "yes")
+
+    return replace(profile, **overrides) if overrides else profile
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    u = make_url(url)
+    return u.get_backend_name() == "sqlite" and u.database in (None, "", ":memory:")
+
+
+def engine_kwargs(url: str, profile: StorageProfile) -> dict[str, object]:
+    """Argumenty create_engine/create_async_engine dla danego URL i profilu."""
+    kwargs: dict[str, object] = {}
+    if is_sqlite(url):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    # SQLite w pamięci używa puli jednego połączenia - parametry puli tam nie pasują
+    if not _is_sqlite_memory(url):
+        kwargs.update(profile.pool_kwargs())
+    return kwargs
+
+
+def apply_sqlite_pragmas(engine: Engine, profile: StorageProfile) -> None:
+    """Ustawia pragmy profilu na każdym nowym połączeniu (sync Engine albo AsyncEngine.sync_engine)."""
+    pragmas = profile.sqlite_pragmas()
+    if not pragmas or engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _record) -> None:
+        cursor = dbapi_conn.cursor()
+        try:
+            for key, value in pragmas.items():
+                cursor.execute(f"PRAGMA {key}={value}")
+        finally:
+            cursor.close()
+
+
+def describe(url: str, profile: StorageProfile) -> str:
+    """Jedna linia do logu startowego: który profil i z jakimi ustawieniami."""
+    safe_url = make_url(url).render_as_string(hide_password=True)
+    parts = [f"profile={profile.name}", f"url={safe_url}"]
+    if is_sqlite(url):
+        parts += [f"{k}={v}" for k, v in profile.sqlite_pragmas().items()]
+    parts += [f"{k}={v}" for k, v in profile.pool_kwargs().items()]
+    return " ".join(parts)
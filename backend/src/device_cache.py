@@ -0,0 +1,142 @@
+# device_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from sqlalchemy import event, inspect
+
+from src.models import Device
+
+
+@dataclass(frozen=True)
+class CachedDevice:
+    """Lekka kopia wiersza devices - tylko to, czego potrzebują trasy stanu/alarmu."""
+    id_device: int
+    hw_uid: str
+    id_user: Optional[int]
+    name: str
+    is_open: bool
+    alarm_active: bool
+
+    @classmethod
+    def from_device(cls, device: Device) -> "CachedDevice":
+        return cls(
+            id_device=device.id_device,
+            hw_uid=device.hw_uid,
+            id_user=device.id_user,
+            name=device.name,
+            is_open=bool(device.is_open),
+            alarm_active=bool(device.alarm_active),
+        )
+
+
+class DeviceCache:
+    """
+    Cache urządzeń w pamięci procesu, kluczowany hw_uid.
+    - LRU z limitem rozmiaru + TTL na wpis
+    - write-through: trasy zapisujące stan wołają put() po commicie
+    - invalidate()/invalidate_user()/clear() dla wszystkiego, co zmienia devices poza trasami
+    Blokada, bo z cache korzysta też wątek listenera MQTT.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 30.0) -> None:
+        self._max_size = max_size
+        self._ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, CachedDevice]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, hw_uid: str) -> Optional[CachedDevice]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(hw_uid)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, device = entry
+            if expires_at <= now:
+                del self._data[hw_uid]
+                self.misses += 1
+                return None
+            self._data.move_to_end(hw_uid)
+            self.hits += 1
+            return device
+
+    def put(self, device: CachedDevice) -> None:
+        if not device.hw_uid or self._max_size <= 0:
+            return
+        with self._lock:
+            self._data[device.hw_uid] = (time.monotonic() + self._ttl, device)
+            self._data.move_to_end(device.hw_uid)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def put_device(self, device: Device) -> CachedDevice:
+        cached = CachedDevice.from_device(device)
+        self.put(cached)
+        return cached
+
+    def update(self, hw_uid: str, **changes) -> None:
+        """Zmienia pola istniejącego wpisu (np. is_open po zapisie stanu z MQTT); brak wpisu = nic."""
+        with self._lock:
+            entry = self._data.get(hw_uid)
+            if entry is not None:
+                expires_at, device = entry
+                self._data[hw_uid] = (expires_at, replace(device, **changes))
+
+    def invalidate(self, hw_uid: str) -> None:
+        with self._lock:
+            if self._data.pop(hw_uid, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_user(self, id_user: int) -> None:
+        with self._lock:
+            stale = [k for k, (_, d) in self._data.items() if d.id_user == id_user]
+            for k in stale:
+                del self._data[k]
+            self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self._max_size,
+            "ttl": self._ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+device_cache = DeviceCache(
+    max_size=int(os.getenv("DEVICE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("DEVICE_CACHE_TTL", "30")),
+)
+
+
+# Każda zmiana/usunięcie Device przez ORM (poza trasami stanu) unieważnia wpis.
+# Zapisy przez core (update()/executemany) muszą same zawołać device_cache.invalidate().
+@event.listens_for(Device, "after_update")
+@event.listens_for(Device, "after_delete")
+def _invalidate_on_change(mapper, connection, target: Device) -> None:
+    if target.hw_uid:
+        device_cache.invalidate(target.hw_uid)
+    # zmiana samego hw_uid - stary klucz też wylatuje
+    for old_uid in inspect(target).attrs.hw_uid.history.deleted or ():
+        if old_uid:
+            device_cache.invalidate(old_uid)
@@ -0,0 +1,338 @@
+# device_import.py
+"""
+Masowe zakładanie urządzeń z CSV/JSONL (CLI i POST /admin/devices/import).
+
+Wiersz: hw_uid (wymagane), name, opis, owner (username albo email usera; puste = bez zmiany).
+- wejście czytane strumieniowo, linia po linii - pamięć stała niezależnie od rozmiaru pliku
+- zapis paczkami (IMPORT_CHUNK, domyślnie 1000) jako upsert po hw_uid, każda paczka w osobnej
+  transakcji; błąd paczki nie przerywa importu
+- istniejące urządzenie: name/opis/owner nadpisywane tylko, gdy podane w wierszu
+  (import nie odpina urządzeń od userów); nowe bez name dostaje name = hw_uid
+- błędy per wiersz (numer linii, hw_uid, powód) - najwyżej IMPORT_MAX_ERRORS w raporcie
+
+CLI:
+    python -m src.device_import devices.csv
+    python -m src.device_import devices.jsonl --format jsonl --chunk 5000
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.alarm_repo import recipient_cache
+from src.app_log import get_logger
+from src.device_cache import device_cache
+from src.models import Device, User
+
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+_devices = Device.__table__
+_UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+_HW_UID_MAX = _devices.c.hw_uid.type.length
+_NAME_MAX = _devices.c.name.type.length
+
+log = get_logger("device_import")
+
+
+@dataclass
+class RowError:
+    line: int
+    hw_uid: Optional[str]
+    error: str
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    chunks: int = 0
+    elapsed_ms: int = 0
+    errors: list[RowError] = field(default_factory=list)
+    # błędy ponad IMPORT_MAX_ERRORS są tylko liczone
+    errors_truncated: int = 0
+
+    def add_error(self, line: int, hw_uid: Optional[str], error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(RowError(line, hw_uid, error))
+        else:
+            self.errors_truncated += 1
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+    def progress(self) -> dict:
+        """Same liczniki (bez listy błędów) - linia postępu importu."""
+        return {
+            "rows": self.rows, "inserted": self.inserted, "updated": self.updated,
+            "failed": self.failed, "chunks": self.chunks,
+        }
+
+
+@dataclass
+class _Row:
+    line: int
+    hw_uid: str
+    name: Optional[str]
+    opis: Optional[str]
+    owner: Optional[str]
+
+
+# --- wejście ---
+
+async def iter_file_lines(lines: Iterable[str]) -> AsyncIterator[str]:
+    for line in lines:
+        yield line
+
+
+async def parse_rows(lines: AsyncIterable[str], fmt: str) -> AsyncIterator[tuple[int, dict]]:
+    """(numer linii, pola) dla CSV z nagłówkiem albo JSONL. Niepoprawna linia -> pola {"_error": ...}."""
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError("format musi być 'csv' albo 'jsonl'")
+
+    header: Optional[list[str]] = None
+    pending, start = "", 0
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        line = line.rstrip("\r")
+        if fmt == "jsonl":
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield line_no, {"_error": f"invalid JSON: {e}"}
+                continue
+            yield line_no, data if isinstance(data, dict) else {"_error": "expected a JSON object"}
+            continue
+
+        # CSV: pole w cudzysłowie może zawierać nową linię - sklejamy do zamknięcia cudzysłowu
+        pending = f"{pending}\n{line}" if pending else line
+        start = start or line_no
+        if pending.count('"') % 2:
+            continue
+        text, row_line, pending, start = pending, start, "", 0
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [h.strip().lower() for h in values]
+            continue
+        if len(values) > len(header):
+            yield row_line, {"_error": f"expected {len(header)} columns, got {len(values)}"}
+            continue
+        yield row_line, dict(zip(header, values))
+    if pending:
+        yield start, {"_error": "unterminated quoted field"}
+
+
+def _clean(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _validate(line: int, data: dict, report: ImportReport) -> Optional[_Row]:
+    if "_error" in data:
+        report.add_error(line, None, data["_error"])
+        return None
+    hw_uid = _clean(data.get("hw_uid"))
+    if hw_uid is None:
+        report.add_error(line, None, "missing hw_uid")
+        return None
+    if len(hw_uid) > _HW_UID_MAX:
+        report.add_error(line, hw_uid, f"hw_uid longer than {_HW_UID_MAX} characters")
+        return None
+    name = _clean(data.get("name"))
+    if name is not None and len(name) > _NAME_MAX:
+        report.add_error(line, hw_uid, f"name longer than {_NAME_MAX} characters")
+        return None
+    return _Row(line, hw_uid, name, _clean(data.get("opis")), _clean(data.get("owner")))
+
+
+# --- zapis ---
+
+def _upsert_statement(dialect: str):
+    if dialect not in _UPSERT_DIALECTS:
+        raise RuntimeError(f"Brak upsertu dla bazy: {dialect}")
+    stmt = _UPSERT_DIALECTS[dialect](_devices)
+    # puste opis/owner w wierszu = zostaw obecne (None w VALUES -> coalesce bierze starą wartość)
+    return stmt.on_conflict_do_update(
+        index_elements=[_devices.c.hw_uid],
+        set_={
+            "name": stmt.excluded.name,
+            "opis": func.coalesce(stmt.excluded.opis, _devices.c.opis),
+            "id_user": func.coalesce(stmt.excluded.id_user, _devices.c.id_user),
+        },
+    )
+
+
+async def _write_chunk(db: AsyncSession, rows: list[_Row], report: ImportReport) -> list[str]:
+    """Upsert jednej paczki. Zwraca hw_uid faktycznie zapisanych urządzeń (do unieważnienia cache)."""
+    # błędy wierszy trafiają do raportu dopiero po commicie - wycofana paczka raportuje każdy wiersz raz
+    errors: list[RowError] = []
+
+    # powtórzony hw_uid w paczce - wygrywa ostatni wiersz (upsert nie zmieni tego samego wiersza dwa razy)
+    latest: dict[str, _Row] = {}
+    for row in rows:
+        previous = latest.get(row.hw_uid)
+        if previous is not None:
+            errors.append(RowError(previous.line, row.hw_uid, f"duplicate hw_uid, replaced by line {row.line}"))
+        latest[row.hw_uid] = row
+    rows = list(latest.values())
+
+    owners = {row.owner for row in rows if row.owner}
+    owner_ids: dict[str, int] = {}
+    if owners:
+        result = await db.execute(
+            select(User.id_user, User.username, User.email).where(
+                or_(User.username.in_(owners), User.email.in_(owners))
+            )
+        )
+        for id_user, username, email in result:
+            owner_ids[username] = id_user
+            owner_ids[email] = id_user
+
+    existing = dict((await db.execute(
+        select(Device.hw_uid, Device.name).where(Device.hw_uid.in_([row.hw_uid for row in rows]))
+    )).all())
+
+    params = []
+    for row in rows:
+        if row.owner and row.owner not in owner_ids:
+            errors.append(RowError(row.line, row.hw_uid, f"unknown owner: {row.owner}"))
+            continue
+        params.append({
+            "hw_uid": row.hw_uid,
+            # brak name: istniejące zachowuje swoją, nowe dostaje hw_uid
+            "name": row.name or existing.get(row.hw_uid) or row.hw_uid,
+            "opis": row.opis,
+            "id_user": owner_ids.get(row.owner) if row.owner else None,
+        })
+    if params:
+        await db.execute(_upsert_statement(db.bind.dialect.name), params)
+        await db.commit()
+
+    for error in sorted(errors, key=lambda e: e.line):
+        report.add_error(error.line, error.hw_uid, error.error)
+
+    updated = sum(p["hw_uid"] in existing for p in params)
+    report.updated += updated
+    report.inserted += len(params) - updated
+    return [p["hw_uid"] for p in params]
+
+
+def _invalidate_caches(hw_uids: list[str]) -> None:
+    # zapis przez core omija zdarzenia ORM, które normalnie czyszczą cache
+    for hw_uid in hw_uids:
+        device_cache.invalidate(hw_uid)
+        recipient_cache.invalidate(hw_uid)
+
+
+async def import_devices(
+    session_factory: async_sessionmaker[AsyncSession],
+    rows: AsyncIterable[tuple[int, dict]],
+    *,
+    chunk_size: int = IMPORT_CHUNK,
+    on_progress: Optional[Callable[[ImportReport], Awaitable[None] | None]] = None,
+) -> ImportReport:
+    report = ImportReport()
+    started = time.monotonic()
+    chunk: list[_Row] = []
+
+    async def flush() -> None:
+        report.chunks += 1
+        try:
+            async with session_factory() as db:
+                written = await _write_chunk(db, chunk, report)
+        except Exception as e:
+            # cała paczka wycofana - każdy jej wiersz jako błąd, import idzie dalej
+            log.error("import chunk failed", extra={"chunk": report.chunks, "rows": len(chunk), "error": str(e)})
+            for row in chunk:
+                report.add_error(row.line, row.hw_uid, f"chunk failed: {e}")
+            written = []
+        _invalidate_caches(written)
+        chunk.clear()
+        if on_progress is not None:
+            result = on_progress(report)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async for line, data in rows:
+        report.rows += 1
+        row = _validate(line, data, report)
+        if row is not None:
+            chunk.append(row)
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+
+    report.elapsed_ms = int((time.monotonic() - started) * 1000)
+    log.info("import finished", extra={
+        "rows": report.rows, "inserted": report.inserted, "updated": report.updated,
+        "failed": report.failed, "elapsed_ms": report.elapsed_ms,
+    })
+    return report
+
+
+def _detect_format(path: str) -> str:
+    return "jsonl" if path.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk device import (CSV/JSONL)")
+    parser.add_argument("path", help="plik z urządzeniami albo '-' (stdin)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None, help="domyślnie z rozszerzenia")
+    parser.add_argument("--chunk", type=int, default=IMPORT_CHUNK)
+    parser.add_argument("--report", default=None, help="plik na pełny raport JSON")
+    args = parser.parse_args()
+
+    from src.db import AsyncSessionLocal, async_engine, init_db
+
+    def _progress(report: ImportReport) -> None:
+        print(
+            f"[IMPORT] rows: {report.rows}, inserted: {report.inserted}, "
+            f"updated: {report.updated}, failed: {report.failed}",
+            file=sys.stderr,
+        )
+
+    async def _main() -> ImportReport:
+        fmt = args.format or ("csv" if args.path == "-" else _detect_format(args.path))
+        source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+        try:
+            rows = parse_rows(iter_file_lines(line.rstrip("\n") for line in source), fmt)
+            return await import_devices(AsyncSessionLocal, rows, chunk_size=args.chunk, on_progress=_progress)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            await async_engine.dispose()
+
+    init_db()
+    result = asyncio.run(_main())
+    for err in result.errors:
+        print(f"[IMPORT] line {err.line} ({err.hw_uid or '-'}): {err.error}", file=sys.stderr)
+    if result.errors_truncated:
+        print(f"[IMPORT] ... and {result.errors_truncated} more errors", file=sys.stderr)
+    print(
+        f"[IMPORT] Done ✔ rows: {result.rows}, inserted: {result.inserted}, updated: {result.updated}, "
+        f"failed: {result.failed} ({result.elapsed_ms} ms)"
+    )
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(result.as_dict(), f, indent=2)
+    sys.exit(1 if result.failed else 0)
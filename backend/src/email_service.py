@@ -1,7 +1,16 @@
 # email_service.py
+import asyncio
 import os
 import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
 from email.message import EmailMessage
+from typing import Iterator, Optional
+
+from src.metrics import EMAIL_SEND_FAILURES, EMAIL_SEND_SECONDS
 
 
 def _require_env(name: str) -> str:
@@ -11,12 +20,240 @@ def _require_env(name: str) -> str:
     return val
 
 
-def send_alarm_email(to_email: str, hw_uid: str, device_name: str | None = None) -> None:
-    host = _require_env("SMTP_HOST")
-    port = int(os.getenv("SMTP_PORT", "587"))
-    user = _require_env("SMTP_USER")
-    password = _require_env("SMTP_PASS")
-    mail_from = os.getenv("SMTP_FROM", user)
+class _ConnectionLost(Exception):
+    """Połączenie SMTP nadaje się tylko do wyrzucenia (reconnect + ponowienie)."""
+
+
+def _is_connection_error(e: BaseException) -> bool:
+    # SMTPException dziedziczy po OSError, więc sam OSError nie wystarczy
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code == 421:
+        return True
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+
+class SmtpPool:
+    """
+    Pula zalogowanych połączeń SMTP (STARTTLS).
+
+    - połączenie jest trzymane po wysyłce i używane ponownie (bez EHLO/STARTTLS/LOGIN za każdym razem)
+    - przed użyciem połączenia, które długo leżało, idzie NOOP; martwe jest zastępowane nowym
+    - połączenia bezczynne dłużej niż idle_timeout są zamykane
+    - max_connections ogranicza liczbę równoległych sesji (limity dostawcy)
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: str,
+        password: str,
+        *,
+        max_connections: int = 2,
+        noop_after: float = 30.0,
+        idle_timeout: float = 240.0,
+        timeout: float = 15.0,
+        starttls: bool = True,
+    ) -> None:
+        self._host = host
+        self._port = port
+        self._user = user
+        self._password = password
+        self._noop_after = noop_after
+        self._idle_timeout = idle_timeout
+        self._timeout = timeout
+        self._starttls = starttls
+
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle: deque[tuple[float, smtplib.SMTP]] = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.connects = 0
+        self.reuses = 0
+        self.sent = 0
+        self.failed = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self._host, self._port, timeout=self._timeout)
+        try:
+            smtp.ehlo()
+            if self._starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            smtp.login(self._user, self._password)
+        except Exception:
+            _quiet_close(smtp)
+            raise
+        self.connects += 1
+        return smtp
+
+    def _take_idle(self) -> Optional[smtplib.SMTP]:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                last_used, smtp = self._idle.pop()
+
+            idle_for = now - last_used
+            if idle_for > self._idle_timeout:
+                _quiet_close(smtp)
+                continue
+            if idle_for > self._noop_after:
+                try:
+                    code, _ = smtp.noop()
+                    if code != 250:
+                        raise smtplib.SMTPServerDisconnected(f"NOOP -> {code}")
+                except Exception:
+                    _quiet_close(smtp)
+                    continue
+            self.reuses += 1
+            return smtp
+
+    def _release(self, smtp: smtplib.SMTP) -> None:
+        with self._lock:
+            if not self._closed:
+                self._idle.append((time.monotonic(), smtp))
+                return
+        _quiet_close(smtp)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """Wypożycza zalogowane połączenie (czeka, gdy wszystkie sloty są zajęte)."""
+        with self._slots:
+            smtp = self._take_idle() or self._connect()
+            try:
+                yield smtp
+            except Exception as e:
+                if _is_connection_error(e) or isinstance(e, _ConnectionLost):
+                    _quiet_close(smtp)
+                else:
+                    # błąd na poziomie wiadomości (np. odrzucony adres) - połączenie dalej jest dobre
+                    self._release(smtp)
+                raise
+            else:
+                self._release(smtp)
+
+    def send(self, msg: EmailMessage) -> None:
+        self.send_many([msg], raise_errors=True)
+
+    def send_many(self, messages: list[EmailMessage], raise_errors: bool = False) -> list[Optional[Exception]]:
+        """
+        Wysyła wiele wiadomości jedną zalogowaną sesją.
+        Po zerwaniu połączenia łączy się ponownie i ponawia bieżącą wiadomość (raz).
+        Zwraca błędy w kolejności wiadomości (None = wysłana).
+        """
+        errors: list[Optional[Exception]] = [None] * len(messages)
+        pending = list(range(len(messages)))
+        retried = False
+
+        while pending:
+            try:
+                with self.connection() as smtp:
+                    while pending:
+                        idx = pending[0]
+                        try:
+                            smtp.send_message(messages[idx])
+                            self.sent += 1
+                        except Exception as e:
+                            if _is_connection_error(e):
+                                raise _ConnectionLost(str(e)) from e
+                            self.failed += 1
+                            errors[idx] = e
+                        pending.pop(0)
+            except Exception as e:
+                if not (_is_connection_error(e) or isinstance(e, _ConnectionLost)):
+                    # np. błąd logowania przy nowym połączeniu - nie ma sensu ponawiać
+                    for idx in pending:
+                        self.failed += 1
+                        errors[idx] = e
+                    break
+                if retried:
+                    for idx in pending:
+                        self.failed += 1
+                        errors[idx] = e
+                    break
+                retried = True
+
+        if raise_errors:
+            for err in errors:
+                if err is not None:
+                    raise err
+        return errors
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for _, smtp in idle:
+            try:
+                smtp.quit()
+            except Exception:
+                _quiet_close(smtp)
+
+    def stats(self) -> dict:
+        return {
+            "idle": len(self._idle),
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+def _quiet_close(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.close()
+    except Exception:
+        pass
+
+
+_pool: Optional[SmtpPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SmtpPool:
+    """
+    Wspólna pula SMTP procesu. Konfiguracja:
+    - SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS (jak wcześniej)
+    - SMTP_MAX_CONNECTIONS (domyślnie 2)
+    - SMTP_NOOP_AFTER      (sekundy bezczynności, po których przed użyciem idzie NOOP; domyślnie 30)
+    - SMTP_IDLE_TIMEOUT    (sekundy, po których bezczynne połączenie jest zamykane; domyślnie 240)
+    - SMTP_STARTTLS        (0 = bez STARTTLS, tylko lokalny serwer testowy; domyślnie 1)
+    """
+    global _pool
+
+    if _pool is not None:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = SmtpPool(
+                _require_env("SMTP_HOST"),
+                int(os.getenv("SMTP_PORT", "587")),
+                _require_env("SMTP_USER"),
+                _require_env("SMTP_PASS"),
+                max_connections=int(os.getenv("SMTP_MAX_CONNECTIONS", "2")),
+                noop_after=float(os.getenv("SMTP_NOOP_AFTER", "30")),
+                idle_timeout=float(os.getenv("SMTP_IDLE_TIMEOUT", "240")),
+                starttls=os.getenv("SMTP_STARTTLS", "1") != "0",
+            )
+    return _pool
+
+
+def close_smtp_pool() -> None:
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def build_alarm_email(to_email: str, hw_uid: str, device_name: str | None = None) -> EmailMessage:
+    mail_from = os.getenv("SMTP_FROM") or _require_env("SMTP_USER")
 
     subject = "ALARM: wykryto zdarzenie z urządzenia"
     pretty_name = f" ({device_name})" if device_name else ""
@@ -30,11 +267,90 @@ def send_alarm_email(to_email: str, hw_uid: str, device_name: str | None = None)
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.set_content(body)
+    return msg
+
+
+def build_alarm_digest_email(
+    to_email: str,
+    hw_uid: str,
+    device_name: str | None,
+    count: int,
+    first: datetime,
+    last: datetime,
+) -> EmailMessage:
+    mail_from = os.getenv("SMTP_FROM") or _require_env("SMTP_USER")
+
+    pretty_name = f" ({device_name})" if device_name else ""
+    fmt = "%Y-%m-%d %H:%M:%S"
+    body = (
+        f"Urządzenie o hw_uid: {hw_uid}{pretty_name} zgłosiło kolejne alarmy.\n\n"
+        f"{count} alarm(ów) między {first.strftime(fmt)} a {last.strftime(fmt)}.\n\n"
+        f"Jeśli to nie Ty, sprawdź stan zamka w aplikacji."
+    )
+
+    msg = EmailMessage()
+    msg["From"] = mail_from
+    msg["To"] = to_email
+    msg["Subject"] = f"ALARM: {count} kolejnych zdarzeń z urządzenia"
+    msg.set_content(body)
+    return msg
+
+
+def _send_timed(kind: str, msg: EmailMessage) -> None:
+    # czas wysyłki i błędy -> /metrics (alarm_email_send_*)
+    started = time.perf_counter()
+    try:
+        get_smtp_pool().send(msg)
+    except Exception:
+        EMAIL_SEND_FAILURES.labels(kind).inc()
+        raise
+    EMAIL_SEND_SECONDS.labels(kind).observe(time.perf_counter() - started)
+
+
+def send_alarm_email(to_email: str, hw_uid: str, device_name: str | None = None) -> None:
+    # STARTTLS + LOGIN robi pula, tylko gdy nie ma gotowego połączenia
+    _send_timed("alarm", build_alarm_email(to_email, hw_uid, device_name))
+
+
+async def send_alarm_email_async(to_email: str, hw_uid: str, device_name: str | None = None) -> None:
+    """Jak send_alarm_email, ale bez blokowania pętli zdarzeń."""
+    await asyncio.to_thread(send_alarm_email, to_email, hw_uid, device_name)
+
+
+def _send_many_timed(messages: list[tuple[str, EmailMessage]]) -> list[Optional[Exception]]:
+    started = time.perf_counter()
+    errors = get_smtp_pool().send_many([msg for _, msg in messages])
+    # jedna sesja: każdy mail dostaje czas całej paczki (górne oszacowanie)
+    elapsed = time.perf_counter() - started
+    for (kind, _), err in zip(messages, errors):
+        if err is None:
+            EMAIL_SEND_SECONDS.labels(kind).observe(elapsed)
+        else:
+            EMAIL_SEND_FAILURES.labels(kind).inc()
+    return errors
+
+
+async def send_alarm_emails_async(messages: list[tuple[str, EmailMessage]]) -> list[Optional[Exception]]:
+    """
+    Wysyła kilka gotowych maili (kind "alarm"/"digest", wiadomość) jedną sesją SMTP.
+    Zwraca błędy w kolejności wiadomości (None = wysłany).
+    """
+    try:
+        return await asyncio.to_thread(_send_many_timed, messages)
+    except Exception as e:
+        # np. brak konfiguracji SMTP - błąd dla każdej wiadomości, jak przy pojedynczej wysyłce
+        for kind, _ in messages:
+            EMAIL_SEND_FAILURES.labels(kind).inc()
+        return [e for _ in messages]
+
 
-    # STARTTLS
-    with smtplib.SMTP(host, port, timeout=15) as smtp:
-        smtp.ehlo()
-        smtp.starttls()
-        smtp.ehlo()
-        smtp.login(user, password)
-        smtp.send_message(msg)
+async def send_alarm_digest_email_async(
+    to_email: str,
+    hw_uid: str,
+    device_name: str | None,
+    count: int,
+    first: datetime,
+    last: datetime,
+) -> None:
+    msg = build_alarm_digest_email(to_email, hw_uid, device_name, count, first, last)
+    await asyncio.to_thread(_send_timed, "digest", msg)
@@ -0,0 +1,121 @@
+# event_hub.py
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+
+@dataclass(frozen=True)
+class StateChange:
+    """Zmiana stanu urządzenia wysyłana do subskrybentów strumienia."""
+    hw_uid: str
+    kind: str      # "state" | "alarm" | "alarm_triggered"
+    value: str     # np. "open"/"closed", "active"/"inactive", "1"
+    source: str    # "api" | "device"
+    ts: float = field(default_factory=time.time)
+
+
+class Subscriber:
+    """
+    Jeden klient strumienia. Kolejka jest ograniczona; gdy klient nie nadąża i kolejka się
+    zapełni, subskrybent jest odłączany (dostaje None i kończy strumień), zamiast spowalniać innych.
+    """
+
+    def __init__(self, hub: "EventHub", hw_uids: Iterable[str], maxsize: int) -> None:
+        self._hub = hub
+        self.hw_uids = frozenset(hw_uids)
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[Optional[StateChange]] = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    def _offer(self, change: StateChange) -> None:
+        # zawsze w pętli subskrybenta
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(change)
+            self._hub.delivered += 1
+        except asyncio.QueueFull:
+            self.dropped = True
+            self._hub.dropped_subscribers += 1
+            self._hub.unsubscribe(self)
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout: float) -> Optional[StateChange]:
+        """Następna zmiana; TimeoutError, gdy nic nie przyszło (czas na heartbeat)."""
+        return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+
+
+class EventHub:
+    """
+    Pub/sub w pamięci procesu: publikujący (trasy POST, listener MQTT w swoim wątku)
+    -> subskrybenci strumienia, indeksowani po hw_uid.
+    publish() jest bezpieczne wątkowo: do pętli subskrybenta trafia przez call_soon_threadsafe.
+    """
+
+    def __init__(self, queue_size: int = 100) -> None:
+        self.queue_size = queue_size
+        self._by_hw_uid: dict[str, set[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(self, hw_uids: Iterable[str]) -> Subscriber:
+        """Wywoływać z pętli, w której subskrybent będzie czytał."""
+        sub = Subscriber(self, hw_uids, self.queue_size)
+        with self._lock:
+            for hw_uid in sub.hw_uids:
+                self._by_hw_uid.setdefault(hw_uid, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            for hw_uid in sub.hw_uids:
+                subs = self._by_hw_uid.get(hw_uid)
+                if subs is None:
+                    continue
+                subs.discard(sub)
+                if not subs:
+                    del self._by_hw_uid[hw_uid]
+
+    def publish(self, change: StateChange) -> None:
+        with self._lock:
+            subs = list(self._by_hw_uid.get(change.hw_uid, ()))
+        self.published += 1
+        if not subs:
+            return
+
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+
+        for sub in subs:
+            if sub.loop is current:
+                sub._offer(change)
+            else:
+                try:
+                    sub.loop.call_soon_threadsafe(sub._offer, change)
+                except RuntimeError:
+                    # pętla subskrybenta już zamknięta
+                    self.unsubscribe(sub)
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = len({s for subs in self._by_hw_uid.values() for s in subs})
+        return {
+            "subscribers": subscribers,
+            "watched_devices": len(self._by_hw_uid),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+event_hub = EventHub(queue_size=int(os.getenv("STREAM_QUEUE_SIZE", "100")))
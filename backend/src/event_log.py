@@ -0,0 +1,191 @@
+# event_log.py
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import bindparam, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app_log import get_logger
+from src.models import Device, DeviceEvent
+
+_events = DeviceEvent.__table__
+_devices = Device.__table__
+
+log = get_logger("events")
+
+# zdarzenia z API - id_device jest znane
+_INSERT_BY_ID = insert(_events).values(
+    id_device=bindparam("b_id_device"),
+    ts=bindparam("b_ts"),
+    kind=bindparam("b_kind"),
+    value=bindparam("b_value"),
+    source=bindparam("b_source"),
+)
+
+# zdarzenia z MQTT - znamy tylko hw_uid; INSERT ... SELECT, nieznane hw_uid po prostu nic nie wstawia
+_INSERT_BY_HW_UID = insert(_events).from_select(
+    ["id_device", "ts", "kind", "value", "source"],
+    select(
+        _devices.c.id_device,
+        bindparam("b_ts", type_=_events.c.ts.type),
+        bindparam("b_kind", type_=_events.c.kind.type),
+        bindparam("b_value", type_=_events.c.value.type),
+        bindparam("b_source", type_=_events.c.source.type),
+    ).where(_devices.c.hw_uid == bindparam("b_hw_uid")),
+)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class DeviceEventLog:
+    """
+    Historia zdarzeń urządzeń (device_events) zapisywana partiami.
+
+    - record() tylko dopisuje do bufora w pamięci - można wołać z dowolnego wątku
+      (trasy API i listener MQTT w swoim wątku)
+    - pętla zapisu (start() w jednej z pętli) co flush_interval sekund wstawia bufor
+      porcjami po max_batch wierszy, jednym executemany na porcję
+    - bufor jest ograniczony (max_buffer); nadmiar jest odrzucany i liczony w `dropped`
+    """
+
+    def __init__(
+        self,
+        *,
+        flush_interval: float = 1.0,
+        max_batch: int = 1000,
+        max_buffer: int = 100_000,
+    ) -> None:
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._max_buffer = max_buffer
+        # (id_device | None, hw_uid | None, ts, kind, value, source)
+        self._buffer: deque[tuple] = deque()
+        self._lock = threading.Lock()
+        self._session_factory: Optional[Callable[[], AsyncSession]] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def record(
+        self,
+        kind: str,
+        value: str,
+        source: str,
+        *,
+        id_device: Optional[int] = None,
+        hw_uid: Optional[str] = None,
+        ts: Optional[datetime] = None,
+    ) -> None:
+        if id_device is None and hw_uid is None:
+            raise ValueError("record() wymaga id_device albo hw_uid")
+        with self._lock:
+            if len(self._buffer) >= self._max_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append((id_device, hw_uid, ts or utc_now(), kind, value, source))
+            self.recorded += 1
+
+    def start(self, session_factory: Callable[[], AsyncSession]) -> None:
+        """Uruchamia pętlę zapisu w bieżącej pętli zdarzeń (sesje z tej samej pętli)."""
+        if self._task is None:
+            self._session_factory = session_factory
+            self._task = asyncio.create_task(self._run(), name="device-event-log")
+
+    async def stop(self) -> None:
+        """Zatrzymuje pętlę i zapisuje to, co zostało w buforze."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while self._buffer and await self.flush():
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            # przy zalegającym buforze kolejne porcje od razu
+            while await self.flush() and len(self._buffer) >= self._max_batch:
+                pass
+
+    def _take(self) -> list[tuple]:
+        with self._lock:
+            n = min(len(self._buffer), self._max_batch)
+            return [self._buffer.popleft() for _ in range(n)]
+
+    async def flush(self) -> bool:
+        """Zapisuje jedną porcję. False, gdy nie było czego zapisać albo zapis się nie udał."""
+        batch = self._take()
+        if not batch:
+            return False
+
+        by_id = []
+        by_uid = []
+        for id_device, hw_uid, ts, kind, value, source in batch:
+            params = {"b_ts": ts, "b_kind": kind, "b_value": value, "b_source": source}
+            if id_device is not None:
+                params["b_id_device"] = id_device
+                by_id.append(params)
+            else:
+                params["b_hw_uid"] = hw_uid
+                by_uid.append(params)
+
+        started = time.monotonic()
+        written = 0
+        try:
+            async with self._session_factory() as db:
+                if by_id:
+                    written += max((await db.execute(_INSERT_BY_ID, by_id)).rowcount or 0, 0)
+                if by_uid:
+                    written += max((await db.execute(_INSERT_BY_HW_UID, by_uid)).rowcount or 0, 0)
+                await db.commit()
+        except Exception as e:
+            self.failed_flushes += 1
+            log.error("event flush failed", extra={"rows": len(batch), "error": str(e)})
+            # wracają na początek bufora, kolejność zachowana
+            with self._lock:
+                self._buffer.extendleft(reversed(batch))
+            return False
+
+        self.flushes += 1
+        self.rows_written += written
+        self.last_flush_ms = round((time.monotonic() - started) * 1000, 2)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+event_log = DeviceEventLog(
+    flush_interval=int(os.getenv("EVENT_LOG_FLUSH_MS", "1000")) / 1000,
+    max_batch=int(os.getenv("EVENT_LOG_BATCH", "1000")),
+    max_buffer=int(os.getenv("EVENT_LOG_MAX_BUFFER", "100000")),
+)
@@ -1,51 +1,84 @@
 import os
 import asyncio
-import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from dotenv import load_dotenv
 
-from src.db import init_db
-from src.mqtt_service import listen_alarm_states
+from src.app_log import get_logger
+from src.auth.password_hasher import password_hasher
+from src.auth.refresh_sessions import session_compactor
+from src.db import AsyncSessionLocal, init_db, describe_storage
+from src.email_service import close_smtp_pool
+from src.event_log import event_log
+from src.mqtt_listener import ListenerRunner, default_listener_mode
+from src.mqtt_service import get_publisher, stop_publisher
 
 from src.routers.router import router as auth_router
 from src.routers.device_state import router as device_state_router
+from src.routers.admin import router as admin_router
+from src.routers.metrics import HttpMetricsMiddleware, router as metrics_router
 
 load_dotenv()
-app = FastAPI(title="DoorLock API")
 
-mqtt_thread: threading.Thread | None = None
+log = get_logger("app")
 
 
-def _mqtt_thread_entry(listen_hw_uid: str | None):
-    loop = asyncio.SelectorEventLoop()
-    asyncio.set_event_loop(loop)
-    print("[APP] MQTT thread loop:", type(loop))
+async def on_startup() -> ListenerRunner:
+    log.info("db storage", extra={"storage": describe_storage()})
+    # brakujące tabele (np. device_events) - istniejących nie rusza
+    await asyncio.to_thread(init_db)
+
+    # historia zdarzeń: zapis partiami z pętli aplikacji (listener tylko dopisuje do bufora)
+    event_log.start(AsyncSessionLocal)
+    # czyszczenie wygasłych/unieważnionych refresh sesji w tle
+    session_compactor.start(AsyncSessionLocal)
+    # pula bcrypt (procesy startują teraz, nie przy pierwszym logowaniu)
+    await asyncio.to_thread(password_hasher.start)
+
+    listen_hw_uid = os.getenv("MQTT_LISTEN_HW_UID")  # None => wszystkie
+    listener = ListenerRunner(default_listener_mode(), listen_hw_uid)
+    # w trybie task listener korzysta z puli DB aplikacji
+    listener.start(AsyncSessionLocal)
+    log.info("mqtt listener started", extra={"mode": listener.mode})
+
+    # wspólne połączenie do publikacji komend (zamiast connect-per-command);
+    # start czeka na gotowość wątku publishera - poza pętlą zdarzeń
     try:
-        loop.run_until_complete(listen_alarm_states(listen_hw_uid))
-    finally:
-        loop.close()
+        await asyncio.to_thread(get_publisher)
+        log.info("mqtt publisher started")
+    except RuntimeError as e:
+        log.warning("mqtt publisher not started", extra={"error": str(e)})
 
+    return listener
 
-@app.on_event("startup")
-async def on_startup():
-    global mqtt_thread
 
-    listen_hw_uid = os.getenv("MQTT_LISTEN_HW_UID")  # None => wszystkie
-    mqtt_thread = threading.Thread(
-        target=_mqtt_thread_entry,
-        args=(listen_hw_uid,),
-        daemon=True,
-        name="mqtt-listener",
-    )
-    mqtt_thread.start()
-    print("[APP] MQTT listener started in background thread ✔")
+async def on_shutdown(listener: ListenerRunner) -> None:
+    # najpierw listener: dokończenie alarmów (maile), zapis stanów i historii
+    await listener.stop(float(os.getenv("LISTENER_DRAIN_TIMEOUT", "15")))
+    await asyncio.to_thread(stop_publisher)
+    await event_log.stop()
+    await session_compactor.stop()
+    await asyncio.to_thread(close_smtp_pool)
+    await asyncio.to_thread(password_hasher.shutdown)
+    log.info("shutdown complete")
 
 
-@app.on_event("shutdown")
-async def on_shutdown():
-    # daemon thread padnie przy zamknięciu procesu
-    print("[APP] shutdown ✔")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    listener = await on_startup()
+    try:
+        yield
+    finally:
+        await on_shutdown(listener)
 
 
+app = FastAPI(title="DoorLock API", lifespan=lifespan)
+
 app.include_router(auth_router)
 app.include_router(device_state_router)
+app.include_router(admin_router)
+
+# METRICS_ENABLED=0 wyłącza /metrics i pomiar czasu żądań
+if os.getenv("METRICS_ENABLED", "1") != "0":
+    app.add_middleware(HttpMetricsMiddleware)
+    app.include_router(metrics_router)
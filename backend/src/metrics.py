@@ -0,0 +1,341 @@
+# metrics.py
+import abc
+import bisect
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Iterable, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# domyślne kubełki histogramów czasu (sekundy)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_get_ident = threading.get_ident
+
+
+class _Sharded:
+    """
+    Stan metryki rozbity na wątki: każdy wątek pisze tylko do swojej listy, więc zapis nie bierze
+    blokad (wątek API, listener w osobnym wątku, wątki SMTP nie walczą o jeden lock).
+    Odczyt (/metrics) sumuje listy wszystkich wątków - może być o ułamek sekundy "spóźniony".
+    """
+
+    __slots__ = ("_shards", "_width")
+
+    def __init__(self, width: int) -> None:
+        self._shards: dict[int, list[float]] = {}
+        self._width = width
+
+    def shard(self) -> list[float]:
+        ident = _get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            # setdefault jest atomowe - dwa wątki nie nadpiszą sobie listy
+            shard = self._shards.setdefault(ident, [0.0] * self._width)
+        return shard
+
+    def total(self) -> list[float]:
+        out = [0.0] * self._width
+        for shard in list(self._shards.values()):
+            for i, v in enumerate(shard):
+                out[i] += v
+        return out
+
+
+class _CounterChild:
+    __slots__ = ("_state",)
+
+    def __init__(self) -> None:
+        self._state = _Sharded(1)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._state.shard()[0] += amount
+
+    def value(self) -> float:
+        return self._state.total()[0]
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_state")
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self._buckets = buckets
+        # [kubełki..., +Inf, suma]
+        self._state = _Sharded(len(buckets) + 2)
+
+    def observe(self, seconds: float) -> None:
+        shard = self._state.shard()
+        shard[bisect.bisect_left(self._buckets, seconds)] += 1
+        shard[-1] += seconds
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    def snapshot(self) -> tuple[list[float], float]:
+        """(skumulowane liczniki kubełków łącznie z +Inf, suma)"""
+        values = self._state.total()
+        cumulative = []
+        running = 0.0
+        for v in values[:-1]:
+            running += v
+            cumulative.append(running)
+        return cumulative, values[-1]
+
+
+class _Timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child: _HistogramChild) -> None:
+        self._child = child
+
+    def __enter__(self) -> "_Timer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._child.observe(time.perf_counter() - self._started)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        REGISTRY.append(self)
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Nowa seria dla zestawu etykiet (Counter/Histogram)."""
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: oczekiwane etykiety {self.labelnames}")
+            child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _label_str(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abc.abstractmethod
+    def render(self) -> list[str]:
+        """Linie próbek w formacie tekstowym Prometheusa (bez # HELP / # TYPE)."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{self._label_str(key)} {_fmt(child.value())}"
+            for key, child in list(self._children.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, seconds: float) -> None:
+        self.labels().observe(seconds)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            cumulative, total = child.snapshot()
+            for bound, count in zip(self.buckets + (math.inf,), cumulative):
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._label_str(key, le)} {_fmt(count)}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {_fmt(cumulative[-1])}")
+        return lines
+
+
+Sample = Union[float, dict[tuple, float]]
+
+
+class CallbackMetric(_Metric):
+    """Wartość liczona przy odczycie (głębokość kolejek, liczniki z istniejących stats())."""
+
+    def __init__(self, name: str, help: str, kind: str, fn: Callable[[], Sample], labelnames: Iterable[str] = ()) -> None:
+        self.kind = kind
+        self._fn = fn
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        # serie zwraca fn przy odczycie - nie ma czego zapisywać przez labels()
+        raise TypeError(f"{self.name}: metryka liczona przy odczycie nie przyjmuje zapisów")
+
+    def render(self) -> list[str]:
+        try:
+            value = self._fn()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            return [f"{self.name} {_fmt(value)}"]
+        return [f"{self.name}{self._label_str(key)} {_fmt(v)}" for key, v in value.items()]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render_prometheus() -> str:
+    """Wszystkie metryki w formacie tekstowym Prometheusa (text/plain; version=0.0.4)."""
+    out = []
+    for metric in list(REGISTRY):
+        lines = metric.render()
+        if not lines:
+            continue
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+def gauge(name: str, help: str, fn: Callable[[], Sample], labelnames: Iterable[str] = ()) -> CallbackMetric:
+    return CallbackMetric(name, help, "gauge", fn, labelnames)
+
+
+def counter_func(name: str, help: str, fn: Callable[[], Sample], labelnames: Iterable[str] = ()) -> CallbackMetric:
+    return CallbackMetric(name, help, "counter", fn, labelnames)
+
+
+# --- metryki gorących ścieżek (rejestrowane przy imporcie, zapisywane w modułach) ---
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Czas obsługi żądania HTTP (do wysłania nagłówków odpowiedzi)",
+    ("method", "route", "status"),
+)
+
+MQTT_PUBLISH_SECONDS = Histogram(
+    "mqtt_publish_duration_seconds",
+    "publish_to_device: od wywołania do PUBACK",
+    ("channel",),
+)
+MQTT_PUBLISH_FAILURES = Counter(
+    "mqtt_publish_failures_total",
+    "Nieudane publikacje komend do urządzeń",
+    ("channel",),
+)
+
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_duration_seconds",
+    "bcrypt w puli PasswordHasher: czekanie na workera (queue_wait) i samo haszowanie (hash)",
+    ("stage",),
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Czas wykonania instrukcji SQL (zdarzenia silnika SQLAlchemy)",
+    ("operation", "table"),
+)
+
+EMAIL_SEND_SECONDS = Histogram(
+    "alarm_email_send_duration_seconds",
+    "Wysyłka maila alarmowego przez pulę SMTP",
+    ("kind",),
+)
+EMAIL_SEND_FAILURES = Counter(
+    "alarm_email_send_failures_total",
+    "Nieudane wysyłki maili alarmowych",
+    ("kind",),
+)
+
+LISTENER_MESSAGES = Counter(
+    "mqtt_listener_messages_total",
+    "Wiadomości odebrane przez listener MQTT",
+    ("kind",),
+)
+MQTT_RECONNECTS = Counter(
+    "mqtt_listener_reconnects_total",
+    "Ponowne połączenia listenera MQTT po błędzie",
+)
+
+ALARM_STAGE_SECONDS = Histogram(
+    "alarm_stage_duration_seconds",
+    "Alarm: czas etapu pipeline (queue_wait, resolve, notify)",
+    ("stage",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+ALARM_END_TO_END_SECONDS = Histogram(
+    "alarm_end_to_end_seconds",
+    "Alarm: od odebrania z MQTT do wysłania maila",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+[\"`]?(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=2048)
+def _statement_labels(statement: str) -> tuple[str, str]:
+    # SQL z parametrami (bez wartości) - zbiór tekstów jest mały, więc cache
+    words = statement.lstrip().split(None, 1)
+    operation = words[0].upper() if words else "?"
+    match = _SQL_TABLE.search(statement)
+    return operation, match.group(1) if match else "-"
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Czas każdej instrukcji SQL -> DB_QUERY_SECONDS{operation, table}. Dla async: engine.sync_engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["_metrics_started"].pop()
+        DB_QUERY_SECONDS.labels(*_statement_labels(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("_metrics_started"):
+            conn.info["_metrics_started"].pop()
@@ -11,6 +11,7 @@ from sqlalchemy import (
     ForeignKey,
     Text,
     Boolean,
+    Index,
     func,
 )
 from sqlalchemy.orm import (
@@ -92,19 +93,53 @@ class Device(Base):
     user: Mapped[Optional["User"]] = relationship(back_populates="devices")
 
 
+# =========================
+#  DEVICE EVENTS (historia, tylko dopisywanie)
+# =========================
+class DeviceEvent(Base):
+    __tablename__ = "device_events"
+    __table_args__ = (
+        # stronicowanie keyset po (id_device, ts) - patrz GET /devices/{hw_uid}/events
+        Index("ix_device_events_device_ts", "id_device", "ts"),
+    )
+
+    id_event: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id_device: Mapped[int] = mapped_column(
+        ForeignKey("devices.id_device", ondelete="CASCADE"),
+        nullable=False,
+    )
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    # "state" / "alarm" / "alarm_triggered"
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)
+    # np. "open"/"closed", "active"/"inactive", "1"
+    value: Mapped[str] = mapped_column(String(32), nullable=False)
+    # "api" albo "device"
+    source: Mapped[str] = mapped_column(String(16), nullable=False)
+
+
 # =========================
 #  REFRESH SESSION
 # =========================
 class RefreshSession(Base):
     __tablename__ = "refresh_sessions"
+    __table_args__ = (
+        # logout_all i limit sesji: WHERE id_user = ? AND revoked_at IS NULL
+        # (zastępuje osobny indeks na id_user - ten sam prefiks; stary indeks
+        # ix_refresh_sessions_id_user usuwa init_db, patrz OBSOLETE_INDEXES w db.py)
+        Index("ix_refresh_sessions_user_revoked", "id_user", "revoked_at"),
+        # czyszczenie wygasłych/unieważnionych porcjami (refresh_sessions.py)
+        Index("ix_refresh_sessions_expires_at", "expires_at"),
+        Index("ix_refresh_sessions_revoked_at", "revoked_at"),
+    )
 
     id_session: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     id_user: Mapped[int] = mapped_column(
         ForeignKey("users.id_user", ondelete="CASCADE"),
         nullable=False,
-        index=True,
     )
 
+    # unikalny indeks = wyszukiwanie po token_hash w /refresh i /logout
     token_hash: Mapped[str] = mapped_column(String(64), unique=True, index=True, nullable=False)
 
     created_at: Mapped[datetime] = mapped_column(
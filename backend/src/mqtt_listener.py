@@ -0,0 +1,522 @@
+# mqtt_listener.py
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from aiomqtt import MqttError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.db import create_async_db_engine, create_async_session_factory
+from src.alarm_repo import get_alarm_recipient_cached, warm_recipient_cache
+from src.email_service import (
+    build_alarm_digest_email,
+    build_alarm_email,
+    close_smtp_pool,
+    send_alarm_digest_email_async,
+    send_alarm_email_async,
+    send_alarm_emails_async,
+)
+from src.mqtt_service import _new_client, _require_env, mqtt_tls_context
+from src.alarm_pipeline import AlarmEvent, AlarmPipeline, shard_for
+from src.alarm_debounce import AlarmDebouncer
+from src.state_ingest import StateWriteBehind, parse_door_state
+from src.event_hub import StateChange, event_hub
+from src.event_log import event_log
+from src.command_ack import ack_tracker, parse_ack
+from src.metrics import LISTENER_MESSAGES, MQTT_RECONNECTS
+from src.app_log import get_logger
+
+log = get_logger("mqtt.listener")
+alarm_log = get_logger("alarm")
+
+
+async def listen_alarm_states(
+    hw_uid: Optional[str] = None,
+    session_factory: Optional[async_sessionmaker[AsyncSession]] = None,
+) -> None:
+    """
+    Ciągły nasłuch alarmów.
+    - Jeśli hw_uid jest podany: subskrybuje doorlock/<hw_uid>/alarm/state
+    - Jeśli hw_uid=None: subskrybuje doorlock/+/alarm/state (wszystkie urządzenia)
+
+    Gdy payload == "1" -> wypisuje alert + próbuje wysłać mail do przypisanego usera.
+
+    Dodatkowo (STATE_INGEST_ENABLED=1, domyślnie) subskrybuje doorlock/+/state i zapisuje
+    zgłaszany przez zamki stan drzwi do devices (write-behind, patrz state_ingest.py).
+    Alarmy i zmiany zgłoszonego stanu trafiają też do historii device_events (event_log.py).
+    CMD_ACK_ENABLED=1 (domyślnie): doorlock/+/ack -> ack_tracker (command_ack.py).
+
+    session_factory: sesje DB z pętli, w której działa listener (zadanie w pętli aplikacji).
+    Bez niego listener tworzy własny engine (osobny wątek/proces).
+
+    Anulowanie zadania = łagodne zatrzymanie: zaległe digesty, kolejka alarmów (ALARM_DRAIN_TIMEOUT)
+    i bufor stanów są dokańczane przed wyjściem.
+    """
+    loop = asyncio.get_running_loop()
+    log.debug("listener loop", extra={"loop": type(loop).__name__, "add_reader": hasattr(loop, "add_reader")})
+
+    # brak konfiguracji -> błąd od razu, a nie pętla reconnectów
+    _require_env("MQTT_HOST")
+    mqtt_tls_context()
+
+    share = _share_prefix()
+    partition = load_partition()
+    if share and partition is not None:
+        raise RuntimeError("MQTT_SHARE_GROUP i LISTENER_PARTITIONS wykluczają się - wybierz jedno")
+
+    ingest_state = os.getenv("STATE_INGEST_ENABLED", "1") != "0"
+    topics = subscription_topics(hw_uid, share, ingest_state)
+    log.info("subscribing", extra={"topics": topics})
+    if partition is not None:
+        log.info("partition", extra={"partition": partition.index, "partitions": partition.count})
+
+    # w osobnej pętli listener potrzebuje własnego async engine (pula jest związana z pętlą)
+    db_engine = None
+    db_sessions = session_factory
+    if db_sessions is None:
+        db_engine = create_async_db_engine()
+        db_sessions = create_async_session_factory(db_engine)
+
+    # ALARM_RECIPIENT_WARM=0 wyłącza ładowanie cache odbiorców przy starcie
+    if os.getenv("ALARM_RECIPIENT_WARM", "1") != "0":
+        try:
+            async with db_sessions() as db:
+                warmed = await warm_recipient_cache(db)
+            log.info("recipient cache warmed", extra={"devices": warmed})
+        except Exception as e:
+            log.warning("recipient cache warm-up failed", extra={"error": str(e)})
+
+    pipeline = _build_alarm_pipeline(db_sessions)
+    pipeline.start()
+    debouncer = _build_alarm_debouncer(pipeline)
+    state_writer = _build_state_writer(db_sessions) if ingest_state else None
+    if state_writer is not None:
+        state_writer.start()
+    # w procesie API historię zapisuje pętla aplikacji; uruchomiony samodzielnie listener robi to sam
+    own_event_log = not event_log.running
+    if own_event_log:
+        event_log.start(db_sessions)
+
+    # ?wait_ack=true w API tego procesu ma sens tylko, gdy acki faktycznie tu docierają
+    ack_tracker.receiving = "doorlock/+/ack" in topics
+    try:
+        await _listen_loop(topics, pipeline, debouncer, state_writer, partition)
+    finally:
+        ack_tracker.receiving = False
+        log.info("stopping, draining in-flight alarms")
+        await debouncer.flush()
+        await pipeline.stop(timeout=float(os.getenv("ALARM_DRAIN_TIMEOUT", "10")))
+        if state_writer is not None:
+            await state_writer.stop()
+        if own_event_log:
+            await event_log.stop()
+        if db_engine is not None:
+            await db_engine.dispose()
+        log.info("stopped", extra={"alarms": pipeline.received, "failed": pipeline.failed})
+
+
+def subscription_topics(hw_uid: Optional[str], share: str = "", ingest_state: bool = True) -> list[str]:
+    """Tematy listenera: alarmy (i stany) urządzenia hw_uid albo wszystkich, plus acki komend."""
+    device_filter = hw_uid or "+"
+    topics = [f"{share}doorlock/{device_filter}/alarm/state"]
+    if ingest_state:
+        topics.append(f"{share}doorlock/{device_filter}/state")
+    # potwierdzenia komend - jedna subskrypcja na wszystkie urządzenia (command_ack.py), także
+    # przy MQTT_LISTEN_HW_UID: komendy z tego procesu mogą iść do dowolnego urządzenia.
+    # Nigdy współdzielona: ack musi trafić do procesu, który wysłał komendę.
+    if os.getenv("CMD_ACK_ENABLED", "1") != "0":
+        topics.append("doorlock/+/ack")
+    return topics
+
+
+# pipeline i debounce bieżącego listenera (do podglądu statystyk)
+_alarm_pipeline: Optional[AlarmPipeline] = None
+_alarm_debouncer: Optional[AlarmDebouncer] = None
+
+
+def alarm_pipeline_stats() -> dict:
+    return _alarm_pipeline.stats() if _alarm_pipeline is not None else {}
+
+
+def alarm_debounce_stats() -> dict:
+    return _alarm_debouncer.stats() if _alarm_debouncer is not None else {}
+
+
+_state_writer: Optional[StateWriteBehind] = None
+
+
+def state_ingest_stats() -> dict:
+    return _state_writer.stats() if _state_writer is not None else {}
+
+
+def _build_state_writer(db_sessions: async_sessionmaker[AsyncSession]) -> StateWriteBehind:
+    """
+    - STATE_FLUSH_MS     co ile ms zapisywać zebrane stany (domyślnie 500)
+    - STATE_FLUSH_BATCH  zapis wcześniej, gdy tyle urządzeń czeka (domyślnie 1000)
+    """
+    global _state_writer
+
+    _state_writer = StateWriteBehind(
+        db_sessions,
+        flush_interval=int(os.getenv("STATE_FLUSH_MS", "500")) / 1000,
+        max_batch=int(os.getenv("STATE_FLUSH_BATCH", "1000")),
+    )
+    return _state_writer
+
+
+def _build_alarm_debouncer(pipeline: AlarmPipeline) -> AlarmDebouncer:
+    """
+    ALARM_DEBOUNCE_SECONDS - okno debounce per urządzenie (domyślnie 30, 0 = wyłączone).
+    Powtórzenia w oknie idą jednym mailem-digestem.
+    """
+    global _alarm_debouncer
+
+    _alarm_debouncer = AlarmDebouncer(
+        float(os.getenv("ALARM_DEBOUNCE_SECONDS", "30")),
+        pipeline.submit_digest,
+    )
+    return _alarm_debouncer
+
+
+def _build_alarm_pipeline(db_sessions: async_sessionmaker[AsyncSession]) -> AlarmPipeline:
+    """
+    Konfiguracja:
+    - ALARM_WORKERS      (równoległe urządzenia, domyślnie 8)
+    - ALARM_QUEUE_SIZE   (łączny limit kolejki, domyślnie 1000)
+    - ALARM_EMAIL_BATCH  (ile czekających alarmów worker wysyła jedną sesją SMTP, domyślnie 20; 1 = po jednym)
+    """
+    global _alarm_pipeline
+
+    async def _resolve(hw_uid: str):
+        # cache odbiorców; do bazy tylko przy braku wpisu
+        return await get_alarm_recipient_cached(db_sessions, hw_uid)
+
+    async def _notify(email: str, event: AlarmEvent, device_name: Optional[str]) -> None:
+        # wysyłka przez wspólną pulę SMTP, w wątku - nie blokuje listenera
+        if event.is_digest:
+            await send_alarm_digest_email_async(
+                email, event.hw_uid, device_name, event.count, event.first, event.last
+            )
+            alarm_log.info("digest sent", extra={"hw_uid": event.hw_uid, "count": event.count, "email": email})
+        else:
+            await send_alarm_email_async(email, event.hw_uid, device_name)
+            alarm_log.info("email sent", extra={"hw_uid": event.hw_uid, "email": email})
+
+    async def _notify_many(items: list[tuple[str, AlarmEvent, Optional[str]]]) -> list[Optional[Exception]]:
+        # zaległe alarmy workera (także digesty) jedną sesją SMTP
+        messages = [
+            ("digest", build_alarm_digest_email(email, event.hw_uid, device_name, event.count, event.first, event.last))
+            if event.is_digest
+            else ("alarm", build_alarm_email(email, event.hw_uid, device_name))
+            for email, event, device_name in items
+        ]
+        errors = await send_alarm_emails_async(messages)
+        for (email, event, _), error in zip(items, errors):
+            if error is None:
+                alarm_log.info(
+                    "digest sent" if event.is_digest else "email sent",
+                    extra={"hw_uid": event.hw_uid, "count": event.count, "email": email, "batch": len(items)},
+                )
+        return errors
+
+    _alarm_pipeline = AlarmPipeline(
+        _resolve,
+        _notify,
+        workers=int(os.getenv("ALARM_WORKERS", "8")),
+        queue_size=int(os.getenv("ALARM_QUEUE_SIZE", "1000")),
+        notify_many=_notify_many,
+        batch_size=int(os.getenv("ALARM_EMAIL_BATCH", "20")),
+    )
+    return _alarm_pipeline
+
+
+def _share_prefix() -> str:
+    """
+    MQTT_SHARE_GROUP=<grupa>: alarmy i stany przez $share/<grupa>/... - broker rozdziela wiadomości
+    między instancje listenera (każda wiadomość trafia do jednej), zamiast dawać każdą wszystkim.
+    Uwaga: kolejne alarmy jednego urządzenia mogą trafić do różnych instancji (debounce per instancja),
+    a strumień SSE w danym procesie widzi tylko zdarzenia odebrane przez ten proces.
+    """
+    group = os.getenv("MQTT_SHARE_GROUP", "").strip()
+    return f"$share/{group}/" if group else ""
+
+
+@dataclass(frozen=True)
+class Partition:
+    """Ta instancja obsługuje tylko urządzenia z shard_for(hw_uid, count) == index."""
+    index: int
+    count: int
+
+    def owns(self, hw_uid: str) -> bool:
+        return shard_for(hw_uid, self.count) == self.index
+
+
+def load_partition() -> Optional[Partition]:
+    """
+    LISTENER_PARTITIONS=N + LISTENER_PARTITION=i (0..N-1): tryb z podziałem po hw_uid.
+    Każda instancja dostaje wszystkie wiadomości, ale przetwarza tylko swoje urządzenia - urządzenie
+    ma zawsze tę samą instancję (debounce i kolejność alarmów jak przy jednym procesie).
+    """
+    count = int(os.getenv("LISTENER_PARTITIONS", "1"))
+    if count <= 1:
+        return None
+    index = int(_require_env("LISTENER_PARTITION"))
+    if not 0 <= index < count:
+        raise RuntimeError(f"LISTENER_PARTITION musi być z zakresu 0..{count - 1}")
+    return Partition(index=index, count=count)
+
+
+# wiadomości pominięte, bo należą do innej partycji
+foreign_skipped = 0
+
+
+async def _listen_loop(
+    topics: list[str],
+    pipeline: AlarmPipeline,
+    debouncer: AlarmDebouncer,
+    state_writer: Optional[StateWriteBehind],
+    partition: Optional[Partition] = None,
+) -> None:
+    global foreign_skipped
+
+    # Prosty auto-reconnect w pętli
+    while True:
+        try:
+            async with _new_client() as client:
+                for topic in topics:
+                    await client.subscribe(topic, qos=1)
+                log.info("connected, waiting for messages")
+
+                async for msg in client.messages:
+                    received_at = time.monotonic()
+                    try:
+                        payload = msg.payload.decode("utf-8", errors="ignore").strip()
+                    except Exception:
+                        payload = str(msg.payload)
+
+                    parts = msg.topic.value.split("/")
+
+                    # topic: doorlock/<hw_uid>/ack - potwierdzenie wykonania komendy
+                    if len(parts) == 3 and parts[0] == "doorlock" and parts[2] == "ack":
+                        cid, status = parse_ack(payload)
+                        ack_tracker.resolve(parts[1], cid, status)
+                        LISTENER_MESSAGES.labels("ack").inc()
+                        continue
+
+                    # tryb partycji: urządzenia innych instancji pomijamy
+                    if partition is not None and len(parts) >= 3 and not partition.owns(parts[1]):
+                        foreign_skipped += 1
+                        LISTENER_MESSAGES.labels("foreign").inc()
+                        continue
+
+                    # topic: doorlock/<hw_uid>/state - stan zgłaszany przez zamek
+                    if len(parts) == 3 and parts[0] == "doorlock" and parts[2] == "state":
+                        LISTENER_MESSAGES.labels("state").inc()
+                        is_open = parse_door_state(payload)
+                        # historia i SSE tylko przy zmianie - nie przy każdym okresowym raporcie
+                        if state_writer is not None and is_open is not None and state_writer.offer(parts[1], is_open):
+                            state_value = "open" if is_open else "closed"
+                            event_log.record("state", state_value, "device", hw_uid=parts[1])
+                            event_hub.publish(StateChange(
+                                hw_uid=parts[1],
+                                kind="state",
+                                value=state_value,
+                                source="device",
+                            ))
+                        continue
+
+                    # topic: doorlock/<hw_uid>/alarm/state
+                    got_hw_uid = (
+                        parts[1]
+                        if len(parts) >= 4 and parts[0] == "doorlock"
+                        else "UNKNOWN"
+                    )
+
+                    LISTENER_MESSAGES.labels("alarm" if payload == "1" else "other").inc()
+                    if payload == "1":
+                        # historia dostaje każdy alarm, także te złożone do digestu
+                        if got_hw_uid != "UNKNOWN":
+                            event_log.record("alarm_triggered", payload, "device", hw_uid=got_hw_uid)
+                        # powtórzenie w oknie debounce - tylko liczymy, trafi do digestu
+                        if not debouncer.offer(got_hw_uid):
+                            continue
+                        alarm_log.info("alarm received", extra={"hw_uid": got_hw_uid, "topic": msg.topic.value})
+                        event_hub.publish(StateChange(
+                            hw_uid=got_hw_uid, kind="alarm_triggered", value=payload, source="device"
+                        ))
+                        # resolve + mail dzieją się w workerach; tu tylko kolejka (czeka, gdy pełna)
+                        await pipeline.submit(got_hw_uid, received_at)
+                    else:
+                        # inne wartości - DEBUG, z limitem na klasę tematu (app_log.py)
+                        log.debug("message", extra={"topic": msg.topic.value, "payload": payload})
+
+        except MqttError as e:
+            log.warning("disconnected, reconnecting", extra={"error": str(e), "retry_s": 3})
+            MQTT_RECONNECTS.inc()
+            await asyncio.sleep(3)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("unexpected error, reconnecting", extra={"error": str(e), "retry_s": 3}, exc_info=True)
+            MQTT_RECONNECTS.inc()
+            await asyncio.sleep(3)
+
+
+
+def default_listener_mode() -> str:
+    """
+    LISTENER_MODE:
+    - task   -> zadanie w pętli aplikacji (domyślnie poza Windowsem)
+    - thread -> osobny wątek z SelectorEventLoop (domyślnie na Windowsie: pętla Proactor
+                uvicorna nie ma add_reader, którego potrzebuje aiomqtt)
+    - off    -> API bez listenera; nasłuch w osobnym procesie (python -m src.mqtt_listener)
+    """
+    default = "thread" if sys.platform.lower().startswith("win") else "task"
+    mode = os.getenv("LISTENER_MODE", default).strip().lower()
+    if mode not in ("task", "thread", "off"):
+        raise RuntimeError("LISTENER_MODE musi być 'task', 'thread' albo 'off'")
+    return mode
+
+
+class ListenerRunner:
+    """
+    Uruchamia listen_alarm_states w wybranym trybie i zatrzymuje go z limitem czasu na dokończenie pracy.
+    Po przekroczeniu limitu nasłuch jest anulowany ponownie i stop() czeka jeszcze najwyżej
+    `cancel_grace` sekund, aż faktycznie się skończy - dopiero potem wołający zamyka DB/SMTP/publishera.
+    """
+
+    def __init__(self, mode: str, hw_uid: Optional[str] = None, *, cancel_grace: float = 2.0) -> None:
+        self.mode = mode
+        self._hw_uid = hw_uid
+        self._cancel_grace = cancel_grace
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._thread_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_task: Optional[asyncio.Task] = None
+
+    def start(self, session_factory: Optional[async_sessionmaker[AsyncSession]] = None) -> None:
+        if self.mode == "task":
+            self._task = asyncio.create_task(
+                listen_alarm_states(self._hw_uid, session_factory),
+                name="mqtt-listener",
+            )
+            self._task.add_done_callback(_report_listener_exit)
+        elif self.mode == "thread":
+            self._thread = threading.Thread(target=self._thread_entry, daemon=True, name="mqtt-listener")
+            self._thread.start()
+
+    @property
+    def done(self) -> bool:
+        """True, gdy nasłuch się zakończył (albo nie był uruchomiony)."""
+        if self._task is not None:
+            return self._task.done()
+        if self._thread is not None:
+            return not self._thread.is_alive()
+        return True
+
+    async def wait(self) -> None:
+        """Czeka, aż nasłuch się zakończy (np. błąd konfiguracji); wyjątku zadania nie rzuca."""
+        if self._task is not None:
+            await asyncio.wait({self._task})
+        elif self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+
+    def _thread_entry(self) -> None:
+        loop = asyncio.SelectorEventLoop()
+        asyncio.set_event_loop(loop)
+        log.debug("listener thread loop", extra={"loop": type(loop).__name__})
+        self._thread_loop = loop
+        self._thread_task = loop.create_task(listen_alarm_states(self._hw_uid))
+        try:
+            loop.run_until_complete(self._thread_task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.error("listener failed", extra={"error": str(e)}, exc_info=True)
+        finally:
+            loop.close()
+
+    def _cancel_thread_task(self) -> None:
+        loop, task = self._thread_loop, self._thread_task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # pętla wątku już zamknięta
+
+    async def stop(self, deadline: float) -> None:
+        """Anuluje nasłuch i czeka na dokończenie pracy najwyżej `deadline` (+ `cancel_grace`) sekund."""
+        if self._task is not None:
+            task = self._task
+            task.cancel()
+            done, _ = await asyncio.wait({task}, timeout=deadline)
+            if not done:
+                log.warning("drain deadline exceeded, cancelling remaining work", extra={"deadline_s": deadline})
+                # drugie anulowanie przerywa dokańczanie (kolejka alarmów, zapis stanów)
+                task.cancel()
+                done, _ = await asyncio.wait({task}, timeout=self._cancel_grace)
+                if not done:
+                    log.error("listener did not stop after cancel", extra={"grace_s": self._cancel_grace})
+            self._task = None
+
+        if self._thread is not None:
+            self._cancel_thread_task()
+            await asyncio.to_thread(self._thread.join, deadline)
+            if self._thread.is_alive():
+                log.warning("drain deadline exceeded, cancelling remaining work", extra={"deadline_s": deadline})
+                self._cancel_thread_task()
+                await asyncio.to_thread(self._thread.join, self._cancel_grace)
+                if self._thread.is_alive():
+                    log.error("listener thread did not stop after cancel", extra={"grace_s": self._cancel_grace})
+            self._thread = None
+
+
+def _report_listener_exit(task: asyncio.Task) -> None:
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        log.error("listener failed", extra={"error": str(exc)}, exc_info=exc)
+
+
+def run_listener_process(hw_uid: Optional[str] = None) -> None:
+    """
+    Tryb "tylko listener": osobny proces do przyjmowania danych z MQTT, skalowany niezależnie od API.
+    SIGINT/SIGTERM -> łagodne zatrzymanie z limitem LISTENER_DRAIN_TIMEOUT.
+    """
+    deadline = float(os.getenv("LISTENER_DRAIN_TIMEOUT", "15"))
+
+    async def _main() -> None:
+        loop = asyncio.get_running_loop()
+        runner = ListenerRunner("task", hw_uid)
+        runner.start()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows - zostaje KeyboardInterrupt
+        stopped = asyncio.create_task(stop.wait())
+        finished = asyncio.create_task(runner.wait())
+        await asyncio.wait({finished, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        finished.cancel()
+        await runner.stop(deadline)
+        await asyncio.to_thread(close_smtp_pool)
+
+    if sys.platform.lower().startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    # python -m src.mqtt_listener  (opcjonalnie MQTT_LISTEN_HW_UID=ABC)
+    try:
+        run_listener_process(os.getenv("MQTT_LISTEN_HW_UID"))
+    except KeyboardInterrupt:
+        print("Interrupted by user")
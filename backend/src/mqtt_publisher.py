@@ -0,0 +1,293 @@
+# mqtt_publisher.py
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from aiomqtt import Client, MqttError
+
+from src.app_log import get_logger
+
+log = get_logger("mqtt.publisher")
+
+
+@dataclass
+class _PublishItem:
+    topic: str
+    payload: str
+    qos: int
+    enqueued_at: float
+    deadline: float
+    future: concurrent.futures.Future = field(default_factory=concurrent.futures.Future)
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class MqttPublisher:
+    """
+    Jedno długożyjące połączenie MQTT do publikacji komend.
+
+    - działa we własnym wątku z SelectorEventLoop (ten sam Windows fix co wcześniej w _sync_publish),
+      więc nie zależy od typu pętli, na której chodzi uvicorn
+    - publish() wrzuca wiadomość do kolejki i czeka na PUBACK (QoS1)
+    - wiele wiadomości może być w locie naraz na jednym połączeniu (max_inflight)
+    - po zerwaniu połączenia łączy się ponownie; wiadomości z kolejki czekają do swojego deadline'u
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Client],
+        *,
+        queue_size: int = 1000,
+        max_inflight: int = 100,
+        publish_timeout: float = 10.0,
+        reconnect_delay: float = 3.0,
+        name: str = "mqtt-publisher",
+    ) -> None:
+        self._client_factory = client_factory
+        self._queue_size = queue_size
+        self._max_inflight = max_inflight
+        self._publish_timeout = publish_timeout
+        self._reconnect_delay = reconnect_delay
+        self._name = name
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._main_task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._stopping = False
+        self._connected = False
+        self._carry: Optional[_PublishItem] = None
+
+        # statystyki (modyfikowane tylko z wątku publishera)
+        self._started_at = 0.0
+        self._published = 0
+        self._failed = 0
+        self._rejected = 0
+        self._reconnects = 0
+        self._inflight = 0
+        self._latencies: deque[float] = deque(maxlen=2048)
+
+    # ------------------------------------------------------------------
+    # API (wywoływane z dowolnego wątku / pętli)
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._thread_entry, daemon=True, name=self._name)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is None or self._loop is None:
+            return
+        self._stopping = True
+        self._loop.call_soon_threadsafe(self._cancel_main)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def submit(self, topic: str, payload: str, qos: int = 1) -> concurrent.futures.Future:
+        """Wrzuca wiadomość do kolejki. Zwraca Future rozwiązywany po PUBACK."""
+        now = time.monotonic()
+        item = _PublishItem(
+            topic=topic,
+            payload=payload,
+            qos=qos,
+            enqueued_at=now,
+            deadline=now + self._publish_timeout,
+        )
+        if self._loop is None or self._stopping:
+            item.future.set_exception(RuntimeError("MQTT publisher is not running"))
+            return item.future
+        try:
+            self._loop.call_soon_threadsafe(self._enqueue, item)
+        except RuntimeError:
+            # pętla publishera została już zamknięta
+            item.future.set_exception(RuntimeError("MQTT publisher is not running"))
+        return item.future
+
+    async def publish(self, topic: str, payload: str, qos: int = 1) -> None:
+        """Publikuje i czeka (w pętli wywołującego) na potwierdzenie z brokera."""
+        await asyncio.wrap_future(self.submit(topic, payload, qos))
+
+    def stats(self) -> dict:
+        """Przepustowość i opóźnienia (enqueue -> PUBACK) w milisekundach."""
+        uptime = max(time.monotonic() - self._started_at, 1e-9) if self._started_at else 0.0
+        lat = sorted(self._latencies)
+        return {
+            "connected": self._connected,
+            "published": self._published,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "reconnects": self._reconnects,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "inflight": self._inflight,
+            "throughput_per_s": round(self._published / uptime, 2) if uptime else 0.0,
+            "latency_ms": {
+                "p50": round(_percentile(lat, 0.50) * 1000, 2),
+                "p95": round(_percentile(lat, 0.95) * 1000, 2),
+                "p99": round(_percentile(lat, 0.99) * 1000, 2),
+                "max": round((lat[-1] if lat else 0.0) * 1000, 2),
+            },
+        }
+
+    # ------------------------------------------------------------------
+    # wnętrze (wątek publishera)
+    # ------------------------------------------------------------------
+    def _thread_entry(self) -> None:
+        loop = asyncio.SelectorEventLoop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._main_task = loop.create_task(self._main())
+        self._ready.set()
+        try:
+            loop.run_until_complete(self._main_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._fail_pending(RuntimeError("MQTT publisher stopped"))
+            loop.close()
+
+    def _cancel_main(self) -> None:
+        if self._main_task is not None:
+            self._main_task.cancel()
+
+    def _enqueue(self, item: _PublishItem) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._rejected += 1
+            self._resolve(item, RuntimeError("MQTT publish queue full"))
+
+    def _resolve(self, item: _PublishItem, error: Optional[BaseException] = None) -> None:
+        if item.future.done():
+            return
+        if error is None:
+            self._published += 1
+            self._latencies.append(time.monotonic() - item.enqueued_at)
+            item.future.set_result(None)
+        else:
+            self._failed += 1
+            item.future.set_exception(error)
+
+    def _fail_pending(self, error: BaseException) -> None:
+        if self._carry is not None:
+            self._resolve(self._carry, error)
+            self._carry = None
+        if self._queue is None:
+            return
+        while not self._queue.empty():
+            self._resolve(self._queue.get_nowait(), error)
+
+    async def _main(self) -> None:
+        first = True
+        while not self._stopping:
+            if not first:
+                self._reconnects += 1
+            first = False
+            try:
+                async with self._client_factory() as client:
+                    self._connected = True
+                    log.info("connected")
+                    await self._pump(client)
+            except MqttError as e:
+                log.warning("disconnected, reconnecting", extra={"error": str(e), "retry_s": self._reconnect_delay})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(
+                    "unexpected error, reconnecting",
+                    extra={"error": str(e), "retry_s": self._reconnect_delay},
+                    exc_info=True,
+                )
+            finally:
+                self._connected = False
+            self._expire_queued()
+            await asyncio.sleep(self._reconnect_delay)
+
+    async def _pump(self, client: Client) -> None:
+        sem = asyncio.Semaphore(self._max_inflight)
+        broken = asyncio.Event()
+        tasks: set[asyncio.Task] = set()
+
+        async def _publish_one(item: _PublishItem) -> None:
+            self._inflight += 1
+            try:
+                timeout = max(item.deadline - time.monotonic(), 0.001)
+                await client.publish(item.topic, item.payload, qos=item.qos, timeout=timeout)
+                self._resolve(item)
+            except MqttError as e:
+                self._resolve(item, e)
+                broken.set()
+            except Exception as e:
+                self._resolve(item, e)
+            finally:
+                self._inflight -= 1
+                sem.release()
+
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            await sem.acquire()
+            task = asyncio.create_task(_publish_one(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        try:
+            while not broken.is_set():
+                get_task = asyncio.ensure_future(self._queue.get())
+                broken_task = asyncio.ensure_future(broken.wait())
+                try:
+                    done, _ = await asyncio.wait({get_task, broken_task}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    broken_task.cancel()
+                    if not get_task.done():
+                        get_task.cancel()
+                if get_task not in done:
+                    break
+                item = get_task.result()
+                if broken.is_set():
+                    # połączenie padło w tej samej chwili - wiadomość idzie na następne połączenie
+                    self._carry = item
+                    break
+
+                if time.monotonic() >= item.deadline:
+                    self._resolve(item, TimeoutError("MQTT publish timed out in queue"))
+                    continue
+
+                await sem.acquire()
+                task = asyncio.create_task(_publish_one(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        raise MqttError("connection lost while publishing")
+
+    def _expire_queued(self) -> None:
+        """Po rozłączeniu odrzuca wiadomości, których deadline już minął."""
+        now = time.monotonic()
+        keep = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if now >= item.deadline:
+                self._resolve(item, TimeoutError("MQTT publish timed out waiting for reconnect"))
+            else:
+                keep.append(item)
+        for item in keep:
+            self._queue.put_nowait(item)
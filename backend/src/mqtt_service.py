@@ -1,15 +1,18 @@
 # mqtt_service.py
+import concurrent.futures
 import os
 import ssl
 import sys
+import threading
+import time
 from typing import Optional, Literal
 import asyncio
 
-from aiomqtt import Client, MqttError
+from aiomqtt import Client
 
-from src.db import SessionLocal
-from src.alarm_repo import get_alarm_recipient_by_hw_uid
-from src.email_service import send_alarm_email
+from src.app_log import get_logger
+from src.metrics import MQTT_PUBLISH_FAILURES, MQTT_PUBLISH_SECONDS
+from src.mqtt_publisher import MqttPublisher
 
 try:
     from dotenv import load_dotenv
@@ -21,6 +24,8 @@ except Exception:
 
 PublishChannel = Literal["cmd", "alarm"]
 
+log = get_logger("mqtt.publish")
+
 
 def _require_env(name: str) -> str:
     val = os.getenv(name)
@@ -29,13 +34,74 @@ def _require_env(name: str) -> str:
     return val
 
 
-def build_tls_context() -> ssl.SSLContext:
-    ca_path = _require_env("MQTT_TLS_CA")
-    cert_path = _require_env("MQTT_TLS_CERT")
-    key_path = _require_env("MQTT_TLS_KEY")
-    key_password = os.getenv("MQTT_TLS_KEY_PASSWORD")
+class _ResumingSSLSocket(ssl.SSLSocket):
+    """SSLSocket, który po handshake'u i przy zamknięciu oddaje sesję TLS do kontekstu."""
+
+    def do_handshake(self, block=False):
+        super().do_handshake(block)
+        self.context.handshakes += 1
+        if self.session_reused:
+            self.context.resumed += 1
+        self.context.remember_session(self.server_hostname, self)
+
+    def close(self):
+        # przy TLS 1.3 bilet sesji przychodzi dopiero po handshake'u - łapiemy go przed zamknięciem
+        self.context.remember_session(self.server_hostname, self)
+        super().close()
+
 
-    ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=ca_path)
+class _ResumingSSLContext(ssl.SSLContext):
+    """
+    Kontekst TLS, który wznawia sesje przy kolejnych połączeniach do tego samego hosta
+    (krótszy handshake przy reconnectach i przy starcie publishera/listenera).
+    """
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        ctx = super().__new__(cls, protocol, *args, **kwargs)
+        ctx.sslsocket_class = _ResumingSSLSocket
+        return ctx
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._sessions: dict[Optional[str], ssl.SSLSession] = {}
+        self._sessions_lock = threading.Lock()
+        self.handshakes = 0
+        self.resumed = 0
+
+    def remember_session(self, hostname: Optional[str], sock: ssl.SSLSocket) -> None:
+        try:
+            session = sock.session
+        except (AttributeError, ValueError):
+            session = None
+        if session is None:
+            return
+        with self._sessions_lock:
+            self._sessions[hostname] = session
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(server_hostname)
+        try:
+            ssl_sock = super().wrap_socket(
+                sock, *args, server_hostname=server_hostname, session=session, **kwargs
+            )
+        except ValueError:
+            # sesja nie pasuje (np. inny kontekst po przeładowaniu) - pełny handshake
+            with self._sessions_lock:
+                self._sessions.pop(server_hostname, None)
+            ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, **kwargs)
+        return ssl_sock
+
+
+def _load_tls_context(
+    ca_path: str,
+    cert_path: str,
+    key_path: str,
+    key_password: Optional[str],
+) -> ssl.SSLContext:
+    # odpowiednik ssl.create_default_context(SERVER_AUTH), ale z naszą klasą kontekstu
+    ctx = _ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
     ctx.load_verify_locations(cafile=ca_path)
     ctx.load_cert_chain(certfile=cert_path, keyfile=key_path, password=key_password)
 
@@ -46,6 +112,59 @@ def build_tls_context() -> ssl.SSLContext:
     return ctx
 
 
+_tls_lock = threading.Lock()
+_tls_key: Optional[tuple] = None
+_tls_context: Optional[ssl.SSLContext] = None
+
+
+def _tls_files_key(ca_path: str, cert_path: str, key_path: str, key_password: Optional[str]) -> tuple:
+    return (
+        tuple((path, os.stat(path).st_mtime_ns) for path in (ca_path, cert_path, key_path)),
+        key_password,
+    )
+
+
+def build_tls_context() -> ssl.SSLContext:
+    """
+    Zwraca wspólny kontekst TLS dla wszystkich połączeń MQTT w procesie.
+    Pliki CA/cert/key są czytane ponownie tylko, gdy zmieni się ich mtime (hot-reload po
+    wymianie certyfikatów). Kontekst pamięta sesje TLS, więc reconnect wznawia sesję.
+    """
+    global _tls_key, _tls_context
+
+    ca_path = _require_env("MQTT_TLS_CA")
+    cert_path = _require_env("MQTT_TLS_CERT")
+    key_path = _require_env("MQTT_TLS_KEY")
+    key_password = os.getenv("MQTT_TLS_KEY_PASSWORD")
+
+    key = _tls_files_key(ca_path, cert_path, key_path, key_password)
+
+    with _tls_lock:
+        if _tls_context is None or key != _tls_key:
+            if _tls_context is not None:
+                log.info("TLS certificate files changed, reloading context")
+            _tls_context = _load_tls_context(ca_path, cert_path, key_path, key_password)
+            _tls_key = key
+        return _tls_context
+
+
+def mqtt_tls_context() -> Optional[ssl.SSLContext]:
+    """
+    Kontekst TLS dla nowych połączeń albo None przy MQTT_TLS=0 - goły TCP, wyłącznie do lokalnego
+    brokera (benchmarki, symulator floty). Produkcyjny broker zawsze z TLS.
+    """
+    if os.getenv("MQTT_TLS", "1") == "0":
+        return None
+    return build_tls_context()
+
+
+def tls_stats() -> dict:
+    ctx = _tls_context
+    if not isinstance(ctx, _ResumingSSLContext):
+        return {"handshakes": 0, "resumed": 0}
+    return {"handshakes": ctx.handshakes, "resumed": ctx.resumed}
+
+
 # Na Windowsie aiomqtt często wymaga Selector loop
 if sys.platform.lower().startswith("win"):
     from asyncio import set_event_loop_policy, WindowsSelectorEventLoopPolicy
@@ -57,33 +176,64 @@ def _get_mqtt_auth() -> tuple[Optional[str], Optional[str]]:
     return os.getenv("MQTT_USER"), os.getenv("MQTT_PASS")
 
 
-def _sync_publish(hw_uid: str, payload: str, channel: str) -> None:
-    """Synchroniczna wersja publish w osobnym wątku z SelectorEventLoop (Windows fix)."""
+def _new_client() -> Client:
     host = _require_env("MQTT_HOST")
     port = int(os.getenv("MQTT_PORT", "8883"))
+    username, password = _get_mqtt_auth()
 
-    topic = f"doorlock/{hw_uid}/{channel}"
+    return Client(
+        hostname=host,
+        port=port,
+        username=username,
+        password=password,
+        keepalive=60,
+        tls_context=mqtt_tls_context(),
+        max_inflight_messages=int(os.getenv("MQTT_PUB_MAX_INFLIGHT", "100")),
+    )
 
-    tls_context = build_tls_context()
-    username, password = _get_mqtt_auth()
 
-    async def _do_publish():
-        async with Client(
-            hostname=host,
-            port=port,
-            username=username,
-            password=password,
-            keepalive=60,
-            tls_context=tls_context,
-        ) as client:
-            await client.publish(topic, payload, qos=1)
-            print(f"[MQTT] {topic} <- {payload}")
-
-    loop = asyncio.SelectorEventLoop()
-    try:
-        loop.run_until_complete(_do_publish())
-    finally:
-        loop.close()
+_publisher: Optional[MqttPublisher] = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> MqttPublisher:
+    """
+    Zwraca wspólny (jeden na proces) publisher MQTT, uruchamiając go przy pierwszym użyciu.
+    Konfiguracja:
+    - MQTT_PUB_QUEUE_SIZE   (domyślnie 1000)
+    - MQTT_PUB_MAX_INFLIGHT (domyślnie 100)
+    - MQTT_PUB_TIMEOUT      (sekundy, domyślnie 10)
+    """
+    global _publisher
+
+    if _publisher is not None:
+        return _publisher
+
+    with _publisher_lock:
+        if _publisher is None:
+            # brak konfiguracji brokera ma dać błąd od razu, a nie dopiero po timeoucie
+            _require_env("MQTT_HOST")
+
+            publisher = MqttPublisher(
+                _new_client,
+                queue_size=int(os.getenv("MQTT_PUB_QUEUE_SIZE", "1000")),
+                max_inflight=int(os.getenv("MQTT_PUB_MAX_INFLIGHT", "100")),
+                publish_timeout=float(os.getenv("MQTT_PUB_TIMEOUT", "10")),
+            )
+            publisher.start()
+            _publisher = publisher
+
+    return _publisher
+
+
+def stop_publisher(timeout: float = 5.0) -> None:
+    global _publisher
+
+    with _publisher_lock:
+        if _publisher is not None:
+            log.info("publisher stopping", extra={"stats": _publisher.stats()})
+            _publisher.stop(timeout)
+            _publisher = None
 
 
 async def publish_to_device(
@@ -93,103 +243,69 @@ async def publish_to_device(
 ) -> None:
     """
     Publikuje wiadomość MQTT do konkretnego urządzenia.
+    Wiadomość idzie przez wspólne połączenie publishera; czekamy na PUBACK (QoS1).
 
     Kanały:
     - cmd   -> doorlock/<hw_uid>/cmd
     - alarm -> doorlock/<hw_uid>/alarm
     """
+    topic = f"doorlock/{hw_uid}/{channel}"
+
+    started = time.perf_counter()
     try:
-        await asyncio.to_thread(_sync_publish, hw_uid, payload, channel)
+        await get_publisher().publish(topic, payload, qos=1)
     except Exception as e:
+        MQTT_PUBLISH_FAILURES.labels(channel).inc()
         raise RuntimeError(f"MQTT publish failed: {e}") from e
+    MQTT_PUBLISH_SECONDS.labels(channel).observe(time.perf_counter() - started)
 
+    log.info("published", extra={"topic": topic, "payload": payload})
 
-async def listen_alarm_states(hw_uid: Optional[str] = None) -> None:
-    """
-    Ciągły nasłuch alarmów.
-    - Jeśli hw_uid jest podany: subskrybuje doorlock/<hw_uid>/alarm/state
-    - Jeśli hw_uid=None: subskrybuje doorlock/+/alarm/state (wszystkie urządzenia)
 
-    Gdy payload == "1" -> wypisuje alert + próbuje wysłać mail do przypisanego usera.
+async def publish_many_to_devices(
+    messages: list[tuple[str, str]],
+    channel: PublishChannel = "cmd",
+) -> list[Optional[Exception]]:
     """
-    loop = asyncio.get_running_loop()
-    print("[MQTT DEBUG] loop type:", type(loop))
-    print("[MQTT DEBUG] can add_reader:", hasattr(loop, "add_reader"))
-
-    host = _require_env("MQTT_HOST")
-    port = int(os.getenv("MQTT_PORT", "8883"))
-
-    tls_context = build_tls_context()
-    username, password = _get_mqtt_auth()
-
-    topic = f"doorlock/{hw_uid}/alarm/state" if hw_uid else "doorlock/+/alarm/state"
-    print(f"[MQTT LISTENER] Subscribing: {topic}")
-
-    # Prosty auto-reconnect w pętli
-    while True:
-        try:
-            async with Client(
-                hostname=host,
-                port=port,
-                username=username,
-                password=password,
-                keepalive=60,
-                tls_context=tls_context,
-            ) as client:
-                await client.subscribe(topic, qos=1)
-                print("[MQTT LISTENER] Connected ✔ Waiting for messages...")
-
-                async for msg in client.messages:
-                    try:
-                        payload = msg.payload.decode("utf-8", errors="ignore").strip()
-                    except Exception:
-                        payload = str(msg.payload)
-
-                    # topic: doorlock/<hw_uid>/alarm/state
-                    parts = msg.topic.value.split("/")
-                    got_hw_uid = (
-                        parts[1]
-                        if len(parts) >= 4 and parts[0] == "doorlock"
-                        else "UNKNOWN"
-                    )
-
-                    if payload == "1":
-                        print(f"[ALARM] Otrzymano alarm od urządzenia o hw_uid: {got_hw_uid}")
-
-                        db = SessionLocal()
-                        try:
-                            recipient = get_alarm_recipient_by_hw_uid(db, got_hw_uid)
-                        finally:
-                            db.close()
-
-                        if not recipient:
-                            print(
-                                f"[ALARM] Brak przypisanego użytkownika/email dla hw_uid={got_hw_uid} – nie wysyłam maila."
-                            )
-                            continue
-
-                        email, device_name = recipient
-
-                        # wyślij maila w osobnym wątku, żeby nie blokować listenera
-                        try:
-                            await asyncio.to_thread(
-                                send_alarm_email, email, got_hw_uid, device_name
-                            )
-                            print(f"[ALARM] Mail wysłany do: {email}")
-                        except Exception as e:
-                            print(f"[ALARM] Błąd wysyłki maila do {email}: {e}")
-                    else:
-                        # jeśli nie chcesz logować innych wartości, usuń ten print
-                        print(f"[MQTT] {msg.topic.value} -> {payload}")
-
-        except MqttError as e:
-            print(f"[MQTT LISTENER] Disconnected / error: {e}. Reconnecting in 3s...")
-            await asyncio.sleep(3)
-        except asyncio.CancelledError:
-            raise
-        except Exception as e:
-            print(f"[MQTT LISTENER] Unexpected error: {e}. Reconnecting in 3s...")
-            await asyncio.sleep(3)
+    Publikuje wiele wiadomości naraz: (hw_uid, payload).
+    Wszystkie trafiają od razu do kolejki publishera i lecą potokowo jednym połączeniem.
+    Zwraca listę błędów w tej samej kolejności (None = PUBACK otrzymany).
+    """
+    try:
+        publisher = get_publisher()
+    except Exception as e:
+        MQTT_PUBLISH_FAILURES.labels(channel).inc(len(messages))
+        err = RuntimeError(f"MQTT publish failed: {e}")
+        return [err for _ in messages]
+
+    started = time.perf_counter()
+    histogram = MQTT_PUBLISH_SECONDS.labels(channel)
+
+    def _observe(future: concurrent.futures.Future) -> None:
+        # wołane w wątku publishera przy PUBACK danej wiadomości - czas tej wiadomości, nie całej paczki
+        if not future.cancelled() and future.exception() is None:
+            histogram.observe(time.perf_counter() - started)
+
+    futures = []
+    for hw_uid, payload in messages:
+        future = publisher.submit(f"doorlock/{hw_uid}/{channel}", payload, qos=1)
+        future.add_done_callback(_observe)
+        futures.append(asyncio.wrap_future(future))
+    results = await asyncio.gather(*futures, return_exceptions=True)
+
+    errors: list[Optional[Exception]] = []
+    for res in results:
+        if isinstance(res, BaseException):
+            MQTT_PUBLISH_FAILURES.labels(channel).inc()
+            errors.append(RuntimeError(f"MQTT publish failed: {res}"))
+        else:
+            errors.append(None)
+    log.info("batch published", extra={
+        "channel": channel,
+        "ok": len(messages) - sum(e is not None for e in errors),
+        "total": len(messages),
+    })
+    return errors
 
 
 async def _quick_test_publish() -> None:
@@ -217,7 +333,7 @@ if __name__ == "__main__":
     """
     TRYB:
     - MQTT_MODE=publish  -> odpala test publish
-    - MQTT_MODE=listen   -> odpala listener alarmów
+    - MQTT_MODE=listen   -> odpala listener alarmów (to samo co python -m src.mqtt_listener)
       opcjonalnie: MQTT_LISTEN_HW_UID=ABC (nasłuch tylko jednego urządzenia)
     """
     mode = os.getenv("MQTT_MODE", "listen").lower()
@@ -225,9 +341,14 @@ if __name__ == "__main__":
 
     try:
         if mode == "publish":
-            asyncio.run(_quick_test_publish())
+            try:
+                asyncio.run(_quick_test_publish())
+            finally:
+                stop_publisher()
         else:
-            asyncio.run(listen_alarm_states(listen_hw_uid))
+            from src.mqtt_listener import run_listener_process
+
+            run_listener_process(listen_hw_uid)
     except KeyboardInterrupt:
         print("Interrupted by user")
     except Exception as e:
@@ -0,0 +1,95 @@
+import asyncio
+import hmac
+import io
+import json
+import os
+import tempfile
+from typing import AsyncIterator, Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from src.app_log import get_logger
+from src.db import AsyncSessionLocal
+from src.device_import import IMPORT_CHUNK, import_devices, iter_file_lines, parse_rows
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+log = get_logger("admin")
+
+# bez ADMIN_API_TOKEN trasy /admin są wyłączone (404)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+# treść importu do tej wielkości zostaje w pamięci, większa idzie do pliku tymczasowego
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+
+
+def require_admin(x_admin_token: str | None = Header(None)) -> None:
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def _ndjson(kind: str, data: dict) -> bytes:
+    return (json.dumps({"type": kind, **data}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _import_progress(source, fmt: str, chunk: int) -> AsyncIterator[bytes]:
+    """Import w osobnym zadaniu; po każdej paczce linia "progress", na końcu "report"."""
+    updates: asyncio.Queue[dict] = asyncio.Queue()
+    rows = parse_rows(iter_file_lines(line.rstrip("\n") for line in source), fmt)
+    task = asyncio.create_task(import_devices(
+        AsyncSessionLocal, rows, chunk_size=chunk,
+        on_progress=lambda report: updates.put_nowait(report.progress()),
+    ))
+    try:
+        while True:
+            get = asyncio.ensure_future(updates.get())
+            await asyncio.wait({get, task}, return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                break
+            yield _ndjson("progress", get.result())
+        while not updates.empty():
+            yield _ndjson("progress", updates.get_nowait())
+        try:
+            report = task.result()
+        except Exception as e:
+            # status 200 już poszedł - błąd jako ostatnia linia
+            log.error("device import failed", extra={"error": str(e)})
+            yield _ndjson("error", {"error": str(e)})
+            return
+        yield _ndjson("report", report.as_dict())
+    finally:
+        # klient się rozłączył: przerywamy import (zapisane paczki zostają)
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        source.close()
+
+
+@router.post("/devices/import", dependencies=[Depends(require_admin)])
+async def import_devices_route(
+    request: Request,
+    format: Literal["csv", "jsonl"] = Query("csv"),
+    chunk: int = Query(IMPORT_CHUNK, ge=1, le=10_000),
+):
+    """
+    Treść żądania: plik CSV (nagłówek hw_uid,name,opis,owner) albo JSONL, zapis paczkami
+    po `chunk` wierszy. Odpowiedź strumieniowa NDJSON: po każdej paczce linia
+    {"type": "progress", rows, inserted, updated, failed, chunks}, na końcu
+    {"type": "report", ...} z pełnym raportem i błędami per wiersz.
+
+    Treść jest najpierw zrzucana do pliku tymczasowego (pamięć stała): odpowiedź
+    strumieniowa nie może czytać ciała żądania równolegle z nasłuchem na rozłączenie klienta.
+    """
+    source = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES, mode="w+b")
+    try:
+        async for data in request.stream():
+            source.write(data)
+        source.seek(0)
+    except BaseException:
+        source.close()
+        raise
+    text = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    return StreamingResponse(_import_progress(text, format, chunk), media_type="application/x-ndjson")
@@ -1,24 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Literal, Dict, List, Optional
+from datetime import datetime, timezone
+import asyncio
+import base64
+import csv
+import io
+import json
+import os
 import time
 
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.db import get_db
-from src.models import Device, User
-from src.mqtt_service import publish_to_device
-from src.routers.router import get_current_user  # <- MUSI zwracać obiekt User
+from src.db import AsyncSessionLocal, get_async_db
+from src.models import Device, DeviceEvent
+from src.auth.principal_cache import Principal
+from src.device_cache import CachedDevice, device_cache
+from src.event_hub import StateChange, event_hub
+from src.event_log import event_log
+from src.command_ack import ack_tracker, format_command
+from src.mqtt_service import publish_to_device, publish_many_to_devices
+from src.routers.router import get_current_user  # <- zwraca Principal (snapshot usera)
 
 router = APIRouter(prefix="/devices", tags=["Devices"])
 
 DoorState = Literal["open", "closed"]
 AlarmState = Literal["active", "inactive"]
 
-# Tymczasowy cache stanu (per hw_uid, tylko w pamięci backendu)
-_state_cache: Dict[str, DoorState] = {}
-
-
 class DoorStateIn(BaseModel):
     state: DoorState
 
@@ -26,6 +36,9 @@ class DoorStateIn(BaseModel):
 class DoorStateOut(BaseModel):
     hw_uid: str
     state: DoorState
+    # tylko przy POST: identyfikator komendy i (przy ?wait_ack=true) czas do potwierdzenia
+    cid: Optional[str] = None
+    ack_ms: Optional[float] = None
 
 class AlarmStateIn(BaseModel):
         state: AlarmState
@@ -33,6 +46,8 @@ class AlarmStateIn(BaseModel):
 class AlarmStateOut(BaseModel):
         hw_uid: str
         state: AlarmState
+        cid: Optional[str] = None
+        ack_ms: Optional[float] = None
 
 
 class DeviceOut(BaseModel):
@@ -47,22 +62,89 @@ class DeviceListResponse(BaseModel):
     devices: List[DeviceOut]
 
 
+# maksymalna liczba urządzeń w jednym żądaniu batch
+MAX_BATCH = 500
+
+
+class BatchDoorStateItem(BaseModel):
+    hw_uid: str
+    state: DoorState
+
+
+class BatchAlarmStateItem(BaseModel):
+    hw_uid: str
+    state: AlarmState
+
+
+class BatchDoorStateIn(BaseModel):
+    items: List[BatchDoorStateItem]
+
+
+class BatchAlarmStateIn(BaseModel):
+    items: List[BatchAlarmStateItem]
+
+
+class BatchResultItem(BaseModel):
+    hw_uid: str
+    ok: bool
+    status_code: int
+    state: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class BatchResultResponse(BaseModel):
+    results: List[BatchResultItem]
+
+
+class DeviceStatesItem(BaseModel):
+    hw_uid: str
+    ok: bool
+    status_code: int
+    state: Optional[DoorState] = None
+    alarm: Optional[AlarmState] = None
+    detail: Optional[str] = None
+
+
+class DeviceStatesResponse(BaseModel):
+    devices: List[DeviceStatesItem]
+
+
+EventKind = Literal["state", "alarm", "alarm_triggered"]
+
+
+class DeviceEventOut(BaseModel):
+    id_event: int
+    ts: datetime
+    kind: str
+    value: str
+    source: str
+
+
+class DeviceEventsResponse(BaseModel):
+    hw_uid: str
+    events: List[DeviceEventOut]
+    # None = nie ma starszych zdarzeń
+    next_cursor: Optional[str] = None
+
+
 @router.get("", response_model=DeviceListResponse)
 async def get_user_devices(
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
 ):
     """Pobiera wszystkie urządzenia przypisane do zalogowanego użytkownika."""
-    devices = db.query(Device).filter(Device.id_user == user.id_user).all()
+    devices = (await db.execute(select(Device).where(Device.id_user == user.id_user))).scalars().all()
+    for device in devices:
+        device_cache.put_device(device)
     return {"devices": devices}
 
 
-def get_owned_device(
-    db: Session,
+async def get_owned_device(
+    db: AsyncSession,
     hw_uid: str,
-    user: User,
+    user: Principal,
 ) -> Device:
-    device = db.query(Device).filter(Device.hw_uid == hw_uid).first()
+    device = (await db.execute(select(Device).where(Device.hw_uid == hw_uid))).scalars().first()
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
 
@@ -72,13 +154,297 @@ def get_owned_device(
     return device
 
 
-@router.get("/{hw_uid}/state", response_model=DoorStateOut)
+async def get_owned_device_cached(
+    db: AsyncSession,
+    hw_uid: str,
+    user: Principal,
+) -> CachedDevice:
+    """Jak get_owned_device, ale najpierw patrzy w device_cache (ścieżka odczytu)."""
+    cached = device_cache.get(hw_uid)
+    if cached is None:
+        cached = device_cache.put_device(await get_owned_device(db, hw_uid, user))
+
+    if cached.id_user != user.id_user:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    return cached
+
+
+async def get_owned_devices(
+    db: AsyncSession,
+    hw_uids: List[str],
+    user: Principal,
+) -> tuple[Dict[str, Device], Dict[str, tuple[int, str]]]:
+    """
+    Wersja get_owned_device dla wielu urządzeń - jedno zapytanie dla wszystkich hw_uid.
+    Zwraca (hw_uid -> Device dla urządzeń usera, hw_uid -> (status, detail) dla pozostałych).
+    """
+    if len(hw_uids) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Too many devices (max {MAX_BATCH})")
+
+    found = {
+        d.hw_uid: d
+        for d in (await db.execute(select(Device).where(Device.hw_uid.in_(hw_uids)))).scalars()
+    }
+
+    owned: Dict[str, Device] = {}
+    errors: Dict[str, tuple[int, str]] = {}
+    for hw_uid in hw_uids:
+        device = found.get(hw_uid)
+        if not device:
+            errors[hw_uid] = (404, "Device not found")
+        elif device.id_user != user.id_user:
+            errors[hw_uid] = (403, "Forbidden")
+        else:
+            owned[hw_uid] = device
+
+    return owned, errors
+
+
+def _dedupe_items(items: list) -> list:
+    """Przy powtórzonym hw_uid wygrywa ostatnia pozycja (jak przy kolejnych pojedynczych POST)."""
+    return list({item.hw_uid: item for item in items}.values())
+
+
+async def _apply_batch(
+    db: AsyncSession,
+    user: Principal,
+    items: list,
+    field: str,
+    true_state: str,
+    channel: str,
+) -> dict:
+    items = _dedupe_items(items)
+    owned, errors = await get_owned_devices(db, [i.hw_uid for i in items], user)
+
+    # zapis w jednej transakcji
+    to_publish = [i for i in items if i.hw_uid in owned]
+    for item in to_publish:
+        setattr(owned[item.hw_uid], field, item.state == true_state)
+    if to_publish:
+        await db.commit()
+        for item in to_publish:
+            device_cache.put_device(owned[item.hw_uid])
+
+    # publikacja potokowo jednym połączeniem brokera; każda komenda z własnym cid (bez czekania na ack)
+    commands = [
+        ack_tracker.register(i.hw_uid, channel, "1" if i.state == true_state else "0")
+        for i in to_publish
+    ]
+    publish_errors = await publish_many_to_devices(
+        [(c.hw_uid, format_command(c.payload, c.cid)) for c in commands],
+        channel=channel,
+    )
+    publish_error_by_uid = {i.hw_uid: err for i, err in zip(to_publish, publish_errors)}
+    for cmd, err in zip(commands, publish_errors):
+        if err is not None:
+            ack_tracker.forget(cmd)
+
+    kind = "state" if field == "is_open" else "alarm"
+    for item in to_publish:
+        event_log.record(kind, item.state, "api", id_device=owned[item.hw_uid].id_device)
+        event_hub.publish(StateChange(hw_uid=item.hw_uid, kind=kind, value=item.state, source="api"))
+
+    results = []
+    for item in items:
+        if item.hw_uid in errors:
+            status_code, detail = errors[item.hw_uid]
+            results.append({"hw_uid": item.hw_uid, "ok": False, "status_code": status_code, "detail": detail})
+            continue
+
+        err = publish_error_by_uid.get(item.hw_uid)
+        if err is not None:
+            results.append({"hw_uid": item.hw_uid, "ok": False, "status_code": 500, "state": item.state, "detail": str(err)})
+        else:
+            results.append({"hw_uid": item.hw_uid, "ok": True, "status_code": 200, "state": item.state})
+
+    return {"results": results}
+
+
+# UWAGA: trasy /batch/... muszą być przed /{hw_uid}/..., inaczej "batch" złapie się jako hw_uid
+@router.post("/batch/state", response_model=BatchResultResponse)
+async def set_devices_state_batch(
+    payload: BatchDoorStateIn,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
+):
+    """Ustawia stan wielu zamków naraz; wynik osobno dla każdego urządzenia."""
+    return await _apply_batch(db, user, payload.items, "is_open", "open", "cmd")
+
+
+@router.post("/batch/alarm", response_model=BatchResultResponse)
+async def set_devices_alarm_batch(
+    payload: BatchAlarmStateIn,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
+):
+    """Włącza/wyłącza alarm na wielu urządzeniach naraz; wynik osobno dla każdego urządzenia."""
+    return await _apply_batch(db, user, payload.items, "alarm_active", "active", "alarm")
+
+
+@router.get("/states", response_model=DeviceStatesResponse)
+async def get_devices_states(
+    hw_uid: List[str] = Query(...),
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
+):
+    """Odczyt stanu i alarmu wielu urządzeń: GET /devices/states?hw_uid=A&hw_uid=B"""
+    hw_uids = list(dict.fromkeys(hw_uid))
+    if len(hw_uids) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Too many devices (max {MAX_BATCH})")
+
+    # z cache bierzemy co się da, resztę jednym zapytaniem
+    owned: Dict[str, CachedDevice] = {}
+    for uid in hw_uids:
+        cached = device_cache.get(uid)
+        if cached is not None:
+            owned[uid] = cached
+
+    errors: Dict[str, tuple[int, str]] = {}
+    missing = [uid for uid in hw_uids if uid not in owned]
+    if missing:
+        found, errors = await get_owned_devices(db, missing, user)
+        for uid, device in found.items():
+            owned[uid] = device_cache.put_device(device)
+
+    for uid, cached in list(owned.items()):
+        if cached.id_user != user.id_user:
+            del owned[uid]
+            errors[uid] = (403, "Forbidden")
+
+    devices = []
+    for uid in hw_uids:
+        if uid in errors:
+            status_code, detail = errors[uid]
+            devices.append({"hw_uid": uid, "ok": False, "status_code": status_code, "detail": detail})
+            continue
+        device = owned[uid]
+        devices.append({
+            "hw_uid": uid,
+            "ok": True,
+            "status_code": 200,
+            "state": "open" if device.is_open else "closed",
+            "alarm": "active" if device.alarm_active else "inactive",
+        })
+
+    return {"devices": devices}
+
+
+# co ile sekund komentarz-heartbeat w strumieniu (utrzymuje połączenie przez proxy)
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/stream")
+async def stream_device_changes(
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
+):
+    """
+    Server-Sent Events ze zmianami stanu/alarmu urządzeń zalogowanego usera.
+    Na start: event "snapshot" z aktualnym stanem; potem "change" przy każdej zmianie
+    (POST z API albo stan/alarm zgłoszony przez zamek). Klient, który nie nadąża
+    z odbiorem, dostaje "dropped" i musi połączyć się ponownie.
+    Lista urządzeń jest ustalana przy podłączeniu.
+    """
+    devices = (await db.execute(select(Device).where(Device.id_user == user.id_user))).scalars().all()
+    # strumień trwa długo - nie trzymamy połączenia z bazą
+    await db.close()
+
+    snapshot = [
+        {
+            "hw_uid": d.hw_uid,
+            "state": "open" if d.is_open else "closed",
+            "alarm": "active" if d.alarm_active else "inactive",
+        }
+        for d in devices
+        if d.hw_uid
+    ]
+    sub = event_hub.subscribe(d["hw_uid"] for d in snapshot)
+
+    async def _events():
+        try:
+            yield _sse("snapshot", {"devices": snapshot})
+            while True:
+                try:
+                    change = await sub.get(timeout=STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if change is None:
+                    yield _sse("dropped", {"reason": "slow consumer"})
+                    return
+                yield _sse("change", {
+                    "hw_uid": change.hw_uid,
+                    "kind": change.kind,
+                    "value": change.value,
+                    "source": change.source,
+                    "ts": change.ts,
+                })
+        finally:
+            event_hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _send_command(hw_uid: str, channel: str, cmd: str, state: str, wait_ack: bool) -> dict:
+    """
+    Publikacja komendy z identyfikatorem (cid) zarejestrowanym w ack_tracker.
+    wait_ack: odpowiedź dopiero po potwierdzeniu z zamka (504 po CMD_ACK_TIMEOUT, 502 gdy zamek zgłosi błąd).
+    Bez listenera odbierającego acki w tym procesie (LISTENER_MODE=off, CMD_ACK_ENABLED=0) wait_ack -> 409,
+    zanim komenda zostanie wysłana - inaczej zawsze kończyłby się mylącym 504.
+    """
+    if wait_ack and not ack_tracker.receiving:
+        raise HTTPException(
+            status_code=409,
+            detail="Command acks are not received by this API process (listener off or CMD_ACK_ENABLED=0)",
+        )
+    pending = ack_tracker.register(hw_uid, channel, cmd, wait=wait_ack)
+
+    try:
+        await publish_to_device(hw_uid, format_command(cmd, pending.cid), channel=channel)
+    except Exception as e:
+        ack_tracker.forget(pending)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    result = {"hw_uid": hw_uid, "state": state, "cid": pending.cid}
+    if not wait_ack:
+        return result
+
+    ack = await ack_tracker.wait(pending)
+    if ack is None:
+        raise HTTPException(status_code=504, detail=f"Device did not acknowledge command {pending.cid}")
+    if ack.status != "ok":
+        raise HTTPException(status_code=502, detail=f"Device reported failure for command {pending.cid}")
+    result["ack_ms"] = ack.latency_ms
+    return result
+
+
+@router.get("/{hw_uid}/commands/latency")
+async def get_device_command_latency(
+    hw_uid: str,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
+):
+    """Histogram czasu komenda -> ack dla urządzenia (od startu procesu)."""
+    await get_owned_device_cached(db, hw_uid, user)
+    return {"hw_uid": hw_uid, **ack_tracker.device_latency(hw_uid)}
+
+
+@router.get("/{hw_uid}/state", response_model=DoorStateOut, response_model_exclude_none=True)
 async def get_device_state(
     hw_uid: str,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
 ):
-    device = get_owned_device(db, hw_uid, user)
+    device = await get_owned_device_cached(db, hw_uid, user)
 
     state: DoorState = "open" if device.is_open else "closed"
 
@@ -92,40 +458,36 @@ async def get_device_state(
 async def set_device_state(
     hw_uid: str,
     payload: DoorStateIn,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    wait_ack: bool = Query(False, description="Czekaj na potwierdzenie z doorlock/<hw_uid>/ack"),
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
 ):
-    device = get_owned_device(db, hw_uid, user)
+    device = await get_owned_device(db, hw_uid, user)
 
     # mapowanie API -> baza
     new_state_bool = payload.state == "open"
 
     # zapisz do bazy
     device.is_open = new_state_bool
-    db.commit()
-    db.refresh(device)
+    await db.commit()
+    await db.refresh(device)
+    device_cache.put_device(device)
+    event_log.record("state", payload.state, "api", id_device=device.id_device)
+    event_hub.publish(StateChange(hw_uid=hw_uid, kind="state", value=payload.state, source="api"))
 
     # mapowanie API -> MQTT
     cmd = "1" if payload.state == "open" else "0"
 
-    try:
-        await publish_to_device(hw_uid, cmd)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-    return {
-        "hw_uid": hw_uid,
-        "state": payload.state,
-    }
+    return await _send_command(hw_uid, "cmd", cmd, payload.state, wait_ack)
 
 
-@router.get("/{hw_uid}/alarm", response_model=AlarmStateOut)
+@router.get("/{hw_uid}/alarm", response_model=AlarmStateOut, response_model_exclude_none=True)
 async def get_device_alarm(
     hw_uid: str,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
 ):
-    device = get_owned_device(db, hw_uid, user)
+    device = await get_owned_device_cached(db, hw_uid, user)
 
     state: AlarmState = "active" if device.alarm_active else "inactive"
     return {"hw_uid": hw_uid, "state": state}
@@ -135,24 +497,198 @@ async def get_device_alarm(
 async def set_device_alarm(
     hw_uid: str,
     payload: AlarmStateIn,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    wait_ack: bool = Query(False, description="Czekaj na potwierdzenie z doorlock/<hw_uid>/ack"),
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
 ):
-    device = get_owned_device(db, hw_uid, user)
+    device = await get_owned_device(db, hw_uid, user)
 
     alarm_bool = payload.state == "active"
     device.alarm_active = alarm_bool
-    db.commit()
-    db.refresh(device)
+    await db.commit()
+    await db.refresh(device)
+    device_cache.put_device(device)
+    event_log.record("alarm", payload.state, "api", id_device=device.id_device)
+    event_hub.publish(StateChange(hw_uid=hw_uid, kind="alarm", value=payload.state, source="api"))
 
     alarm = "1" if alarm_bool else "0"
 
-    try:
-        await publish_to_device(hw_uid, alarm, channel="alarm")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _send_command(hw_uid, "alarm", alarm, payload.state, wait_ack)
+
+# --- historia zdarzeń (device_events) ---
+
+# limit strony i rozmiar porcji eksportu
+EVENTS_MAX_LIMIT = 500
+EVENTS_EXPORT_CHUNK = int(os.getenv("EVENTS_EXPORT_CHUNK", "1000"))
+
+_EVENT_COLUMNS = ("id_event", "ts", "kind", "value", "source")
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite oddaje czas bez strefy - zapisujemy zawsze UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
 
+def _encode_cursor(ts: datetime, id_event: int) -> str:
+    raw = f"{_as_utc(ts).isoformat()}|{id_event}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        ts, id_event = raw.rsplit("|", 1)
+        return _as_utc(datetime.fromisoformat(ts)), int(id_event)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _events_query(
+    id_device: int,
+    *,
+    kind: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    after: Optional[tuple[datetime, int]],
+    descending: bool,
+    limit: int,
+):
+    """
+    Keyset zamiast OFFSET: kolejna strona zaczyna się za (ts, id_event) ostatniego wiersza,
+    więc koszt nie rośnie z numerem strony (indeks ix_device_events_device_ts).
+    """
+    ev = DeviceEvent
+    query = select(*(getattr(ev, c) for c in _EVENT_COLUMNS)).where(ev.id_device == id_device)
+    if kind:
+        query = query.where(ev.kind == kind)
+    if since:
+        query = query.where(ev.ts >= _as_utc(since))
+    if until:
+        query = query.where(ev.ts < _as_utc(until))
+    if after:
+        ts, id_event = after
+        if descending:
+            query = query.where(or_(ev.ts < ts, and_(ev.ts == ts, ev.id_event < id_event)))
+        else:
+            query = query.where(or_(ev.ts > ts, and_(ev.ts == ts, ev.id_event > id_event)))
+    if descending:
+        query = query.order_by(ev.ts.desc(), ev.id_event.desc())
+    else:
+        query = query.order_by(ev.ts.asc(), ev.id_event.asc())
+    return query.limit(limit)
+
+
+def _event_dict(row) -> dict:
     return {
-        "hw_uid": hw_uid,
-        "state": payload.state,
-    }
\ No newline at end of file
+        "id_event": row.id_event,
+        "ts": _as_utc(row.ts),
+        "kind": row.kind,
+        "value": row.value,
+        "source": row.source,
+    }
+
+
+@router.get("/{hw_uid}/events", response_model=DeviceEventsResponse)
+async def get_device_events(
+    hw_uid: str,
+    limit: int = Query(50, ge=1, le=EVENTS_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    kind: Optional[EventKind] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
+):
+    """
+    Historia zdarzeń urządzenia, od najnowszych. Kolejna strona: ?cursor=<next_cursor>.
+    Zdarzenia są zapisywane partiami, więc najnowsze mogą pojawić się z opóźnieniem ~EVENT_LOG_FLUSH_MS.
+    """
+    device = await get_owned_device_cached(db, hw_uid, user)
+
+    rows = (await db.execute(_events_query(
+        device.id_device,
+        kind=kind,
+        since=since,
+        until=until,
+        after=_decode_cursor(cursor) if cursor else None,
+        descending=True,
+        limit=limit + 1,
+    ))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].ts, rows[-1].id_event)
+
+    return {"hw_uid": hw_uid, "events": [_event_dict(r) for r in rows], "next_cursor": next_cursor}
+
+
+@router.get("/{hw_uid}/events/export")
+async def export_device_events(
+    hw_uid: str,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    kind: Optional[EventKind] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_user),
+):
+    """
+    Eksport historii (od najstarszych) jako NDJSON albo CSV, strumieniowo.
+    Zakres jest czytany porcjami po EVENTS_EXPORT_CHUNK wierszy (keyset), każda porcja
+    w krótkiej, osobnej sesji - w pamięci jest najwyżej jedna porcja i nie trzymamy
+    długiej transakcji przez cały eksport.
+    """
+    device = await get_owned_device_cached(db, hw_uid, user)
+    id_device = device.id_device
+    await db.close()
+
+    async def _chunks():
+        after = None
+        while True:
+            async with AsyncSessionLocal() as chunk_db:
+                rows = (await chunk_db.execute(_events_query(
+                    id_device,
+                    kind=kind,
+                    since=since,
+                    until=until,
+                    after=after,
+                    descending=False,
+                    limit=EVENTS_EXPORT_CHUNK,
+                ))).all()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < EVENTS_EXPORT_CHUNK:
+                return
+            after = (_as_utc(rows[-1].ts), rows[-1].id_event)
+
+    async def _ndjson():
+        async for rows in _chunks():
+            lines = []
+            for row in rows:
+                item = _event_dict(row)
+                item["ts"] = item["ts"].isoformat()
+                lines.append(json.dumps(item))
+            yield "\n".join(lines) + "\n"
+
+    async def _csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(_EVENT_COLUMNS)
+        yield buf.getvalue()
+        async for rows in _chunks():
+            buf.seek(0)
+            buf.truncate()
+            for row in rows:
+                writer.writerow((row.id_event, _as_utc(row.ts).isoformat(), row.kind, row.value, row.source))
+            yield buf.getvalue()
+
+    filename = f"{hw_uid}-events.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        _csv() if format == "csv" else _ndjson(),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
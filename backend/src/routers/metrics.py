@@ -0,0 +1,225 @@
+import hmac
+import os
+import time
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from src import metrics, mqtt_listener, mqtt_service
+from src.app_log import log_stats
+from src.auth.password_hasher import password_hasher
+from src.command_ack import ack_tracker
+from src.device_cache import device_cache
+from src.event_log import event_log
+
+router = APIRouter(tags=["Metrics"])
+
+# METRICS_TOKEN ustawiony -> /metrics wymaga "Authorization: Bearer <token>" (scraper Prometheusa)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class HttpMetricsMiddleware:
+    """
+    Czas każdego żądania HTTP -> http_request_duration_seconds{method, route, status}.
+    route to szablon ścieżki (/devices/{hw_uid}/state), nie konkretny URL - stała liczba serii.
+    Czysty ASGI (bez BaseHTTPMiddleware), więc nie buforuje odpowiedzi strumieniowych (SSE, eksport).
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+
+        async def _send(message) -> None:
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # scope["route"] ustawia router po dopasowaniu; 404 -> jedna wspólna seria
+                route = getattr(scope.get("route"), "path", "unmatched")
+                metrics.HTTP_REQUEST_SECONDS.labels(scope["method"], route, status).observe(
+                    time.perf_counter() - started
+                )
+            await send(message)
+
+        await self.app(scope, receive, _send)
+
+
+def _publisher_stats() -> dict:
+    publisher = mqtt_service._publisher
+    if publisher is None:
+        raise LookupError("publisher not started")
+    return publisher.stats()
+
+
+def _publisher_stat(name: str) -> float:
+    return _publisher_stats()[name]
+
+
+def _publisher_latency() -> dict[tuple, float]:
+    # okno ostatnich publikacji z publishera (ms) -> sekundy per kwantyl
+    latency = _publisher_stats()["latency_ms"]
+    return {(q,): latency[key] / 1000 for q, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))}
+
+
+# wartości liczone przy odczycie - z istniejących stats(), bez dodatkowego zapisu na gorącej ścieżce
+metrics.counter_func(
+    "mqtt_publisher_published_total",
+    "Komendy potwierdzone przez broker (PUBACK)",
+    lambda: _publisher_stat("published"),
+)
+metrics.counter_func(
+    "mqtt_publisher_failed_total",
+    "Komendy zakończone błędem (timeout, zerwane połączenie, stop)",
+    lambda: _publisher_stat("failed"),
+)
+metrics.counter_func(
+    "mqtt_publisher_rejected_total",
+    "Komendy odrzucone przy pełnej kolejce publishera",
+    lambda: _publisher_stat("rejected"),
+)
+metrics.gauge(
+    "mqtt_publisher_latency_seconds",
+    "Publisher: od kolejki do PUBACK, kwantyle z okna ostatnich publikacji",
+    _publisher_latency,
+    ("quantile",),
+)
+metrics.counter_func(
+    "mqtt_publisher_reconnects_total",
+    "Ponowne połączenia publishera komend",
+    lambda: _publisher_stat("reconnects"),
+)
+metrics.gauge(
+    "mqtt_publisher_queue_depth",
+    "Komendy czekające w kolejce publishera",
+    lambda: _publisher_stat("queue_depth"),
+)
+metrics.counter_func(
+    "mqtt_tls_handshakes_total",
+    "Handshake'i TLS z brokerem (publisher i listener)",
+    lambda: mqtt_service.tls_stats()["handshakes"],
+)
+metrics.counter_func(
+    "mqtt_tls_resumed_total",
+    "Handshake'i TLS ze wznowioną sesją",
+    lambda: mqtt_service.tls_stats()["resumed"],
+)
+metrics.gauge(
+    "alarm_queue_depth",
+    "Alarmy czekające na obsługę w pipeline",
+    lambda: mqtt_listener.alarm_pipeline_stats()["queue_depth"],
+)
+metrics.counter_func(
+    "alarm_debounce_suppressed_total",
+    "Alarmy wstrzymane w oknie debounce (trafiają do digestu)",
+    lambda: mqtt_listener.alarm_debounce_stats()["suppressed"],
+)
+metrics.counter_func(
+    "alarm_digests_total",
+    "Wysłane digesty zbiorcze po oknie debounce",
+    lambda: mqtt_listener.alarm_debounce_stats()["digests"],
+)
+metrics.counter_func(
+    "device_cache_hits_total",
+    "Odczyty urządzeń obsłużone z cache",
+    lambda: device_cache.stats()["hits"],
+)
+metrics.counter_func(
+    "device_cache_misses_total",
+    "Odczyty urządzeń, które poszły do bazy",
+    lambda: device_cache.stats()["misses"],
+)
+metrics.counter_func(
+    "device_cache_evictions_total",
+    "Wpisy usunięte z cache urządzeń po przekroczeniu limitu",
+    lambda: device_cache.stats()["evictions"],
+)
+metrics.gauge(
+    "device_cache_size",
+    "Urządzenia w cache",
+    lambda: device_cache.stats()["size"],
+)
+metrics.gauge(
+    "device_state_pending",
+    "Stany urządzeń czekające na zapis write-behind",
+    lambda: mqtt_listener.state_ingest_stats()["pending"],
+)
+metrics.counter_func(
+    "device_state_flushes_total",
+    "Zapisy paczek stanów urządzeń",
+    lambda: mqtt_listener.state_ingest_stats()["flushes"],
+)
+metrics.counter_func(
+    "device_state_flush_failures_total",
+    "Nieudane zapisy paczek stanów (stany wracają do bufora)",
+    lambda: mqtt_listener.state_ingest_stats()["failed_flushes"],
+)
+metrics.counter_func(
+    "device_state_rows_written_total",
+    "Wiersze devices zmienione przez zapis stanów",
+    lambda: mqtt_listener.state_ingest_stats()["rows_written"],
+)
+metrics.gauge(
+    "device_event_log_buffered",
+    "Zdarzenia czekające na zapis do device_events",
+    lambda: event_log.stats()["buffered"],
+)
+metrics.counter_func(
+    "device_event_log_dropped_total",
+    "Zdarzenia odrzucone przy pełnym buforze historii",
+    lambda: event_log.stats()["dropped"],
+)
+metrics.gauge(
+    "command_ack_pending",
+    "Komendy czekające na potwierdzenie z urządzenia",
+    lambda: ack_tracker.stats()["pending"],
+)
+metrics.gauge(
+    "password_hash_waiting",
+    "Żądania czekające na wolnego workera bcrypt",
+    lambda: password_hasher.stats()["waiting"],
+)
+metrics.counter_func(
+    "password_hash_rejected_total",
+    "Haszowania odrzucone przy pełnej kolejce (503)",
+    lambda: password_hasher.stats()["rejected"],
+)
+metrics.counter_func(
+    "password_hash_rehashed_total",
+    "Hashe przeliczone przy logowaniu na aktualny koszt bcrypt",
+    lambda: password_hasher.stats()["rehashed"],
+)
+metrics.counter_func(
+    "password_hash_failed_total",
+    "Haszowania przerwane przez padnięty proces roboczy",
+    lambda: password_hasher.stats()["failed"],
+)
+metrics.counter_func(
+    "mqtt_listener_foreign_skipped_total",
+    "Wiadomości pominięte przez listener (urządzenia innej partycji)",
+    lambda: mqtt_listener.foreign_skipped,
+)
+metrics.counter_func(
+    "log_records_dropped_total",
+    "Wpisy logu odrzucone przy pełnej kolejce zapisu",
+    lambda: log_stats()["dropped"],
+)
+metrics.counter_func(
+    "log_records_suppressed_total",
+    "Wpisy logu pominięte przez próbkowanie/limit na temat",
+    lambda: log_stats()["suppressed"],
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics(authorization: str | None = Header(None)):
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        if not authorization or not hmac.compare_digest(authorization, expected):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,18 +1,21 @@
 # app/auth/router.py
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone
 
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 import jwt
 
-from src.db import get_db
+from src.db import get_async_db
 from src.models import User, RefreshSession
 from src.auth.schemas import RegisterIn, LoginIn, RefreshIn, TokenOut
+from src.auth.principal_cache import Principal, principal_cache
+from src.auth.password_hasher import HashingBusy, password_hasher
+from src.auth.rate_limit import client_ip, login_limiter, retry_after_header
+from src.auth.refresh_sessions import add_refresh_session
 from src.auth.security import (
-    hash_password,
-    verify_password,
     create_access_token,
     create_refresh_token,
     hash_refresh,
@@ -26,17 +29,22 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 security = HTTPBearer()
 
 
-def get_current_user(
+async def get_current_user(
     creds: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
-) -> User:
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal:
     """
     Dependency do autoryzacji.
     Oczekuje nagłówka: Authorization: Bearer <access_token>
-    Zwraca obiekt User z bazy.
+    Zwraca Principal (snapshot usera). Zweryfikowane tokeny są trzymane w principal_cache
+    do swojego `exp`, więc typowy request nie dekoduje JWT ani nie pyta bazy o usera.
     """
     token = creds.credentials
 
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return cached[1]
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
         user_id = payload.get("sub")
@@ -51,18 +59,32 @@ def get_current_user(
             detail="Invalid access token",
         )
 
-    user = db.query(User).filter(User.id_user == int(user_id)).first()
+    epoch = principal_cache.epoch(int(user_id))
+    user = await db.get(User, int(user_id))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
 
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.put(token, payload, principal, epoch)
+    return principal
+
+
+async def _hash_or_503(job):
+    try:
+        return await job
+    except HashingBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, retry shortly",
+            headers={"Retry-After": "1"},
+        )
 
 
 @router.get("/me")
-def me(user: User = Depends(get_current_user)):
+async def me(user: Principal = Depends(get_current_user)):
     """
     Zwraca dane aktualnie zalogowanego usera (na podstawie access tokena).
     """
@@ -76,33 +98,30 @@ def me(user: User = Depends(get_current_user)):
 
 
 @router.post("/register", response_model=TokenOut, status_code=201)
-def register(data: RegisterIn, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == data.username).first():
+async def register(data: RegisterIn, db: AsyncSession = Depends(get_async_db)):
+    if (await db.execute(select(User.id_user).where(User.username == data.username))).first():
         raise HTTPException(409, "Username already exists")
-    if db.query(User).filter(User.email == data.email).first():
+    if (await db.execute(select(User.id_user).where(User.email == data.email))).first():
         raise HTTPException(409, "Email already exists")
 
+    # bcrypt we własnej puli (poza pętlą zdarzeń i wspólnym threadpoolem)
+    password_hash = await _hash_or_503(password_hasher.hash(data.password))
+
     user = User(
         username=data.username,
         email=data.email,
-        password_hash=hash_password(data.password),
+        password_hash=password_hash,
         nr_telefonu=data.nr_telefonu,
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     access = create_access_token(user.id_user)
     refresh = create_refresh_token()
 
-    db.add(
-        RefreshSession(
-            id_user=user.id_user,
-            token_hash=hash_refresh(refresh),
-            expires_at=refresh_expires_at(),
-        )
-    )
-    db.commit()
+    await add_refresh_session(db, user.id_user, hash_refresh(refresh), refresh_expires_at())
+    await db.commit()
 
     return TokenOut(
         access_token=access,
@@ -112,25 +131,36 @@ def register(data: RegisterIn, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=TokenOut)
-def login(data: LoginIn, db: Session = Depends(get_db)):
-    user = db.query(User).filter(
-        (User.username == data.login) | (User.email == data.login)
-    ).first()
+async def login(data: LoginIn, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # limit prób przed zapytaniem o usera i bcryptem
+    if login_limiter is not None:
+        wait = await login_limiter.check(data.login, client_ip(request))
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts",
+                headers={"Retry-After": retry_after_header(wait)},
+            )
+
+    user = (await db.execute(
+        select(User).where((User.username == data.login) | (User.email == data.login))
+    )).scalars().first()
+
+    if not user:
+        raise HTTPException(401, "Invalid credentials")
 
-    if not user or not verify_password(data.password, user.password_hash):
+    ok, new_hash = await _hash_or_503(password_hasher.verify_and_update(data.password, user.password_hash))
+    if not ok:
         raise HTTPException(401, "Invalid credentials")
+    if new_hash:
+        # hash z innym kosztem niż BCRYPT_ROUNDS - podmiana przy okazji logowania (commit niżej)
+        user.password_hash = new_hash
 
     access = create_access_token(user.id_user)
     refresh = create_refresh_token()
 
-    db.add(
-        RefreshSession(
-            id_user=user.id_user,
-            token_hash=hash_refresh(refresh),
-            expires_at=refresh_expires_at(),
-        )
-    )
-    db.commit()
+    await add_refresh_session(db, user.id_user, hash_refresh(refresh), refresh_expires_at())
+    await db.commit()
 
     return TokenOut(
         access_token=access,
@@ -140,16 +170,18 @@ def login(data: LoginIn, db: Session = Depends(get_db)):
 
 
 @router.post("/refresh", response_model=TokenOut)
-def refresh_tokens(data: RefreshIn, db: Session = Depends(get_db)):
+async def refresh_tokens(data: RefreshIn, db: AsyncSession = Depends(get_async_db)):
     now = datetime.now(timezone.utc)
     token_h = hash_refresh(data.refresh_token)
 
-    sess = db.query(RefreshSession).filter(RefreshSession.token_hash == token_h).first()
+    sess = (await db.execute(
+        select(RefreshSession).where(RefreshSession.token_hash == token_h)
+    )).scalars().first()
 
     if not sess or sess.revoked_at or sess.expires_at <= now:
         raise HTTPException(401, "Invalid refresh token")
 
-    user = db.query(User).filter(User.id_user == sess.id_user).first()
+    user = await db.get(User, sess.id_user)
     if not user:
         raise HTTPException(401, "Invalid session")
 
@@ -160,14 +192,8 @@ def refresh_tokens(data: RefreshIn, db: Session = Depends(get_db)):
     # UWAGA: to pole musi istnieć w modelu RefreshSession, inaczej usuń tę linię:
     sess.replaced_by_hash = new_hash
 
-    db.add(
-        RefreshSession(
-            id_user=user.id_user,
-            token_hash=new_hash,
-            expires_at=refresh_expires_at(),
-        )
-    )
-    db.commit()
+    await add_refresh_session(db, user.id_user, new_hash, refresh_expires_at())
+    await db.commit()
 
     new_access = create_access_token(user.id_user)
 
@@ -179,31 +205,36 @@ def refresh_tokens(data: RefreshIn, db: Session = Depends(get_db)):
 
 
 @router.post("/logout")
-def logout(data: RefreshIn, db: Session = Depends(get_db)):
+async def logout(data: RefreshIn, db: AsyncSession = Depends(get_async_db)):
     token_h = hash_refresh(data.refresh_token)
-    sess = db.query(RefreshSession).filter(RefreshSession.token_hash == token_h).first()
+    sess = (await db.execute(
+        select(RefreshSession).where(RefreshSession.token_hash == token_h)
+    )).scalars().first()
 
     if sess and not sess.revoked_at:
         sess.revoked_at = datetime.now(timezone.utc)
-        db.commit()
+        await db.commit()
 
     return {"ok": True}
 
 
 @router.post("/logout_all")
-def logout_all(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def logout_all(user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     """
     Unieważnia wszystkie aktywne refresh tokeny danego użytkownika.
     """
     now = datetime.now(timezone.utc)
 
-    db.query(RefreshSession).filter(
-        RefreshSession.id_user == user.id_user,
-        RefreshSession.revoked_at.is_(None),
-    ).update(
-        {RefreshSession.revoked_at: now},
-        synchronize_session=False,
+    await db.execute(
+        update(RefreshSession)
+        .where(
+            RefreshSession.id_user == user.id_user,
+            RefreshSession.revoked_at.is_(None),
+        )
+        .values(revoked_at=now)
+        .execution_options(synchronize_session=False)
     )
 
-    db.commit()
+    await db.commit()
+    principal_cache.revoke_user(user.id_user)
     return {"ok": True}
@@ -0,0 +1,165 @@
+# state_ingest.py
+import asyncio
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import and_, bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app_log import get_logger
+from src.device_cache import device_cache
+from src.models import Device
+
+_devices = Device.__table__
+
+log = get_logger("state")
+
+# UPDATE ... WHERE hw_uid = ? AND is_open != ? - niezmieniony stan nie generuje zapisu
+_UPDATE_IS_OPEN = (
+    update(_devices)
+    .where(
+        and_(
+            _devices.c.hw_uid == bindparam("b_hw_uid"),
+            _devices.c.is_open != bindparam("b_is_open"),
+        )
+    )
+    .values(is_open=bindparam("b_is_open"))
+)
+
+
+def parse_door_state(payload: str) -> Optional[bool]:
+    """Payload z doorlock/<hw_uid>/state: "1"/"open" -> True, "0"/"closed" -> False, inne -> None."""
+    value = payload.strip().lower()
+    if value in ("1", "open", "opened"):
+        return True
+    if value in ("0", "closed", "close"):
+        return False
+    return None
+
+
+class StateWriteBehind:
+    """
+    Zapis stanu zgłaszanego przez zamki (doorlock/<hw_uid>/state) metodą write-behind.
+
+    - offer() tylko nadpisuje ostatnią wartość dla hw_uid w pamięci (koalescencja)
+    - co flush_interval sekund (albo gdy uzbiera się max_batch urządzeń) wszystko idzie do
+      tabeli devices jednym executemany w jednej transakcji
+    - po zapisie aktualizuje device_cache (UPDATE przez core nie odpala eventów ORM)
+    - pamięta ostatni znany stan każdego urządzenia (na starcie z bazy), więc offer() mówi,
+      czy raport to zmiana - okresowe "heartbeaty" z tym samym stanem nie trafiają do historii/SSE
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        *,
+        flush_interval: float = 0.5,
+        max_batch: int = 1000,
+    ) -> None:
+        self._session_factory = session_factory
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._pending: dict[str, bool] = {}
+        self._known: dict[str, bool] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.received = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="state-write-behind")
+
+    def offer(self, hw_uid: str, is_open: bool) -> bool:
+        """Przyjmuje zgłoszony stan. True = różni się od ostatnio znanego (zmiana), False = powtórzenie."""
+        self.received += 1
+        changed = self._known.get(hw_uid) != is_open
+        self._known[hw_uid] = is_open
+        if not changed:
+            self.unchanged += 1
+        # powtórzenie też idzie do zapisu: UPDATE z warunkiem is_open != ? poprawi bazę,
+        # jeśli ktoś (np. trasa API) zmienił stan, a zamek go nie wykonał
+        if hw_uid in self._pending:
+            self.coalesced += 1
+        self._pending[hw_uid] = is_open
+        if len(self._pending) >= self._max_batch:
+            self._wake.set()
+        return changed
+
+    async def stop(self) -> None:
+        """Zatrzymuje pętlę i zapisuje to, co zostało w pamięci."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _load_known(self) -> None:
+        """Ostatnie stany z bazy - pierwszy raport po starcie nie jest traktowany jako zmiana."""
+        try:
+            async with self._session_factory() as db:
+                result = await db.stream(
+                    select(_devices.c.hw_uid, _devices.c.is_open).where(_devices.c.hw_uid.is_not(None))
+                )
+                async for hw_uid, is_open in result:
+                    # raport, który przyszedł w trakcie ładowania, jest nowszy
+                    self._known.setdefault(hw_uid, bool(is_open))
+        except Exception as e:
+            log.warning("loading known door states failed", extra={"error": str(e)})
+
+    async def _run(self) -> None:
+        await self._load_known()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+
+        started = time.monotonic()
+        params = [{"b_hw_uid": hw_uid, "b_is_open": is_open} for hw_uid, is_open in batch.items()]
+        try:
+            async with self._session_factory() as db:
+                result = await db.execute(_UPDATE_IS_OPEN, params)
+                await db.commit()
+        except Exception as e:
+            self.failed_flushes += 1
+            log.error("state flush failed", extra={"rows": len(batch), "error": str(e)})
+            # nowsze wartości, które przyszły w trakcie, mają pierwszeństwo
+            for hw_uid, is_open in batch.items():
+                self._pending.setdefault(hw_uid, is_open)
+            return
+
+        self.flushes += 1
+        self.rows_written += max(result.rowcount or 0, 0)
+        self.last_flush_ms = round((time.monotonic() - started) * 1000, 2)
+
+        for hw_uid, is_open in batch.items():
+            device_cache.update(hw_uid, is_open=is_open)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "unchanged": self.unchanged,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": self.last_flush_ms,
+        }
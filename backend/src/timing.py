@@ -0,0 +1,32 @@
+# timing.py
+from collections import deque
+from typing import Callable, Optional
+
+
+class StageTimer:
+    """
+    Okno ostatnich czasów etapu (sekundy) + licznik - do stats() komponentów.
+    observe (np. Histogram.labels(...).observe) dostaje każdy pomiar - ten sam czas trafia do /metrics.
+    """
+
+    def __init__(self, window: int = 1024, observe: Optional[Callable[[float], None]] = None) -> None:
+        self.samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self._observe = observe
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+        if self._observe is not None:
+            self._observe(seconds)
+
+    def summary(self) -> dict:
+        values = sorted(self.samples)
+        if not values:
+            return {"count": self.count, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "count": self.count,
+            "p50_ms": round(values[len(values) // 2] * 1000, 2),
+            "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
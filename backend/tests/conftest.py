@@ -0,0 +1,13 @@
+# conftest.py
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# osobna baza SQLite na przebieg testów (src.db tworzy engine przy imporcie)
+_TMP_DIR = tempfile.mkdtemp(prefix="doorlock-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from src.alarm_debounce import AlarmDebouncer
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+class DigestRecorder:
+    def __init__(self) -> None:
+        self.digests: list[tuple[str, int, datetime, datetime]] = []
+
+    async def __call__(self, hw_uid: str, count: int, first: datetime, last: datetime) -> None:
+        self.digests.append((hw_uid, count, first, last))
+
+
+def test_first_alarm_passes_and_repeats_become_one_digest():
+    recorder = DigestRecorder()
+
+    async def main():
+        debouncer = AlarmDebouncer(0.05, recorder)
+        assert debouncer.offer("dev", T0) is True
+        assert debouncer.offer("dev", T0 + timedelta(seconds=1)) is False
+        assert debouncer.offer("dev", T0 + timedelta(seconds=2)) is False
+        await asyncio.sleep(0.1)
+        return debouncer.stats()
+
+    stats = asyncio.run(main())
+
+    assert recorder.digests == [("dev", 2, T0 + timedelta(seconds=1), T0 + timedelta(seconds=2))]
+    assert stats["passed"] == 1
+    assert stats["suppressed"] == 2
+    assert stats["digests"] == 1
+
+
+def test_window_without_repeats_sends_no_digest_and_reopens_fresh():
+    recorder = DigestRecorder()
+
+    async def main():
+        debouncer = AlarmDebouncer(0.03, recorder)
+        assert debouncer.offer("dev") is True
+        await asyncio.sleep(0.06)
+        # okno zamknięte bez powtórzeń - kolejny alarm znowu przechodzi od razu
+        assert debouncer.offer("dev") is True
+        return debouncer.stats()
+
+    stats = asyncio.run(main())
+    assert recorder.digests == []
+    assert stats["open_windows"] == 1
+
+
+def test_ongoing_storm_sends_digest_per_window():
+    recorder = DigestRecorder()
+
+    async def main():
+        debouncer = AlarmDebouncer(0.05, recorder)
+        debouncer.offer("dev")
+        for _ in range(10):
+            await asyncio.sleep(0.012)
+            debouncer.offer("dev")
+        await asyncio.sleep(0.12)
+
+    asyncio.run(main())
+
+    # każdy alarm poza pierwszym trafia do dokładnie jednego digestu
+    assert len(recorder.digests) >= 2
+    assert sum(count for _, count, _, _ in recorder.digests) == 10
+
+
+def test_devices_have_independent_windows():
+    recorder = DigestRecorder()
+
+    async def main():
+        debouncer = AlarmDebouncer(0.05, recorder)
+        assert debouncer.offer("a") is True
+        assert debouncer.offer("b") is True
+        assert debouncer.offer("a") is False
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert [d[:2] for d in recorder.digests] == [("a", 1)]
+
+
+def test_flush_emits_pending_digests_immediately():
+    recorder = DigestRecorder()
+
+    async def main():
+        debouncer = AlarmDebouncer(60, recorder)
+        debouncer.offer("a")
+        debouncer.offer("a")
+        debouncer.offer("b")
+        await debouncer.flush()
+        return debouncer.stats()
+
+    stats = asyncio.run(main())
+    assert [d[:2] for d in recorder.digests] == [("a", 1)]
+    assert stats["open_windows"] == 0
+
+
+def test_zero_window_disables_debounce():
+    recorder = DigestRecorder()
+    debouncer = AlarmDebouncer(0, recorder)
+
+    assert all(debouncer.offer("dev") for _ in range(5))
+    assert debouncer.stats()["suppressed"] == 0
@@ -0,0 +1,199 @@
+import asyncio
+import random
+import time
+
+from src.alarm_pipeline import AlarmPipeline, shard_for
+from src.metrics import ALARM_END_TO_END_SECONDS, ALARM_STAGE_SECONDS
+
+
+async def _resolve(hw_uid: str):
+    return f"{hw_uid}@example.com", hw_uid
+
+
+def test_shard_for_is_stable_and_in_range():
+    assert shard_for("dev-1", 8) == shard_for("dev-1", 8)
+    assert all(0 <= shard_for(f"dev-{i}", 8) < 8 for i in range(100))
+
+
+def test_alarms_of_one_device_are_handled_in_order():
+    handled: dict[str, list[float]] = {}
+
+    async def notify(email, event, device_name):
+        # losowy czas wysyłki - kolejność ma wynikać z shardów, nie z czasu
+        await asyncio.sleep(random.random() / 1000)
+        handled.setdefault(event.hw_uid, []).append(event.received_at)
+
+    async def main():
+        pipeline = AlarmPipeline(_resolve, notify, workers=4, queue_size=1000)
+        pipeline.start()
+        for i in range(1, 51):
+            for dev in "abcde":
+                # received_at jako numer kolejny zgłoszenia
+                await pipeline.submit(dev, received_at=float(i))
+        await pipeline.stop(timeout=5)
+        return pipeline.stats()
+
+    stats = asyncio.run(main())
+
+    assert handled == {dev: [float(i) for i in range(1, 51)] for dev in "abcde"}
+    assert stats["received"] == 250
+    assert stats["failed"] == 0
+
+
+def test_devices_on_different_shards_run_in_parallel():
+    async def notify(email, event, device_name):
+        await asyncio.sleep(0.1)
+
+    async def main():
+        pipeline = AlarmPipeline(_resolve, notify, workers=8, queue_size=80)
+        pipeline.start()
+        devices = []
+        i = 0
+        while len({shard_for(d, 8) for d in devices}) < 8:
+            dev = f"dev-{i}"
+            if shard_for(dev, 8) not in {shard_for(d, 8) for d in devices}:
+                devices.append(dev)
+            i += 1
+        started = time.monotonic()
+        for dev in devices:
+            await pipeline.submit(dev)
+        await pipeline.stop(timeout=5)
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.5
+
+
+def test_stop_drains_queued_alarms():
+    sent = []
+
+    async def notify(email, event, device_name):
+        await asyncio.sleep(0.001)
+        sent.append(event.hw_uid)
+
+    async def main():
+        pipeline = AlarmPipeline(_resolve, notify, workers=2, queue_size=100)
+        pipeline.start()
+        for i in range(40):
+            await pipeline.submit(f"dev-{i}")
+        await pipeline.stop(timeout=5)
+
+    asyncio.run(main())
+    assert len(sent) == 40
+
+
+def test_stop_respects_timeout_when_worker_is_stuck_and_queue_full():
+    release = None
+
+    async def notify(email, event, device_name):
+        await release.wait()  # np. SMTP, który nie odpowiada
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        pipeline = AlarmPipeline(_resolve, notify, workers=1, queue_size=2)
+        pipeline.start()
+        await pipeline.submit("dev")
+        await asyncio.sleep(0)  # worker bierze pierwszy alarm i utyka
+        await pipeline.submit("dev")
+        await pipeline.submit("dev")  # kolejka pełna
+
+        started = time.monotonic()
+        await pipeline.stop(timeout=0.2)
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 1.0
+
+
+def test_resolve_without_recipient_and_notify_errors_are_counted():
+    async def resolve(hw_uid):
+        return None if hw_uid == "orphan" else (f"{hw_uid}@example.com", None)
+
+    async def notify(email, event, device_name):
+        raise RuntimeError("smtp down")
+
+    async def main():
+        pipeline = AlarmPipeline(resolve, notify, workers=2)
+        pipeline.start()
+        await pipeline.submit("orphan")
+        await pipeline.submit("dev")
+        await pipeline.stop(timeout=5)
+        return pipeline.stats()
+
+    stats = asyncio.run(main())
+    assert stats["no_recipient"] == 1
+    assert stats["failed"] == 1
+
+
+def test_queued_alarms_are_sent_in_one_batch_in_order():
+    calls: list[list[float]] = []
+
+    async def notify(email, event, device_name):
+        calls.append([event.received_at])
+
+    async def notify_many(items):
+        calls.append([event.received_at for _, event, _ in items])
+        return [None for _ in items]
+
+    async def main():
+        pipeline = AlarmPipeline(_resolve, notify, workers=1, queue_size=100, notify_many=notify_many, batch_size=5)
+        # zgłoszenia przed startem workera - wszystkie czekają w kolejce
+        for i in range(1, 13):
+            await pipeline.submit("dev", received_at=float(i))
+        pipeline.start()
+        await pipeline.stop(timeout=5)
+        return pipeline.stats()
+
+    stats = asyncio.run(main())
+
+    assert calls == [[1.0, 2.0, 3.0, 4.0, 5.0], [6.0, 7.0, 8.0, 9.0, 10.0], [11.0, 12.0]]
+    assert stats["batches"] == 3
+    assert stats["stages"]["end_to_end"]["count"] == 12
+
+
+def test_batch_counts_per_message_failures_and_skips_missing_recipients():
+    async def resolve(hw_uid):
+        return None if hw_uid == "orphan" else (f"{hw_uid}@example.com", None)
+
+    async def notify_many(items):
+        return [RuntimeError("rejected") if event.hw_uid == "bad" else None for _, event, _ in items]
+
+    async def main():
+        pipeline = AlarmPipeline(resolve, None, workers=1, notify_many=notify_many, batch_size=10)
+        for dev in ("ok", "orphan", "bad", "ok"):
+            await pipeline.submit(dev)
+        pipeline.start()
+        await pipeline.stop(timeout=5)
+        return pipeline.stats()
+
+    stats = asyncio.run(main())
+    assert stats["no_recipient"] == 1
+    assert stats["failed"] == 1
+    assert stats["stages"]["end_to_end"]["count"] == 2
+
+
+def _observed(child) -> float:
+    cumulative, _ = child.snapshot()
+    return cumulative[-1]
+
+
+def test_stage_times_are_exported_as_histograms():
+    stages = ("queue_wait", "resolve", "notify")
+    before = {stage: _observed(ALARM_STAGE_SECONDS.labels(stage)) for stage in stages}
+    before_total = _observed(ALARM_END_TO_END_SECONDS.labels())
+
+    async def notify(email, event, device_name):
+        pass
+
+    async def main():
+        pipeline = AlarmPipeline(_resolve, notify, workers=2)
+        pipeline.start()
+        for i in range(3):
+            await pipeline.submit(f"dev-{i}")
+        await pipeline.stop(timeout=5)
+
+    asyncio.run(main())
+
+    assert {stage: _observed(ALARM_STAGE_SECONDS.labels(stage)) - before[stage] for stage in stages} == {
+        "queue_wait": 3, "resolve": 3, "notify": 3,
+    }
+    assert _observed(ALARM_END_TO_END_SECONDS.labels()) - before_total == 3
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+
+import pytest
+
+from src.alarm_repo import RecipientCache, get_alarm_recipient_cached, recipient_cache, warm_recipient_cache
+from src.db import AsyncSessionLocal, SessionLocal, init_db
+from src.models import Device, User
+
+_seq = itertools.count()
+
+
+class CountingSessions:
+    """Fabryka sesji licząca, ile razy lookup sięgnął do bazy."""
+
+    def __init__(self) -> None:
+        self.opened = 0
+
+    def __call__(self):
+        self.opened += 1
+        return AsyncSessionLocal()
+
+
+@pytest.fixture
+def owned_device():
+    init_db()
+    recipient_cache.clear()
+    n = next(_seq)
+    with SessionLocal() as session:
+        user = User(username=f"recipient{n}", email=f"recipient{n}@example.com", password_hash="x")
+        session.add(user)
+        session.flush()
+        device = Device(name=f"Front door {n}", hw_uid=f"recipient-dev-{n}", id_user=user.id_user)
+        session.add(device)
+        session.commit()
+        yield session, user, device
+    recipient_cache.clear()
+
+
+def _lookup(sessions, hw_uid):
+    return asyncio.run(get_alarm_recipient_cached(sessions, hw_uid))
+
+
+def test_lookup_is_cached_after_first_query(owned_device):
+    _, user, device = owned_device
+    sessions = CountingSessions()
+
+    assert _lookup(sessions, device.hw_uid) == (user.email, device.name)
+    assert _lookup(sessions, device.hw_uid) == (user.email, device.name)
+    assert sessions.opened == 1
+
+
+def test_unknown_device_is_cached_negatively(owned_device):
+    sessions = CountingSessions()
+
+    assert _lookup(sessions, "no-such-device") is None
+    assert _lookup(sessions, "no-such-device") is None
+    assert sessions.opened == 1
+    assert recipient_cache.stats()["negative_hits"] == 1
+
+
+def test_user_email_change_invalidates_users_devices(owned_device):
+    session, user, device = owned_device
+    sessions = CountingSessions()
+    _lookup(sessions, device.hw_uid)
+
+    user.email = f"new-{user.email}"
+    session.commit()
+
+    assert _lookup(sessions, device.hw_uid) == (user.email, device.name)
+    assert sessions.opened == 2
+
+
+def test_device_owner_and_name_changes_invalidate_entry(owned_device):
+    session, _, device = owned_device
+    sessions = CountingSessions()
+    _lookup(sessions, device.hw_uid)
+
+    device.id_user = None
+    session.commit()
+    assert _lookup(sessions, device.hw_uid) is None
+
+    device.name = "renamed"
+    session.commit()
+    assert sessions.opened == 2
+    assert recipient_cache.get(device.hw_uid) is RecipientCache._MISS
+
+
+def test_state_change_keeps_entry(owned_device):
+    session, _, device = owned_device
+    sessions = CountingSessions()
+    _lookup(sessions, device.hw_uid)
+
+    device.is_open = True
+    device.alarm_active = True
+    session.commit()
+
+    _lookup(sessions, device.hw_uid)
+    assert sessions.opened == 1
+
+
+def test_new_device_replaces_negative_entry(owned_device):
+    session, user, _ = owned_device
+    sessions = CountingSessions()
+    hw_uid = f"later-{user.username}"
+    assert _lookup(sessions, hw_uid) is None
+
+    session.add(Device(name="later", hw_uid=hw_uid, id_user=user.id_user))
+    session.commit()
+
+    assert _lookup(sessions, hw_uid) == (user.email, "later")
+
+
+def test_user_delete_invalidates_users_devices(owned_device):
+    session, user, device = owned_device
+    sessions = CountingSessions()
+    _lookup(sessions, device.hw_uid)
+
+    session.delete(user)
+    session.commit()
+
+    assert _lookup(sessions, device.hw_uid) is None
+    assert sessions.opened == 2
+
+
+def test_warm_loads_owned_devices(owned_device):
+    _, user, device = owned_device
+
+    async def warm():
+        async with AsyncSessionLocal() as db:
+            return await warm_recipient_cache(db)
+
+    assert asyncio.run(warm()) >= 1
+    assert recipient_cache.get(device.hw_uid) == (user.email, device.name)
+
+
+def test_negative_entries_expire_sooner(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("src.alarm_repo.time.monotonic", lambda: now[0])
+    cache = RecipientCache(ttl=300, negative_ttl=60)
+    cache.put("missing", None)
+    cache.put("owned", ("a@example.com", None), 1)
+
+    now[0] += 61
+    assert cache.get("missing") is RecipientCache._MISS
+    assert cache.get("owned") == ("a@example.com", None)
@@ -0,0 +1,54 @@
+import json
+import logging
+import queue
+
+from src.app_log import BoundedQueueHandler, JsonFormatter, TopicSampler, _parse_sampling, topic_class
+
+
+def _record(msg: str = "msg", level: int = logging.INFO, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("doorlock.test", level, __file__, 1, msg, None, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_topic_class_hides_device_id():
+    assert topic_class("doorlock/dev-1/alarm/state") == "doorlock/+/alarm/state"
+    assert topic_class("other/dev-1/state") == "other/dev-1/state"
+
+
+def test_parse_sampling():
+    assert _parse_sampling("doorlock/+/state=0.01, doorlock/+/ack=0.1,bad") == {
+        "doorlock/+/state": 0.01,
+        "doorlock/+/ack": 0.1,
+    }
+
+
+def test_json_formatter_includes_extra_fields():
+    line = JsonFormatter().format(_record("alarm %s", hw_uid="dev-1", topic="doorlock/dev-1/alarm"))
+    entry = json.loads(line)
+
+    assert (entry["level"], entry["logger"]) == ("INFO", "doorlock.test")
+    assert (entry["hw_uid"], entry["topic"]) == ("dev-1", "doorlock/dev-1/alarm")
+
+
+def test_topic_sampler_limits_per_topic_class_but_not_warnings():
+    sampler = TopicSampler(rate=0.001, burst=2, sampling={})
+
+    passed = [sampler.filter(_record(topic=f"doorlock/dev-{i}/state")) for i in range(5)]
+
+    # wszystkie urządzenia dzielą jeden kubełek klasy doorlock/+/state
+    assert passed == [True, True, False, False, False]
+    assert sampler.filter(_record(topic="doorlock/dev-9/ack")) is True
+    assert sampler.filter(_record(level=logging.WARNING, topic="doorlock/dev-9/state")) is True
+    assert sampler.filter(_record()) is True
+    assert sampler.suppressed == 3
+
+
+def test_bounded_handler_drops_instead_of_blocking():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=2))
+
+    for i in range(5):
+        handler.handle(_record(f"msg {i}"))
+
+    assert (handler.enqueued, handler.dropped) == (2, 3)
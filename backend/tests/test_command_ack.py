@@ -0,0 +1,137 @@
+import asyncio
+import itertools
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src import command_ack
+from src.command_ack import AckTracker, format_command, parse_ack
+from src.db import SessionLocal, init_db
+from src.models import Device, User
+from src.routers import device_state
+from src.routers.router import get_current_user
+
+_seq = itertools.count()
+
+
+@pytest.mark.parametrize("payload, expected", [
+    ('{"cid": "abc", "status": "ok"}', ("abc", "ok")),
+    ('{"cid": "abc", "status": "error"}', ("abc", "error")),
+    ("abc", ("abc", "ok")),
+    ("1", (None, "ok")),
+    ("0", (None, "error")),
+    ("{broken", (None, "ok")),
+])
+def test_parse_ack(payload, expected):
+    assert parse_ack(payload) == expected
+
+
+def test_format_command_is_opt_in(monkeypatch):
+    monkeypatch.setattr(command_ack, "CMD_CORRELATION", False)
+    assert format_command("1", "abc") == "1"
+
+    monkeypatch.setattr(command_ack, "CMD_CORRELATION", True)
+    assert format_command("1", "abc") == '{"cmd":"1","cid":"abc"}'
+
+
+def test_ack_by_cid_and_without_cid_matches_oldest_command():
+    tracker = AckTracker()
+    first = tracker.register("dev", "cmd", "1")
+    second = tracker.register("dev", "cmd", "0")
+
+    assert tracker.resolve("dev", second.cid).cid == second.cid
+    # stary firmware: ack bez cid potwierdza najstarszą oczekującą komendę
+    assert tracker.resolve("dev", None).cid == first.cid
+    assert tracker.resolve("dev", None) is None
+
+    stats = tracker.stats()
+    assert (stats["acked"], stats["unmatched"], stats["pending"]) == (2, 1, 0)
+    assert tracker.device_latency("dev")["count"] == 2
+
+
+def test_ack_from_another_device_does_not_match():
+    tracker = AckTracker()
+    cmd = tracker.register("dev", "cmd", "1")
+
+    assert tracker.resolve("other", cmd.cid) is None
+    assert tracker.stats()["pending"] == 1
+
+
+def test_wait_gets_ack_resolved_from_listener_thread():
+    tracker = AckTracker()
+
+    async def main():
+        cmd = tracker.register("dev", "cmd", "1", wait=True)
+        threading.Timer(0.02, tracker.resolve, args=("dev", cmd.cid, "error")).start()
+        return await tracker.wait(cmd, timeout=2)
+
+    result = asyncio.run(main())
+    assert result.status == "error"
+    assert tracker.stats()["errors"] == 1
+
+
+def test_wait_times_out_and_forgets_command():
+    tracker = AckTracker()
+
+    async def main():
+        cmd = tracker.register("dev", "cmd", "1", wait=True)
+        return await tracker.wait(cmd, timeout=0.02)
+
+    assert asyncio.run(main()) is None
+    assert tracker.stats()["timeouts"] == 1
+    assert tracker.stats()["pending"] == 0
+
+
+@pytest.fixture
+def lock_client(monkeypatch):
+    """Klient API z jednym urządzeniem usera; publikacja podmieniona - zamek od razu potwierdza."""
+    init_db()
+    n = next(_seq)
+    hw_uid = f"ack-dev-{n}"
+    with SessionLocal() as session:
+        user = User(username=f"ack{n}", email=f"ack{n}@example.com", password_hash="x")
+        session.add(user)
+        session.flush()
+        session.add(Device(name="lock", hw_uid=hw_uid, id_user=user.id_user))
+        session.commit()
+        principal = SimpleNamespace(id_user=user.id_user)
+
+    sent = []
+
+    async def fake_publish(hw_uid, payload, channel="cmd"):
+        sent.append((hw_uid, payload))
+        device_state.ack_tracker.resolve(hw_uid, None)
+
+    monkeypatch.setattr(device_state, "publish_to_device", fake_publish)
+    app = FastAPI()
+    app.include_router(device_state.router)
+    app.dependency_overrides[get_current_user] = lambda: principal
+    with TestClient(app) as c:
+        yield c, hw_uid, sent
+
+
+def test_wait_ack_without_ack_listener_is_rejected_before_publish(lock_client, monkeypatch):
+    client, hw_uid, sent = lock_client
+    monkeypatch.setattr(device_state.ack_tracker, "receiving", False)
+
+    r = client.post(f"/devices/{hw_uid}/state", params={"wait_ack": "true"}, json={"state": "open"})
+
+    assert r.status_code == 409
+    assert sent == []
+    # bez czekania komenda nadal idzie
+    assert client.post(f"/devices/{hw_uid}/state", json={"state": "open"}).status_code == 200
+    assert len(sent) == 1
+
+
+def test_wait_ack_with_ack_listener_returns_ack_latency(lock_client, monkeypatch):
+    client, hw_uid, sent = lock_client
+    monkeypatch.setattr(device_state.ack_tracker, "receiving", True)
+
+    r = client.post(f"/devices/{hw_uid}/state", params={"wait_ack": "true"}, json={"state": "closed"})
+
+    assert r.status_code == 200
+    assert r.json()["ack_ms"] >= 0
+    assert sent == [(hw_uid, "0")]
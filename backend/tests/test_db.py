@@ -0,0 +1,74 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db import (
+    SessionLocal,
+    create_async_db_engine,
+    create_async_session_factory,
+    get_async_db,
+    init_db,
+    to_async_url,
+)
+from src.models import User
+
+_seq = itertools.count()
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("sqlite:///./app.db", "sqlite+aiosqlite:///./app.db"),
+    ("postgresql://u:p@db:5432/app", "postgresql+asyncpg://u:p@db:5432/app"),
+    ("postgresql+psycopg2://u:p@db/app", "postgresql+asyncpg://u:p@db/app"),
+])
+def test_to_async_url(url, expected):
+    assert to_async_url(url) == expected
+
+
+def test_to_async_url_rejects_unknown_backend():
+    with pytest.raises(RuntimeError, match="mysql"):
+        to_async_url("mysql://u:p@db/app")
+
+
+@pytest.fixture
+def username():
+    init_db()
+    name = f"asyncdb{next(_seq)}"
+    with SessionLocal() as session:
+        session.add(User(username=name, email=f"{name}@example.com", password_hash="x"))
+        session.commit()
+    return name
+
+
+async def _email(db: AsyncSession, username: str) -> str:
+    return (await db.execute(select(User.email).where(User.username == username))).scalar_one()
+
+
+def test_get_async_db_sees_rows_committed_by_sync_session(username):
+    async def read():
+        gen = get_async_db()
+        db = await gen.__anext__()
+        try:
+            assert isinstance(db, AsyncSession)
+            return await _email(db, username)
+        finally:
+            await gen.aclose()
+
+    assert asyncio.run(read()) == f"{username}@example.com"
+
+
+def test_separate_engine_on_another_loop(username):
+    # jak listener MQTT: własna pętla w wątku, własny engine
+    async def read():
+        engine = create_async_db_engine()
+        try:
+            async with create_async_session_factory(engine)() as db:
+                return await _email(db, username)
+        finally:
+            await engine.dispose()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(asyncio.run, read()).result(timeout=5) == f"{username}@example.com"
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from src.db_profile import PROFILES, apply_sqlite_pragmas, describe, engine_kwargs, load_storage_profile
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    monkeypatch.delenv("DB_PROFILE", raising=False)
+    monkeypatch.delenv("DB_POOL_PRE_PING", raising=False)
+    for name in ("JOURNAL_MODE", "SYNCHRONOUS", "MMAP_SIZE", "CACHE_SIZE", "BUSY_TIMEOUT", "TEMP_STORE"):
+        monkeypatch.delenv(f"DB_SQLITE_{name}", raising=False)
+    for name in ("DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_POOL_TIMEOUT", "DB_POOL_RECYCLE"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_default_profile_changes_nothing():
+    profile = load_storage_profile()
+
+    assert profile is PROFILES["default"]
+    assert profile.sqlite_pragmas() == {}
+    assert profile.pool_kwargs() == {}
+
+
+def test_env_overrides_single_settings(monkeypatch):
+    monkeypatch.setenv("DB_PROFILE", "Production")
+    monkeypatch.setenv("DB_SQLITE_BUSY_TIMEOUT", "100")
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "0")
+
+    profile = load_storage_profile()
+
+    assert profile.name == "production"
+    assert profile.sqlite_pragmas()["busy_timeout"] == 100
+    assert profile.sqlite_pragmas()["journal_mode"] == "WAL"
+    assert profile.pool_kwargs()["pool_size"] == 3
+    assert "pool_pre_ping" not in profile.pool_kwargs()
+
+
+def test_unknown_profile_fails(monkeypatch):
+    monkeypatch.setenv("DB_PROFILE", "fast")
+    with pytest.raises(RuntimeError, match="DB_PROFILE"):
+        load_storage_profile()
+
+
+def test_engine_kwargs_per_backend():
+    production = PROFILES["production"]
+
+    sqlite_file = engine_kwargs("sqlite:///./app.db", production)
+    assert sqlite_file["connect_args"] == {"check_same_thread": False}
+    assert sqlite_file["pool_size"] == 10
+
+    # pula jednego połączenia - bez parametrów puli
+    assert engine_kwargs("sqlite://", production) == {"connect_args": {"check_same_thread": False}}
+
+    postgres = engine_kwargs("postgresql+psycopg2://u:p@db/app", production)
+    assert "connect_args" not in postgres
+    assert postgres["pool_pre_ping"] is True
+
+
+def test_pragmas_applied_on_every_connection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+    apply_sqlite_pragmas(engine, PROFILES["production"])
+    try:
+        for _ in range(2):
+            with engine.connect() as conn:
+                assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+                assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+            engine.dispose()
+    finally:
+        engine.dispose()
+
+
+def test_describe_hides_password():
+    line = describe("postgresql+psycopg2://user:secret@db/app", PROFILES["production"])
+
+    assert "secret" not in line
+    assert line.startswith("profile=production url=postgresql+psycopg2://user:***@db/app")
@@ -0,0 +1,122 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.db import SessionLocal, init_db
+from src.models import Device, User
+from src.routers import device_state
+from src.routers.router import get_current_user
+
+_seq = itertools.count()
+
+
+@pytest.fixture
+def fleet():
+    """Dwa urządzenia usera (a, b) i jedno cudze (c)."""
+    init_db()
+    n = next(_seq)
+    prefix = f"batch-{n}"
+    with SessionLocal() as session:
+        owner = User(username=f"batch{n}", email=f"batch{n}@example.com", password_hash="x")
+        other = User(username=f"batch{n}-other", email=f"batch{n}-other@example.com", password_hash="x")
+        session.add_all([owner, other])
+        session.flush()
+        session.add_all([
+            Device(name="a", hw_uid=f"{prefix}-a", id_user=owner.id_user),
+            Device(name="b", hw_uid=f"{prefix}-b", id_user=owner.id_user),
+            Device(name="c", hw_uid=f"{prefix}-c", id_user=other.id_user),
+        ])
+        session.commit()
+        return SimpleNamespace(id_user=owner.id_user), prefix
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Podmiana publikacji: zapisuje (kanał, hw_uid), dla hw_uid z `failing` zwraca błąd."""
+    sent: list[tuple[str, str]] = []
+    failing: set[str] = set()
+
+    async def fake_publish_many(messages, channel="cmd"):
+        sent.extend((channel, hw_uid) for hw_uid, _ in messages)
+        return [
+            RuntimeError("MQTT publish failed: broker down") if hw_uid in failing else None
+            for hw_uid, _ in messages
+        ]
+
+    monkeypatch.setattr(device_state, "publish_many_to_devices", fake_publish_many)
+    return sent, failing
+
+
+@pytest.fixture
+def client(fleet):
+    user, _ = fleet
+    app = FastAPI()
+    app.include_router(device_state.router)
+    app.dependency_overrides[get_current_user] = lambda: user
+    with TestClient(app) as c:
+        yield c
+
+
+def _device(hw_uid: str) -> Device:
+    with SessionLocal() as session:
+        return session.query(Device).filter_by(hw_uid=hw_uid).one()
+
+
+def test_batch_reports_each_device_and_continues_after_failures(client, fleet, published):
+    _, prefix = fleet
+    sent, failing = published
+    failing.add(f"{prefix}-b")
+    items = [{"hw_uid": f"{prefix}-{x}", "state": "open"} for x in ("a", "b", "c", "missing")]
+
+    r = client.post("/devices/batch/state", json={"items": items})
+    results = r.json()["results"]
+
+    assert r.status_code == 200
+    assert [(res["hw_uid"], res["status_code"], res["ok"]) for res in results] == [
+        (f"{prefix}-a", 200, True),
+        (f"{prefix}-b", 500, False),
+        (f"{prefix}-c", 403, False),
+        (f"{prefix}-missing", 404, False),
+    ]
+    assert "broker down" in results[1]["detail"]
+    # komendy tylko dla własnych urządzeń, jedną paczką
+    assert sent == [("cmd", f"{prefix}-a"), ("cmd", f"{prefix}-b")]
+    assert _device(f"{prefix}-a").is_open is True
+    assert _device(f"{prefix}-c").is_open is False
+
+
+def test_batch_alarm_repeated_hw_uid_last_item_wins(client, fleet, published):
+    _, prefix = fleet
+    sent, _ = published
+    items = [
+        {"hw_uid": f"{prefix}-a", "state": "active"},
+        {"hw_uid": f"{prefix}-a", "state": "inactive"},
+    ]
+
+    results = client.post("/devices/batch/alarm", json={"items": items}).json()["results"]
+
+    assert [(res["hw_uid"], res["state"]) for res in results] == [(f"{prefix}-a", "inactive")]
+    assert sent == [("alarm", f"{prefix}-a")]
+    assert _device(f"{prefix}-a").alarm_active is False
+
+
+def test_batch_over_limit_is_413(client, fleet, published, monkeypatch):
+    _, prefix = fleet
+    monkeypatch.setattr(device_state, "MAX_BATCH", 2)
+    items = [{"hw_uid": f"{prefix}-{x}", "state": "open"} for x in ("a", "b", "c")]
+
+    assert client.post("/devices/batch/state", json={"items": items}).status_code == 413
+    assert published[0] == []
+
+
+def test_bulk_states_read(client, fleet):
+    _, prefix = fleet
+
+    r = client.get("/devices/states", params={"hw_uid": [f"{prefix}-a", f"{prefix}-c", f"{prefix}-a"]})
+    devices = r.json()["devices"]
+
+    assert [(d["hw_uid"], d["status_code"]) for d in devices] == [(f"{prefix}-a", 200), (f"{prefix}-c", 403)]
+    assert (devices[0]["state"], devices[0]["alarm"]) == ("closed", "inactive")
@@ -0,0 +1,112 @@
+import itertools
+
+import pytest
+
+from src.db import SessionLocal, init_db
+from src.device_cache import CachedDevice, DeviceCache, device_cache
+from src.models import Device, User
+
+_seq = itertools.count()
+
+
+def _cached(hw_uid: str, id_user: int | None = 1, is_open: bool = False) -> CachedDevice:
+    return CachedDevice(id_device=1, hw_uid=hw_uid, id_user=id_user, name=hw_uid, is_open=is_open, alarm_active=False)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = DeviceCache(max_size=2, ttl=60)
+    cache.put(_cached("a"))
+    cache.put(_cached("b"))
+    assert cache.get("a") is not None  # "a" świeżo użyte
+    cache.put(_cached("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.device_cache.time.monotonic", lambda: now[0])
+    cache = DeviceCache(max_size=10, ttl=30)
+    cache.put(_cached("a"))
+
+    now[0] += 29
+    assert cache.get("a") is not None
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_update_changes_only_existing_entry():
+    cache = DeviceCache(max_size=10, ttl=60)
+    cache.put(_cached("a"))
+    cache.update("a", is_open=True)
+    cache.update("missing", is_open=True)
+
+    assert cache.get("a").is_open is True
+    assert cache.get("missing") is None
+
+
+def test_invalidate_user_drops_only_that_users_devices():
+    cache = DeviceCache(max_size=10, ttl=60)
+    cache.put(_cached("a", id_user=1))
+    cache.put(_cached("b", id_user=2))
+    cache.invalidate_user(1)
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+
+
+def test_zero_size_disables_cache():
+    cache = DeviceCache(max_size=0, ttl=60)
+    cache.put(_cached("a"))
+    assert cache.get("a") is None
+
+
+@pytest.fixture
+def db():
+    init_db()
+    with SessionLocal() as session:
+        n = next(_seq)
+        user = User(username=f"cache{n}", email=f"cache{n}@example.com", password_hash="x")
+        session.add(user)
+        session.flush()
+        device = Device(name="lock", hw_uid=f"cache-dev-{n}", id_user=user.id_user)
+        session.add(device)
+        session.commit()
+        yield session, device
+    device_cache.clear()
+
+
+def test_orm_update_invalidates_entry(db):
+    db, device = db
+    device_cache.put_device(device)
+
+    device.name = "renamed"
+    db.commit()
+
+    assert device_cache.get(device.hw_uid) is None
+
+
+def test_orm_hw_uid_change_invalidates_old_key(db):
+    db, device = db
+    old_uid = device.hw_uid
+    device_cache.put_device(device)
+
+    device.hw_uid = f"{old_uid}-new"
+    db.commit()
+
+    assert device_cache.get(old_uid) is None
+
+
+def test_orm_delete_invalidates_entry(db):
+    db, device = db
+    hw_uid = device.hw_uid
+    device_cache.put_device(device)
+
+    db.delete(device)
+    db.commit()
+
+    assert device_cache.get(hw_uid) is None
@@ -0,0 +1,126 @@
+import itertools
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from src.auth.principal_cache import Principal
+from src.db import SessionLocal, init_db
+from src.models import Device, DeviceEvent, User
+from src.routers import device_state
+from src.routers.router import get_current_user
+
+_seq = itertools.count()
+T0 = datetime(2024, 5, 1, 8, 0, 0, 123456, tzinfo=timezone.utc)
+
+
+def test_cursor_round_trip_keeps_microseconds_and_utc():
+    local = T0.astimezone(timezone(timedelta(hours=2)))
+    cursor = device_state._encode_cursor(local, 42)
+
+    assert "=" not in cursor
+    assert device_state._decode_cursor(cursor) == (T0, 42)
+
+
+def test_cursor_from_naive_sqlite_timestamp_is_utc():
+    cursor = device_state._encode_cursor(T0.replace(tzinfo=None), 7)
+    assert device_state._decode_cursor(cursor) == (T0, 7)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "bm9waXBl", device_state._encode_cursor(T0, 1)[:-4]])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        device_state._decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+@pytest.fixture
+def history():
+    """Urządzenie z 10 zdarzeniami; po dwa mają ten sam ts (remisy rozstrzyga id_event)."""
+    init_db()
+    n = next(_seq)
+    with SessionLocal() as session:
+        user = User(username=f"events{n}", email=f"events{n}@example.com", password_hash="x")
+        session.add(user)
+        session.flush()
+        device = Device(name="lock", hw_uid=f"events-dev-{n}", id_user=user.id_user)
+        session.add(device)
+        session.flush()
+        events = [
+            DeviceEvent(
+                id_device=device.id_device,
+                ts=T0 + timedelta(seconds=i // 2),
+                kind="state" if i % 3 else "alarm_triggered",
+                value=str(i),
+                source="device",
+            )
+            for i in range(10)
+        ]
+        session.add_all(events)
+        session.commit()
+        principal = Principal(user.id_user, user.username, user.email, None, T0)
+        yield device.hw_uid, principal, [e.id_event for e in events]
+
+    device_state.device_cache.clear()
+
+
+@pytest.fixture
+def client(history):
+    _, principal, _ = history
+    app = FastAPI()
+    app.include_router(device_state.router)
+    app.dependency_overrides[get_current_user] = lambda: principal
+    with TestClient(app) as c:
+        yield c
+
+
+def _pages(client, hw_uid, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, **({"cursor": cursor} if cursor else {}))
+        body = client.get(f"/devices/{hw_uid}/events", params=query).json()
+        ids += [e["id_event"] for e in body["events"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+def test_keyset_pages_cover_history_newest_first_without_gaps(client, history):
+    hw_uid, _, event_ids = history
+
+    ids, pages = _pages(client, hw_uid, limit=3)
+
+    assert ids == list(reversed(event_ids))
+    assert pages == 4
+
+
+def test_keyset_pages_with_kind_filter(client, history):
+    hw_uid, _, event_ids = history
+
+    ids, _ = _pages(client, hw_uid, limit=2, kind="alarm_triggered")
+
+    assert ids == [event_ids[i] for i in (9, 6, 3, 0)]
+
+
+def test_export_streams_all_events_oldest_first_across_chunks(client, history, monkeypatch):
+    hw_uid, _, event_ids = history
+    monkeypatch.setattr(device_state, "EVENTS_EXPORT_CHUNK", 3)
+
+    r = client.get(f"/devices/{hw_uid}/events/export")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    assert [row["id_event"] for row in rows] == event_ids
+
+
+def test_export_csv(client, history, monkeypatch):
+    hw_uid, _, event_ids = history
+    monkeypatch.setattr(device_state, "EVENTS_EXPORT_CHUNK", 4)
+
+    lines = client.get(f"/devices/{hw_uid}/events/export", params={"format": "csv"}).text.splitlines()
+
+    assert lines[0] == "id_event,ts,kind,value,source"
+    assert [int(line.split(",")[0]) for line in lines[1:]] == event_ids
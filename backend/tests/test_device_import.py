@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.db import AsyncSessionLocal, SessionLocal, init_db
+from src.device_cache import device_cache
+from src.device_import import ImportReport, import_devices, iter_file_lines, parse_rows
+from src.models import Device, User
+from src.routers import admin
+
+_seq = itertools.count()
+
+
+@pytest.fixture
+def owner():
+    init_db()
+    n = next(_seq)
+    with SessionLocal() as session:
+        user = User(username=f"importer{n}", email=f"importer{n}@example.com", password_hash="x")
+        session.add(user)
+        session.commit()
+        return user.id_user, user.username, f"imp{n}"
+
+
+def _run_import(text: str, fmt: str = "csv", chunk: int = 1000, progress=None) -> ImportReport:
+    rows = parse_rows(iter_file_lines(text.splitlines()), fmt)
+    return asyncio.run(import_devices(AsyncSessionLocal, rows, chunk_size=chunk, on_progress=progress))
+
+
+def _devices(prefix: str) -> dict[str, Device]:
+    with SessionLocal() as session:
+        found = session.query(Device).filter(Device.hw_uid.like(f"{prefix}-%")).all()
+        return {d.hw_uid: d for d in found}
+
+
+def test_parse_rows_reports_bad_lines_and_multiline_csv():
+    text = 'hw_uid,name,opis\nd-1,lock,"two\nlines"\nd-2,a,b,extra\n'
+
+    async def collect():
+        return [row async for row in parse_rows(iter_file_lines(text.splitlines()), "csv")]
+
+    rows = asyncio.run(collect())
+
+    assert rows[0] == (2, {"hw_uid": "d-1", "name": "lock", "opis": "two\nlines"})
+    assert rows[1][0] == 4 and "expected 3 columns" in rows[1][1]["_error"]
+
+
+def test_insert_then_update_keeps_owner_and_opis_when_empty(owner):
+    id_user, username, prefix = owner
+    first = _run_import(
+        f"hw_uid,name,opis,owner\n{prefix}-1,front,main door,{username}\n{prefix}-2,,,\n"
+    )
+    assert (first.inserted, first.updated, first.failed) == (2, 0, 0)
+
+    second = _run_import(f"hw_uid,name,opis,owner\n{prefix}-1,renamed,,\n{prefix}-3,back,,\n")
+    assert (second.inserted, second.updated) == (1, 1)
+
+    devices = _devices(prefix)
+    assert devices[f"{prefix}-1"].name == "renamed"
+    assert devices[f"{prefix}-1"].opis == "main door"
+    assert devices[f"{prefix}-1"].id_user == id_user
+    # nowe urządzenie bez name dostaje hw_uid
+    assert devices[f"{prefix}-2"].name == f"{prefix}-2"
+
+
+def test_row_errors_do_not_stop_import(owner):
+    _, _, prefix = owner
+    text = "\n".join([
+        json.dumps({"hw_uid": f"{prefix}-1"}),
+        "{not json",
+        json.dumps({"name": "no uid"}),
+        json.dumps({"hw_uid": f"{prefix}-2", "owner": "nobody@example.com"}),
+        json.dumps({"hw_uid": "x" * 65}),
+        json.dumps({"hw_uid": f"{prefix}-3"}),
+    ])
+
+    report = _run_import(text, fmt="jsonl", chunk=2)
+
+    assert (report.rows, report.inserted, report.failed) == (6, 2, 4)
+    assert [e.line for e in report.errors] == [2, 3, 4, 5]
+    assert "unknown owner" in report.errors[2].error
+    assert set(_devices(prefix)) == {f"{prefix}-1", f"{prefix}-3"}
+
+
+def test_duplicate_rows_in_chunk_are_reported(owner):
+    _, _, prefix = owner
+    report = _run_import(f"hw_uid,name\n{prefix}-1,first\n{prefix}-2,other\n{prefix}-1,second\n")
+
+    assert (report.inserted, report.failed) == (2, 1)
+    assert (report.errors[0].line, report.errors[0].hw_uid) == (2, f"{prefix}-1")
+    assert "replaced by line 4" in report.errors[0].error
+    assert _devices(prefix)[f"{prefix}-1"].name == "second"
+
+
+def test_failed_chunk_reports_each_row_once(owner):
+    _, _, prefix = owner
+
+    def failing_sessions():
+        session = AsyncSessionLocal()
+
+        async def commit():
+            raise RuntimeError("disk full")
+
+        session.commit = commit
+        return session
+
+    text = f"hw_uid,owner\n{prefix}-1,nobody@example.com\n{prefix}-2,\n{prefix}-2,\n"
+    rows = parse_rows(iter_file_lines(text.splitlines()), "csv")
+    report = asyncio.run(import_devices(failing_sessions, rows))
+
+    assert (report.inserted, report.failed) == (0, 3)
+    assert [(e.line, e.error) for e in report.errors] == [(line, "chunk failed: disk full") for line in (2, 3, 4)]
+    assert _devices(prefix) == {}
+
+
+def test_progress_after_each_chunk_and_cache_invalidated(owner):
+    _, _, prefix = owner
+    _run_import(f"hw_uid,name\n{prefix}-1,old\n")
+    with SessionLocal() as session:
+        device_cache.put_device(session.query(Device).filter_by(hw_uid=f"{prefix}-1").one())
+    seen = []
+
+    _run_import(
+        f"hw_uid,name\n{prefix}-1,new\n{prefix}-2,b\n{prefix}-3,c\n",
+        chunk=2,
+        progress=lambda report: seen.append(report.progress()),
+    )
+
+    assert [p["rows"] for p in seen] == [2, 3]
+    assert device_cache.get(f"{prefix}-1") is None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_API_TOKEN", "secret")
+    app = FastAPI()
+    app.include_router(admin.router)
+    with TestClient(app) as c:
+        yield c
+
+
+def test_import_endpoint_requires_token(client):
+    assert client.post("/admin/devices/import", content=b"hw_uid\n").status_code == 403
+
+
+def test_import_endpoint_streams_progress_then_report(client, owner):
+    _, _, prefix = owner
+    body = "hw_uid,name\n" + "".join(f"{prefix}-{i},lock {i}\n" for i in range(5)) + ",missing\n"
+
+    r = client.post(
+        "/admin/devices/import",
+        params={"chunk": 2},
+        headers={"X-Admin-Token": "secret"},
+        content=body.encode(),
+    )
+    lines = [json.loads(line) for line in r.text.splitlines()]
+
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    assert [line["type"] for line in lines] == ["progress"] * 3 + ["report"]
+    assert [line["rows"] for line in lines[:3]] == [2, 4, 6]
+    assert (lines[-1]["inserted"], lines[-1]["failed"]) == (5, 1)
+    assert lines[-1]["errors"] == [{"line": 7, "hw_uid": None, "error": "missing hw_uid"}]
@@ -0,0 +1,118 @@
+import asyncio
+import itertools
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.db import AsyncSessionLocal, SessionLocal, init_db
+from src.event_hub import EventHub, StateChange
+from src.models import Device, User
+from src.routers import device_state
+
+_seq = itertools.count()
+
+
+def _change(hw_uid: str, value: str = "open") -> StateChange:
+    return StateChange(hw_uid=hw_uid, kind="state", value=value, source="device")
+
+
+def test_subscriber_gets_only_its_devices():
+    hub = EventHub()
+
+    async def main():
+        sub = hub.subscribe(["a"])
+        hub.publish(_change("b"))
+        hub.publish(_change("a"))
+        return await sub.get(timeout=1)
+
+    assert asyncio.run(main()).hw_uid == "a"
+    assert hub.stats()["published"] == 2
+    assert hub.stats()["delivered"] == 1
+
+
+def test_publish_from_another_thread_reaches_subscriber_loop():
+    hub = EventHub()
+
+    async def main():
+        sub = hub.subscribe(["a"])
+        # jak listener MQTT: publikacja z wątku z własną pętlą
+        thread = threading.Thread(target=lambda: asyncio.run(_publish_async(hub)))
+        thread.start()
+        change = await sub.get(timeout=1)
+        thread.join()
+        return change
+
+    assert asyncio.run(main()).value == "closed"
+
+
+async def _publish_async(hub: EventHub) -> None:
+    hub.publish(_change("a", "closed"))
+
+
+def test_slow_subscriber_is_dropped_without_affecting_others():
+    hub = EventHub(queue_size=2)
+
+    async def main():
+        slow = hub.subscribe(["a"])
+        fast = hub.subscribe(["a"])
+        received = []
+        for value in ("1", "2", "3"):
+            hub.publish(_change("a", value))
+            received.append((await fast.get(timeout=1)).value)
+        return slow, received
+
+    slow, received = asyncio.run(main())
+
+    assert received == ["1", "2", "3"]
+    assert slow.dropped is True
+    # po odłączeniu w kolejce zostaje tylko znacznik końca
+    assert slow.queue.get_nowait() is None
+    assert hub.stats()["subscribers"] == 1
+    assert hub.stats()["dropped_subscribers"] == 1
+
+
+@pytest.fixture
+def owner():
+    init_db()
+    n = next(_seq)
+    with SessionLocal() as session:
+        user = User(username=f"stream{n}", email=f"stream{n}@example.com", password_hash="x")
+        session.add(user)
+        session.flush()
+        session.add(Device(name="lock", hw_uid=f"stream-dev-{n}", id_user=user.id_user, is_open=True))
+        session.commit()
+        return SimpleNamespace(id_user=user.id_user), f"stream-dev-{n}"
+
+
+def _parse(chunk: str) -> tuple[str, dict]:
+    event, data = chunk.strip().split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+def test_stream_sends_snapshot_then_changes_and_heartbeats(owner, monkeypatch):
+    user, hw_uid = owner
+    monkeypatch.setattr(device_state, "STREAM_HEARTBEAT", 0.05)
+
+    async def main():
+        async with AsyncSessionLocal() as db:
+            response = await device_state.stream_device_changes(db, user)
+        events = response.body_iterator
+        try:
+            snapshot = await events.__anext__()
+            heartbeat = await events.__anext__()
+            device_state.event_hub.publish(_change(hw_uid, "closed"))
+            change = await events.__anext__()
+        finally:
+            await events.aclose()
+        return snapshot, heartbeat, change
+
+    snapshot, heartbeat, change = asyncio.run(main())
+
+    assert _parse(snapshot) == ("snapshot", {"devices": [{"hw_uid": hw_uid, "state": "open", "alarm": "inactive"}]})
+    assert heartbeat == ": keep-alive\n\n"
+    event, data = _parse(change)
+    assert (event, data["hw_uid"], data["value"], data["source"]) == ("change", hw_uid, "closed", "device")
+    # zamknięty strumień nie zostawia subskrybenta
+    assert hw_uid not in device_state.event_hub._by_hw_uid
@@ -0,0 +1,229 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src import metrics, mqtt_listener, mqtt_service
+from src.auth.password_hasher import HashingBusy, PasswordHasher
+from src.device_cache import CachedDevice, DeviceCache
+from src.routers import metrics as metrics_router
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    # metryki z testów nie zostają w globalnym rejestrze
+    before = list(metrics.REGISTRY)
+    yield
+    metrics.REGISTRY[:] = before
+
+
+def _series(text: str) -> dict[str, float]:
+    out = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            out[name] = float(value)
+    return out
+
+
+def test_render_round_trip():
+    counter = metrics.Counter("test_events_total", "Zdarzenia", ("kind",))
+    histogram = metrics.Histogram("test_seconds", "Czas", buckets=(0.1, 1.0))
+    metrics.gauge("test_depth", "Głębokość", lambda: 7)
+
+    counter.labels('a"b\n').inc()
+    counter.labels('a"b\n').inc(2)
+    # zapis z innego wątku trafia do osobnego shardu, odczyt sumuje
+    thread = threading.Thread(target=counter.labels("x").inc)
+    thread.start()
+    thread.join()
+    for seconds in (0.05, 0.5, 5.0):
+        histogram.observe(seconds)
+
+    text = metrics.render_prometheus()
+    series = _series(text)
+
+    assert "# TYPE test_events_total counter" in text
+    assert "# TYPE test_seconds histogram" in text
+    assert series['test_events_total{kind="a\\"b\\n"}'] == 3
+    assert series['test_events_total{kind="x"}'] == 1
+    assert series['test_seconds_bucket{le="0.1"}'] == 1
+    assert series['test_seconds_bucket{le="1"}'] == 2
+    assert series['test_seconds_bucket{le="+Inf"}'] == 3
+    assert series["test_seconds_sum"] == 5.55
+    assert series["test_seconds_count"] == 3
+    assert series["test_depth"] == 7
+
+
+def test_failing_callback_and_unused_metric_are_skipped():
+    def broken():
+        raise LookupError("publisher not started")
+
+    metrics.gauge("test_broken", "Niedostępna", broken)
+    metrics.Counter("test_unused_total", "Bez wartości")
+
+    text = metrics.render_prometheus()
+
+    assert "test_broken" not in text
+    assert "test_unused_total" not in text
+
+
+def test_labels_must_match_labelnames():
+    counter = metrics.Counter("test_labeled_total", "Z etykietą", ("kind",))
+    with pytest.raises(ValueError, match="test_labeled_total"):
+        counter.labels("a", "b")
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(metrics_router.HttpMetricsMiddleware)
+    app.include_router(metrics_router.router)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    return app
+
+
+def test_middleware_records_route_template():
+    client = TestClient(_app())
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/nope")
+
+    series = _series(metrics.render_prometheus())
+
+    assert series['http_request_duration_seconds_count{method="GET",route="/items/{item_id}",status="200"}'] >= 2
+    assert series['http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}'] >= 1
+
+
+def test_metrics_endpoint_requires_token_when_configured(monkeypatch):
+    monkeypatch.setattr(metrics_router, "METRICS_TOKEN", "s3cret")
+    client = TestClient(_app())
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == metrics_router.PROMETHEUS_CONTENT_TYPE
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+
+
+def test_metric_without_render_cannot_be_created():
+    class Partial(metrics._Metric):
+        kind = "counter"
+
+        def _new_child(self):
+            return metrics._CounterChild()
+
+    with pytest.raises(TypeError, match="render"):
+        Partial("test_partial_total", "Bez render")
+    assert all(m.name != "test_partial_total" for m in metrics.REGISTRY)
+
+
+def test_callback_metric_rejects_labels():
+    depth = metrics.gauge("test_cb_depth", "Głębokość", lambda: 1, ("queue",))
+    with pytest.raises(TypeError, match="test_cb_depth"):
+        depth.labels("a")
+
+
+def test_alarm_debounce_counters_are_exported(monkeypatch):
+    monkeypatch.setattr(mqtt_listener, "_alarm_debouncer", None)
+    assert "alarm_digests_total" not in metrics.render_prometheus()
+
+    stats = {"received": 10, "passed": 2, "suppressed": 8, "digests": 1}
+    monkeypatch.setattr(mqtt_listener, "_alarm_debouncer", SimpleNamespace(stats=lambda: stats))
+    series = _series(metrics.render_prometheus())
+
+    assert series["alarm_debounce_suppressed_total"] == 8
+    assert series["alarm_digests_total"] == 1
+
+
+def test_password_hasher_times_and_rejections_are_exported(monkeypatch):
+    hasher = PasswordHasher(kind="thread", max_workers=1, max_queue=0)
+    monkeypatch.setattr(metrics_router, "password_hasher", hasher)
+    before = _series(metrics.render_prometheus())
+    hasher.start()
+
+    async def main():
+        # jedyny worker zajęty, kolejka zerowa - drugie żądanie odbite od razu
+        return await asyncio.gather(hasher.hash("secret"), hasher.hash("secret"), return_exceptions=True)
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        hasher.shutdown()
+    series = _series(metrics.render_prometheus())
+
+    assert isinstance(results[1], HashingBusy)
+    assert series["password_hash_rejected_total"] == 1
+    assert series["password_hash_waiting"] == 0
+    for stage in ("queue_wait", "hash"):
+        key = f'password_hash_duration_seconds_count{{stage="{stage}"}}'
+        assert series[key] - before.get(key, 0) == 1
+
+
+def test_tls_handshake_counters_are_exported(monkeypatch):
+    monkeypatch.setattr(mqtt_service, "_tls_context", None)
+    series = _series(metrics.render_prometheus())
+    assert (series["mqtt_tls_handshakes_total"], series["mqtt_tls_resumed_total"]) == (0, 0)
+
+    ctx = mqtt_service._ResumingSSLContext()
+    ctx.handshakes, ctx.resumed = 5, 4
+    monkeypatch.setattr(mqtt_service, "_tls_context", ctx)
+    series = _series(metrics.render_prometheus())
+
+    assert (series["mqtt_tls_handshakes_total"], series["mqtt_tls_resumed_total"]) == (5, 4)
+
+
+def test_device_cache_counters_are_exported(monkeypatch):
+    cache = DeviceCache(max_size=1, ttl=60)
+    monkeypatch.setattr(metrics_router, "device_cache", cache)
+    for hw_uid in ("a", "b"):
+        cache.put(CachedDevice(id_device=1, hw_uid=hw_uid, id_user=1, name=hw_uid, is_open=False, alarm_active=False))
+    cache.get("a")
+    cache.get("b")
+
+    series = _series(metrics.render_prometheus())
+
+    assert series["device_cache_hits_total"] == 1
+    assert series["device_cache_misses_total"] == 1
+    assert series["device_cache_evictions_total"] == 1
+    assert series["device_cache_size"] == 1
+
+
+def test_publisher_counters_and_latency_quantiles_are_exported(monkeypatch):
+    monkeypatch.setattr(mqtt_service, "_publisher", None)
+    assert "mqtt_publisher_published_total" not in metrics.render_prometheus()
+
+    stats = {
+        "published": 120, "failed": 3, "rejected": 2, "reconnects": 1, "queue_depth": 0,
+        "latency_ms": {"p50": 4.0, "p95": 12.5, "p99": 40.0, "max": 90.0},
+    }
+    monkeypatch.setattr(mqtt_service, "_publisher", SimpleNamespace(stats=lambda: stats))
+    text = metrics.render_prometheus()
+    series = _series(text)
+
+    assert (series["mqtt_publisher_published_total"], series["mqtt_publisher_failed_total"]) == (120, 3)
+    assert series["mqtt_publisher_rejected_total"] == 2
+    assert "# TYPE mqtt_publisher_latency_seconds gauge" in text
+    assert series['mqtt_publisher_latency_seconds{quantile="0.5"}'] == 0.004
+    assert series['mqtt_publisher_latency_seconds{quantile="0.95"}'] == 0.0125
+    assert series['mqtt_publisher_latency_seconds{quantile="0.99"}'] == 0.04
+
+
+def test_state_ingest_buffer_and_flushes_are_exported(monkeypatch):
+    stats = {"pending": 17, "flushes": 40, "failed_flushes": 1, "rows_written": 950}
+    monkeypatch.setattr(mqtt_listener, "_state_writer", SimpleNamespace(stats=lambda: stats))
+
+    series = _series(metrics.render_prometheus())
+
+    assert series["device_state_pending"] == 17
+    assert series["device_state_flushes_total"] == 40
+    assert series["device_state_flush_failures_total"] == 1
+    assert series["device_state_rows_written_total"] == 950
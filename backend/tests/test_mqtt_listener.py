@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src import mqtt_listener
+from src.mqtt_listener import subscription_topics
+
+
+def test_listener_mode_from_env(monkeypatch):
+    monkeypatch.setenv("LISTENER_MODE", " Off ")
+    assert mqtt_listener.default_listener_mode() == "off"
+
+    monkeypatch.setenv("LISTENER_MODE", "process")
+    with pytest.raises(RuntimeError, match="LISTENER_MODE"):
+        mqtt_listener.default_listener_mode()
+
+
+def _draining_listener(events: list[str]):
+    async def listen(hw_uid=None, session_factory=None):
+        events.append(f"started:{threading.current_thread().name}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # dokończenie pracy po anulowaniu (digesty, kolejka alarmów, zapis stanów)
+            await asyncio.sleep(0.01)
+            events.append("drained")
+
+    return listen
+
+
+def test_runner_task_mode_drains_on_stop(monkeypatch):
+    events: list[str] = []
+    monkeypatch.setattr(mqtt_listener, "listen_alarm_states", _draining_listener(events))
+
+    async def main():
+        runner = mqtt_listener.ListenerRunner("task")
+        runner.start()
+        await asyncio.sleep(0)
+        await runner.stop(5)
+
+    asyncio.run(main())
+
+    assert events == [f"started:{threading.current_thread().name}", "drained"]
+
+
+def test_runner_thread_mode_runs_listener_in_own_thread(monkeypatch):
+    events: list[str] = []
+    monkeypatch.setattr(mqtt_listener, "listen_alarm_states", _draining_listener(events))
+
+    async def main():
+        runner = mqtt_listener.ListenerRunner("thread")
+        runner.start()
+        while not events:
+            await asyncio.sleep(0.01)
+        await runner.stop(5)
+
+    asyncio.run(main())
+
+    assert events == ["started:mqtt-listener", "drained"]
+
+
+def test_runner_off_mode_starts_nothing(monkeypatch):
+    monkeypatch.setattr(mqtt_listener, "listen_alarm_states", None)
+
+    async def main():
+        runner = mqtt_listener.ListenerRunner("off")
+        runner.start()
+        await runner.stop(1)
+
+    asyncio.run(main())
+
+
+def test_share_prefix(monkeypatch):
+    monkeypatch.delenv("MQTT_SHARE_GROUP", raising=False)
+    assert mqtt_listener._share_prefix() == ""
+
+    monkeypatch.setenv("MQTT_SHARE_GROUP", " api ")
+    assert mqtt_listener._share_prefix() == "$share/api/"
+
+
+def test_partitions_split_devices_without_overlap(monkeypatch):
+    monkeypatch.setenv("LISTENER_PARTITIONS", "3")
+    partitions = []
+    for index in range(3):
+        monkeypatch.setenv("LISTENER_PARTITION", str(index))
+        partitions.append(mqtt_listener.load_partition())
+
+    devices = [f"dev-{i}" for i in range(300)]
+    owners = [[p.index for p in partitions if p.owns(dev)] for dev in devices]
+
+    # każde urządzenie ma dokładnie jedną instancję, każda instancja dostaje część urządzeń
+    assert all(len(o) == 1 for o in owners)
+    assert {o[0] for o in owners} == {0, 1, 2}
+
+
+def test_single_partition_is_disabled_and_index_is_validated(monkeypatch):
+    monkeypatch.setenv("LISTENER_PARTITIONS", "1")
+    assert mqtt_listener.load_partition() is None
+
+    monkeypatch.setenv("LISTENER_PARTITIONS", "4")
+    monkeypatch.setenv("LISTENER_PARTITION", "4")
+    with pytest.raises(RuntimeError, match="0..3"):
+        mqtt_listener.load_partition()
+
+
+def test_ack_subscription_covers_all_devices_when_listening_to_one(monkeypatch):
+    monkeypatch.delenv("CMD_ACK_ENABLED", raising=False)
+
+    topics = subscription_topics("ABC")
+
+    assert topics == ["doorlock/ABC/alarm/state", "doorlock/ABC/state", "doorlock/+/ack"]
+
+
+def test_ack_subscription_is_never_shared(monkeypatch):
+    monkeypatch.delenv("CMD_ACK_ENABLED", raising=False)
+
+    topics = subscription_topics(None, share="$share/api/", ingest_state=False)
+
+    assert topics == ["$share/api/doorlock/+/alarm/state", "doorlock/+/ack"]
+
+
+def test_ack_subscription_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("CMD_ACK_ENABLED", "0")
+
+    assert subscription_topics(None) == ["doorlock/+/alarm/state", "doorlock/+/state"]
+
+
+def test_runner_stop_waits_for_task_after_deadline(monkeypatch):
+    state = {}
+
+    async def slow_drain(hw_uid=None, session_factory=None):
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # dokańczanie dłuższe niż deadline - przerywa je dopiero drugie anulowanie
+            try:
+                await asyncio.sleep(10)
+            finally:
+                state["finished_at"] = time.monotonic()
+
+    monkeypatch.setattr(mqtt_listener, "listen_alarm_states", slow_drain)
+
+    async def main():
+        runner = mqtt_listener.ListenerRunner("task", cancel_grace=1.0)
+        runner.start()
+        await asyncio.sleep(0)
+        assert not runner.done
+        started = time.monotonic()
+        await runner.stop(0.1)
+        return started, time.monotonic(), runner
+
+    started, stopped, runner = asyncio.run(main())
+
+    # zadanie skończyło się, zanim stop() oddał sterowanie (teardown DB/SMTP dopiero potem)
+    assert started < state["finished_at"] <= stopped
+    assert stopped - started < 1.0
+    assert runner.done
+
+
+def test_runner_wait_returns_when_listener_fails(monkeypatch):
+    async def broken(hw_uid=None, session_factory=None):
+        raise RuntimeError("Brak zmiennej środowiskowej: MQTT_HOST")
+
+    monkeypatch.setattr(mqtt_listener, "listen_alarm_states", broken)
+
+    async def main():
+        runner = mqtt_listener.ListenerRunner("task")
+        runner.start()
+        await asyncio.wait_for(runner.wait(), timeout=1)
+        return runner.done
+
+    assert asyncio.run(main()) is True
@@ -0,0 +1,174 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+from aiomqtt import MqttError
+
+from src import mqtt_service
+from src.metrics import MQTT_PUBLISH_SECONDS
+from src.mqtt_publisher import MqttPublisher
+
+
+class FakeClient:
+    """Połączenie MQTT zastępujące aiomqtt.Client; zachowanie publish() ustawia test."""
+
+    def __init__(self, broker: "FakeBroker") -> None:
+        self.broker = broker
+
+    async def __aenter__(self) -> "FakeClient":
+        if self.broker.refuse_connects > 0:
+            self.broker.refuse_connects -= 1
+            raise MqttError("connection refused")
+        self.broker.connections += 1
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        return None
+
+    async def publish(self, topic: str, payload: str, qos: int = 1, timeout: float = 10) -> None:
+        await self.broker.on_publish(self, topic, payload)
+
+
+class FakeBroker:
+    def __init__(self) -> None:
+        self.connections = 0
+        self.refuse_connects = 0
+        self.delivered: list[tuple[int, str, str]] = []  # (nr połączenia, topic, payload)
+        self.break_on: set[str] = set()
+        self.publisher: MqttPublisher | None = None
+        self.during_break: list[str] = []
+
+    async def on_publish(self, client: FakeClient, topic: str, payload: str) -> None:
+        if payload in self.break_on:
+            self.break_on.discard(payload)
+            # wiadomości wysłane w chwili zerwania połączenia
+            for extra in self.during_break:
+                self.publisher.submit("doorlock/dev/cmd", extra)
+            raise MqttError("connection lost")
+        self.delivered.append((self.connections, topic, payload))
+
+
+def _make_publisher(broker: FakeBroker, **kwargs) -> MqttPublisher:
+    kwargs.setdefault("reconnect_delay", 0.01)
+    publisher = MqttPublisher(lambda: FakeClient(broker), **kwargs)
+    broker.publisher = publisher
+    publisher.start()
+    return publisher
+
+
+def test_publish_is_confirmed_and_reuses_connection():
+    broker = FakeBroker()
+    publisher = _make_publisher(broker)
+    try:
+        futures = [publisher.submit("doorlock/dev/cmd", str(i)) for i in range(20)]
+        for f in futures:
+            f.result(timeout=2)
+    finally:
+        publisher.stop()
+
+    assert broker.connections == 1
+    assert sorted(p for _, _, p in broker.delivered) == sorted(str(i) for i in range(20))
+    assert publisher.stats()["published"] == 20
+
+
+def test_connection_loss_fails_inflight_and_delivers_rest_after_reconnect():
+    broker = FakeBroker()
+    broker.break_on = {"boom"}
+    broker.during_break = ["after-1", "after-2"]
+    publisher = _make_publisher(broker, max_inflight=1)
+    try:
+        lost = publisher.submit("doorlock/dev/cmd", "boom")
+        with pytest.raises(MqttError):
+            lost.result(timeout=2)
+
+        deadline = time.monotonic() + 2
+        while len(broker.delivered) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        publisher.stop()
+
+    # wiadomości z chwili zerwania (kolejka albo carry-over) idą raz, na nowym połączeniu
+    assert [p for _, _, p in broker.delivered] == ["after-1", "after-2"]
+    assert all(conn == 2 for conn, _, _ in broker.delivered)
+    assert publisher.stats()["reconnects"] >= 1
+
+
+def test_queued_message_waits_for_reconnect_until_deadline():
+    broker = FakeBroker()
+    broker.refuse_connects = 3
+    publisher = _make_publisher(broker, publish_timeout=2.0)
+    try:
+        publisher.submit("doorlock/dev/cmd", "late").result(timeout=3)
+    finally:
+        publisher.stop()
+
+    assert broker.delivered == [(1, "doorlock/dev/cmd", "late")]
+    assert publisher.stats()["reconnects"] == 3
+
+
+def test_queued_message_expires_when_broker_stays_down():
+    broker = FakeBroker()
+    broker.refuse_connects = 10_000
+    publisher = _make_publisher(broker, publish_timeout=0.05)
+    try:
+        with pytest.raises(TimeoutError):
+            publisher.submit("doorlock/dev/cmd", "never").result(timeout=2)
+    finally:
+        publisher.stop()
+
+    assert broker.delivered == []
+
+
+def test_submit_after_stop_fails_fast():
+    publisher = _make_publisher(FakeBroker())
+    publisher.stop()
+
+    with pytest.raises(RuntimeError, match="not running"):
+        publisher.submit("doorlock/dev/cmd", "x").result(timeout=1)
+
+
+def test_publish_from_caller_loop():
+    broker = FakeBroker()
+    publisher = _make_publisher(broker)
+    try:
+        asyncio.run(publisher.publish("doorlock/dev/cmd", "1"))
+    finally:
+        publisher.stop()
+
+    assert broker.delivered == [(1, "doorlock/dev/cmd", "1")]
+
+
+def test_batch_publish_times_each_message_separately(monkeypatch):
+    # PUBACK po różnym czasie: szybki od razu, wolny po 0.3 s, jeden błąd
+    delays = {"fast": 0.0, "slow": 0.3, "broken": 0.0}
+
+    class StubPublisher:
+        def submit(self, topic, payload, qos=1):
+            future = concurrent.futures.Future()
+            hw_uid = topic.split("/")[1]
+
+            def resolve():
+                if hw_uid == "broken":
+                    future.set_exception(RuntimeError("timeout"))
+                else:
+                    future.set_result(None)
+
+            threading.Timer(delays[hw_uid], resolve).start()
+            return future
+
+    monkeypatch.setattr(mqtt_service, "get_publisher", lambda: StubPublisher())
+    histogram = MQTT_PUBLISH_SECONDS.labels("alarm")
+    cumulative, sum_before = histogram.snapshot()
+    count_before = cumulative[-1]
+
+    errors = asyncio.run(mqtt_service.publish_many_to_devices(
+        [("fast", "1"), ("slow", "1"), ("broken", "1")], channel="alarm",
+    ))
+
+    cumulative, total = histogram.snapshot()
+    assert [e is None for e in errors] == [True, True, False]
+    assert cumulative[-1] - count_before == 2
+    # czas całej paczki dla obu dałby ~0.6 s
+    assert 0.3 <= total - sum_before < 0.45
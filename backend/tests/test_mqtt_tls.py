@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from src import mqtt_service
+
+
+@pytest.fixture
+def tls_files(tmp_path, monkeypatch):
+    paths = {}
+    for name in ("ca", "cert", "key"):
+        path = tmp_path / f"{name}.pem"
+        path.write_text(name)
+        paths[name] = path
+    monkeypatch.setenv("MQTT_TLS_CA", str(paths["ca"]))
+    monkeypatch.setenv("MQTT_TLS_CERT", str(paths["cert"]))
+    monkeypatch.setenv("MQTT_TLS_KEY", str(paths["key"]))
+    monkeypatch.delenv("MQTT_TLS_KEY_PASSWORD", raising=False)
+    monkeypatch.delenv("MQTT_TLS", raising=False)
+
+    loads = []
+
+    def _fake_load(ca_path, cert_path, key_path, key_password):
+        ctx = object()
+        loads.append(ctx)
+        return ctx
+
+    monkeypatch.setattr(mqtt_service, "_load_tls_context", _fake_load)
+    monkeypatch.setattr(mqtt_service, "_tls_context", None)
+    monkeypatch.setattr(mqtt_service, "_tls_key", None)
+    return paths, loads
+
+
+def _touch(path, ns_offset: int) -> None:
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + ns_offset))
+
+
+def test_context_is_built_once_while_files_unchanged(tls_files):
+    _, loads = tls_files
+
+    first = mqtt_service.build_tls_context()
+    assert mqtt_service.build_tls_context() is first
+    assert mqtt_service.mqtt_tls_context() is first
+    assert len(loads) == 1
+
+
+@pytest.mark.parametrize("changed", ["ca", "cert", "key"])
+def test_changed_file_mtime_reloads_context(tls_files, changed):
+    paths, loads = tls_files
+
+    first = mqtt_service.build_tls_context()
+    _touch(paths[changed], 1_000_000_000)
+    second = mqtt_service.build_tls_context()
+
+    assert second is not first
+    assert mqtt_service.build_tls_context() is second
+    assert len(loads) == 2
+
+
+def test_key_password_change_reloads_context(tls_files, monkeypatch):
+    _, loads = tls_files
+
+    first = mqtt_service.build_tls_context()
+    monkeypatch.setenv("MQTT_TLS_KEY_PASSWORD", "new")
+
+    assert mqtt_service.build_tls_context() is not first
+    assert len(loads) == 2
+
+
+def test_tls_disabled_returns_none(tls_files, monkeypatch):
+    _, loads = tls_files
+    monkeypatch.setenv("MQTT_TLS", "0")
+
+    assert mqtt_service.mqtt_tls_context() is None
+    assert loads == []
+
+
+def test_missing_file_fails_instead_of_using_stale_context(tls_files):
+    paths, _ = tls_files
+
+    mqtt_service.build_tls_context()
+    paths["cert"].unlink()
+
+    with pytest.raises(FileNotFoundError):
+        mqtt_service.build_tls_context()
@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import time
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from src.auth.principal_cache import Principal, PrincipalCache, principal_cache
+from src.auth.security import create_access_token
+from src.db import AsyncSessionLocal, SessionLocal, init_db
+from src.models import User
+from src.routers.router import get_current_user
+
+_seq = itertools.count()
+
+
+def _principal(id_user: int = 1) -> Principal:
+    return Principal(
+        id_user=id_user,
+        username=f"u{id_user}",
+        email=f"u{id_user}@example.com",
+        nr_telefonu=None,
+        created_at=datetime.now(timezone.utc),
+    )
+
+
+def _claims(exp_in: float = 60) -> dict:
+    return {"sub": "1", "exp": time.time() + exp_in}
+
+
+def test_hit_until_token_exp(monkeypatch):
+    cache = PrincipalCache()
+    now = [time.time()]
+    monkeypatch.setattr("src.auth.principal_cache.time.time", lambda: now[0])
+    cache.put("t", {"exp": now[0] + 10}, _principal(), cache.epoch(1))
+
+    assert cache.get("t")[1].id_user == 1
+    now[0] += 11
+    assert cache.get("t") is None
+
+
+def test_revoke_user_invalidates_all_tokens_of_user():
+    cache = PrincipalCache()
+    cache.put("a", _claims(), _principal(1), cache.epoch(1))
+    cache.put("b", _claims(), _principal(1), cache.epoch(1))
+    cache.put("c", _claims(), _principal(2), cache.epoch(2))
+    cache.revoke_user(1)
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_put_with_stale_epoch_is_ignored():
+    cache = PrincipalCache()
+    epoch = cache.epoch(1)  # odczyt epoki przed odczytem usera z bazy
+    cache.revoke_user(1)  # w międzyczasie logout_all
+    cache.put("t", _claims(), _principal(1), epoch)
+
+    assert cache.get("t") is None
+
+
+def test_token_without_exp_is_not_cached():
+    cache = PrincipalCache()
+    cache.put("t", {"sub": "1"}, _principal(), cache.epoch(1))
+    assert cache.get("t") is None
+
+
+def test_lru_limit():
+    cache = PrincipalCache(max_size=2)
+    for token in ("a", "b", "c"):
+        cache.put(token, _claims(), _principal(), cache.epoch(1))
+
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 2
+
+
+@pytest.fixture
+def user():
+    init_db()
+    n = next(_seq)
+    with SessionLocal() as session:
+        user = User(username=f"principal{n}", email=f"principal{n}@example.com", password_hash="x")
+        session.add(user)
+        session.commit()
+        yield session, user
+
+
+async def _current_user(token: str, db=None) -> Principal:
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    if db is not None:
+        return await get_current_user(creds, db)
+    async with AsyncSessionLocal() as session:
+        return await get_current_user(creds, session)
+
+
+def test_get_current_user_serves_repeat_requests_from_cache(user):
+    _, u = user
+    token = create_access_token(u.id_user)
+
+    first = asyncio.run(_current_user(token))
+    # bez sesji DB: drugi request nie może sięgnąć do bazy
+    second = asyncio.run(_current_user(token, db=object()))
+
+    assert first == second
+    assert first.email == u.email
+
+
+def test_orm_user_change_revokes_cached_principal(user):
+    session, u = user
+    token = create_access_token(u.id_user)
+    asyncio.run(_current_user(token))
+
+    u.email = f"changed-{u.email}"
+    session.commit()
+
+    assert principal_cache.get(token) is None
+    assert asyncio.run(_current_user(token)).email == u.email
+
+
+def test_invalid_token_is_rejected():
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_current_user("not-a-jwt", db=object()))
+    assert exc.value.status_code == 401
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from src.auth.rate_limit import LoginRateLimiter, MemoryBucketStore, RateLimitStore, _load_store_factory
+
+
+def _limiter(**kwargs) -> LoginRateLimiter:
+    return LoginRateLimiter(MemoryBucketStore, **kwargs)
+
+
+def _attempts(limiter: LoginRateLimiter, n: int, login: str = "alice", ip: str = "10.0.0.1") -> list[float]:
+    async def main():
+        return [await limiter.check(login, ip) for _ in range(n)]
+    return asyncio.run(main())
+
+
+def test_login_bucket_rejects_after_burst_with_retry_after():
+    waits = _attempts(_limiter(login_per_min=6, login_burst=3), 4)
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(10.0, abs=0.1)  # 6/min -> token co 10 s
+
+
+def test_login_key_is_case_insensitive():
+    limiter = _limiter(login_per_min=1, login_burst=1)
+
+    async def main():
+        return await limiter.check("Alice", "10.0.0.1"), await limiter.check(" alice ", "10.0.0.2")
+
+    first, second = asyncio.run(main())
+    assert first == 0.0
+    assert second > 0
+
+
+def test_rejected_ip_does_not_use_login_budget():
+    limiter = _limiter(ip_per_min=1, ip_burst=1, login_per_min=1, login_burst=2)
+
+    async def main():
+        return [
+            await limiter.check("alice", "10.0.0.1"),
+            await limiter.check("alice", "10.0.0.1"),  # odbita przez kubełek IP
+            await limiter.check("alice", "10.0.0.2"),  # drugi token loginu nadal jest
+        ]
+
+    first, blocked, other_ip = asyncio.run(main())
+    assert first == 0.0
+    assert blocked > 0
+    assert other_ip == 0.0
+    assert limiter.stats()["rejected_ip"] == 1
+    assert limiter.stats()["rejected_login"] == 0
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"login_per_min": 0},
+    {"login_burst": 0},
+])
+def test_zero_rate_or_burst_disables_bucket(kwargs):
+    # IP z dużym limitem, żeby odrzucać mógł tylko kubełek loginu
+    limiter = _limiter(ip_per_min=6000, ip_burst=1000, **kwargs)
+
+    assert all(w == 0.0 for w in _attempts(limiter, 50))
+
+
+def test_zero_ip_rate_still_limits_login():
+    waits = _attempts(_limiter(ip_per_min=0, login_per_min=6, login_burst=2), 3)
+    assert waits[2] > 0
+
+
+@pytest.mark.parametrize("kwargs", [{"ip_per_min": -1}, {"login_burst": -5}])
+def test_negative_values_are_rejected_at_construction(kwargs):
+    with pytest.raises(RuntimeError):
+        _limiter(**kwargs)
+
+
+def test_store_without_take_fails_at_construction():
+    class NoTakeStore(RateLimitStore):
+        def size(self) -> int:
+            return 0
+
+    with pytest.raises(TypeError, match="take"):
+        LoginRateLimiter(NoTakeStore)
+
+
+def test_store_spec_must_name_a_rate_limit_store():
+    assert _load_store_factory("src.auth.rate_limit:MemoryBucketStore") is MemoryBucketStore
+
+    with pytest.raises(RuntimeError, match="LOGIN_RATE_STORE"):
+        _load_store_factory("collections:OrderedDict")
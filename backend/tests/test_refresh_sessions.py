@@ -0,0 +1,82 @@
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import inspect, select, text
+
+from src.auth import refresh_sessions
+from src.auth.refresh_sessions import RefreshSessionCompactor, add_refresh_session
+from src.db import AsyncSessionLocal, SessionLocal, drop_obsolete_indexes, engine, init_db
+from src.models import RefreshSession, User
+
+_seq = itertools.count()
+
+
+def _user() -> tuple[int, int]:
+    init_db()
+    n = next(_seq)
+    with SessionLocal() as session:
+        user = User(username=f"sessions{n}", email=f"sessions{n}@example.com", password_hash="x")
+        session.add(user)
+        session.commit()
+        return user.id_user, n
+
+
+def test_init_db_drops_replaced_user_index():
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX ix_refresh_sessions_id_user ON refresh_sessions (id_user)"))
+
+    init_db()
+
+    names = {ix["name"] for ix in inspect(engine).get_indexes("refresh_sessions")}
+    assert "ix_refresh_sessions_id_user" not in names
+    assert "ix_refresh_sessions_user_revoked" in names
+    assert drop_obsolete_indexes() == []
+
+
+def test_session_cap_revokes_oldest_live_sessions(monkeypatch):
+    monkeypatch.setattr(refresh_sessions, "MAX_SESSIONS_PER_USER", 3)
+    id_user, n = _user()
+    expires = datetime.now(timezone.utc) + timedelta(days=1)
+
+    async def main():
+        for i in range(5):
+            async with AsyncSessionLocal() as db:
+                await add_refresh_session(db, id_user, f"cap-{n}-{i}", expires)
+                await db.commit()
+
+    asyncio.run(main())
+
+    with SessionLocal() as session:
+        live = session.scalars(
+            select(RefreshSession.token_hash)
+            .where(RefreshSession.id_user == id_user, RefreshSession.revoked_at.is_(None))
+            .order_by(RefreshSession.id_session)
+        ).all()
+    assert live == [f"cap-{n}-{i}" for i in (2, 3, 4)]
+
+
+def test_compactor_removes_expired_and_revoked_in_chunks():
+    id_user, n = _user()
+    now = datetime.now(timezone.utc)
+    with SessionLocal() as session:
+        for i in range(7):
+            session.add(RefreshSession(
+                id_user=id_user, token_hash=f"expired-{n}-{i}", expires_at=now - timedelta(days=1),
+            ))
+        for i in range(3):
+            session.add(RefreshSession(
+                id_user=id_user, token_hash=f"revoked-{n}-{i}",
+                expires_at=now + timedelta(days=1), revoked_at=now - timedelta(hours=1),
+            ))
+        session.add(RefreshSession(id_user=id_user, token_hash=f"live-{n}", expires_at=now + timedelta(days=1)))
+        session.commit()
+
+    compactor = RefreshSessionCompactor(chunk=4)
+    asyncio.run(compactor.compact(AsyncSessionLocal))
+
+    with SessionLocal() as session:
+        left = session.scalars(select(RefreshSession.token_hash).where(RefreshSession.id_user == id_user)).all()
+    assert left == [f"live-{n}"]
+    assert compactor.stats()["last_purged"] >= 10
@@ -0,0 +1,72 @@
+import asyncio
+import itertools
+
+import pytest
+
+from src.db import AsyncSessionLocal, SessionLocal, init_db
+from src.models import Device
+from src.state_ingest import StateWriteBehind, parse_door_state
+
+_seq = itertools.count()
+
+
+@pytest.mark.parametrize("payload, expected", [
+    ("1", True), ("open", True), (" OPENED ", True),
+    ("0", False), ("closed", False), ("close", False),
+    ("ajar", None), ("", None),
+])
+def test_parse_door_state(payload, expected):
+    assert parse_door_state(payload) is expected
+
+
+@pytest.fixture
+def closed_device():
+    init_db()
+    with SessionLocal() as session:
+        device = Device(name="lock", hw_uid=f"ingest-dev-{next(_seq)}", is_open=False)
+        session.add(device)
+        session.commit()
+        yield session, device
+
+
+def test_only_changes_are_reported_as_changes(closed_device):
+    _, device = closed_device
+
+    async def main():
+        writer = StateWriteBehind(AsyncSessionLocal, flush_interval=60)
+        writer.start()
+        await asyncio.sleep(0.05)  # ostatnie stany z bazy
+        reports = [writer.offer(device.hw_uid, state) for state in (False, False, True, True, False)]
+        await writer.stop()
+        return reports, writer.stats()
+
+    reports, stats = asyncio.run(main())
+
+    # pierwszy raport "closed" = stan z bazy, więc to nie zmiana
+    assert reports == [False, False, True, False, True]
+    assert stats["unchanged"] == 3
+
+
+def test_device_unknown_before_load_is_a_change():
+    writer = StateWriteBehind(AsyncSessionLocal)
+
+    assert writer.offer("never-seen", False) is True
+    assert writer.offer("never-seen", False) is False
+
+
+def test_reports_are_coalesced_and_written_once(closed_device):
+    session, device = closed_device
+
+    async def main():
+        writer = StateWriteBehind(AsyncSessionLocal, flush_interval=60)
+        for state in (True, False, True):
+            writer.offer(device.hw_uid, state)
+        await writer.flush()
+        return writer.stats()
+
+    stats = asyncio.run(main())
+    session.refresh(device)
+
+    assert device.is_open is True
+    assert stats["coalesced"] == 2
+    assert stats["rows_written"] == 1